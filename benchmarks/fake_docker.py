@@ -0,0 +1,768 @@
+import os
+import re
+import json
+import time
+import queue
+import select
+import socket
+import hashlib
+import argparse
+import threading
+import itertools
+import socketserver
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Latencies in seconds, every request waits for "request" and streams wait for their step
+DEFAULT_LATENCIES = {
+    "request": 0.0,
+    "build_step": 0.0,
+    "pull_chunk": 0.0,
+    "push_chunk": 0.0,
+    "start": 0.0,
+}
+
+
+class State(object):
+    """
+        Containers, images, networks and registry content of fake docker, shared by docker and registry servers
+    """
+
+    def __init__(self, layers=3, layer_size=8 * 1024 * 1024, steps=5, build_steps=6, latencies=None):
+        """
+        :param layers: Number of layers of pulled and pushed images
+        :param layer_size: Size of layer in bytes
+        :param steps: Number of progress messages per layer
+        :param build_steps: Number of steps of every build
+        :param latencies: Dict of latencies, see DEFAULT_LATENCIES
+        """
+        self.layers = layers
+        self.layer_size = layer_size
+        self.steps = steps
+        self.build_steps = build_steps
+        self.latencies = dict(DEFAULT_LATENCIES, **(latencies or {}))
+
+        self.lock = threading.RLock()
+        self.subscribers = []
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.containers = {}
+            self.images = set()
+            self.networks = {}
+            self.registry = set()
+            self.requests = {}
+            self.received = 0
+            self.ids = itertools.count(1)
+
+    def count(self, name):
+        with self.lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": dict(self.requests),
+                "containers": len(self.containers),
+                "images": len(self.images),
+                "received_bytes": self.received,
+            }
+
+    def sleep(self, name):
+        latency = self.latencies.get(name, 0)
+
+        if latency:
+            time.sleep(latency)
+
+    def create_id(self):
+        return hashlib.sha256(str(next(self.ids)).encode("utf-8")).hexdigest()
+
+    def publish(self, container, action):
+        event = {
+            "status": action,
+            "id": container.get("Id"),
+            "Type": "container",
+            "Action": action,
+            "Actor": {"ID": container.get("Id"), "Attributes": dict(container.get("Labels") or {})},
+            "time": int(time.time()),
+        }
+
+        with self.lock:
+            for subscriber in self.subscribers:
+                subscriber.put(event)
+
+    def find(self, container_id):
+        with self.lock:
+            if container_id in self.containers:
+                return self.containers[container_id]
+
+            for container in self.containers.values():
+                if container_id in (container.get("Id")[:12], container.get("Name")):
+                    return container
+
+        return None
+
+
+class DockerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+        Stand-in for docker engine API listening on unix socket, implements requests made by tower
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, state):
+        """
+        :param path: Path of unix socket
+        :param state: Shared State
+        """
+        self.path = path
+        self.state = state
+
+        if os.path.exists(path):
+            os.remove(path)
+
+        super().__init__(path, DockerHandler)
+
+    def server_close(self):
+        super().server_close()
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class DockerHandler(BaseHTTPRequestHandler):
+    """
+        Docker engine API, version prefix of path is ignored
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    VERSION = re.compile(r'^/v[0-9.]+')
+    CONTAINER = re.compile(r'^/containers/(?P<id>[^/]+)(?P<action>/[a-z]+)?$')
+    IMAGE = re.compile(r'^/images/(?P<name>.+?)(?P<action>/json|/push|/tag)$')
+
+    def address_string(self):
+        return "unix"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+    def dispatch(self, method):
+        url = urlsplit(self.path)
+        path = self.VERSION.sub('', unquote(url.path))
+        self.query = dict((key, values[-1]) for key, values in parse_qs(url.query).items())
+        self.body = self.read_body()
+        state = self.server.state
+
+        state.sleep("request")
+
+        if path.startswith("/_"):
+            return self.control(method, path)
+
+        if method == "GET" and path == "/version":
+            state.count("version")
+            return self.send_json(200, {"ApiVersion": "1.24", "Version": "1.12.6", "MinAPIVersion": "1.12"})
+
+        if method == "POST" and path == "/auth":
+            state.count("auth")
+            return self.send_json(200, {"Status": "Login Succeeded"})
+
+        if method == "GET" and path == "/events":
+            state.count("events")
+            return self.events()
+
+        if path == "/networks" and method == "GET":
+            state.count("networks")
+            return self.networks()
+
+        if path == "/networks/create" and method == "POST":
+            state.count("network_create")
+            return self.create_network()
+
+        if path == "/containers/json" and method == "GET":
+            state.count("containers")
+            return self.containers()
+
+        if path == "/containers/create" and method == "POST":
+            state.count("container_create")
+            return self.create_container()
+
+        if path == "/build" and method == "POST":
+            state.count("build")
+            return self.build()
+
+        if path == "/images/create" and method == "POST":
+            state.count("pull")
+            return self.pull()
+
+        match = self.CONTAINER.match(path)
+        if match:
+            return self.container(method, match.group("id"), (match.group("action") or '').lstrip("/"))
+
+        match = self.IMAGE.match(path)
+        if match:
+            return self.image(method, match.group("name"), match.group("action").lstrip("/"))
+
+        self.send_json(404, {"message": "page not found"})
+
+    def read_body(self):
+        """
+        Read body of request, build context is sent with chunked encoding
+        :return: Returns bytes
+        """
+        if self.headers.get("Transfer-Encoding", '').lower() == "chunked":
+            size = 0
+
+            while True:
+                length = int(self.rfile.readline().strip().split(b";")[0], 16)
+                if length == 0:
+                    self.rfile.readline()
+                    break
+
+                size += len(self.rfile.read(length))
+                self.rfile.readline()
+
+            with self.server.state.lock:
+                self.server.state.received += size
+
+            return b''
+
+        length = int(self.headers.get("Content-Length", 0) or 0)
+        return self.rfile.read(length) if length else b''
+
+    def get_json(self):
+        return json.loads(self.body.decode("utf-8")) if self.body else {}
+
+    def get_filters(self):
+        filters = json.loads(self.query.get("filters", "{}") or "{}")
+
+        # Filters are lists or dicts of values
+        return dict((key, list(value) if isinstance(value, (list, dict)) else [value])
+                    for key, value in filters.items())
+
+    def control(self, method, path):
+        """
+        Control API of benchmark, /_stats returns request counts and /_reset clears state
+        """
+        if path == "/_stats":
+            return self.send_json(200, self.server.state.stats())
+
+        if path == "/_reset" and method == "POST":
+            self.server.state.reset()
+            return self.send_json(200, {})
+
+        self.send_json(404, {"message": "page not found"})
+
+    def networks(self):
+        names = self.get_filters().get("name", [])
+
+        with self.server.state.lock:
+            networks = [network for name, network in self.server.state.networks.items() if not names or name in names]
+
+        self.send_json(200, networks)
+
+    def create_network(self):
+        data = self.get_json()
+        network = {"Name": data.get("Name"), "Id": self.server.state.create_id(), "Labels": data.get("Labels") or {}}
+
+        with self.server.state.lock:
+            self.server.state.networks[data.get("Name")] = network
+
+        self.send_json(201, {"Id": network.get("Id"), "Warning": ""})
+
+    def containers(self):
+        filters = self.get_filters()
+        show_all = self.query.get("all") in ("1", "True", "true")
+
+        with self.server.state.lock:
+            containers = list(self.server.state.containers.values())
+
+        result = []
+        for container in containers:
+            if not show_all and not container["State"]["Running"]:
+                continue
+            if filters.get("id") and not any(container["Id"].startswith(value) for value in filters.get("id")):
+                continue
+            if not all(self.match_label(container, label) for label in filters.get("label", [])):
+                continue
+
+            result.append(self.format_container(container))
+
+        self.send_json(200, result)
+
+    @staticmethod
+    def match_label(container, label):
+        key, _, value = label.partition("=")
+        labels = container.get("Labels") or {}
+
+        return key in labels and (not value or labels.get(key) == value)
+
+    @staticmethod
+    def format_container(container):
+        running = container["State"]["Running"]
+
+        return {
+            "Id": container["Id"],
+            "Names": ["/" + container["Name"]],
+            "Image": container["Image"],
+            "Labels": container["Labels"],
+            "State": "running" if running else container["State"]["Status"],
+            "Status": "Up 1 second" if running else (
+                "Created" if container["State"]["Status"] == "created" else "Exited (0) 1 second ago"
+            ),
+            "HostConfig": {"NetworkMode": container["HostConfig"].get("NetworkMode", "default")},
+            "NetworkSettings": container["NetworkSettings"],
+        }
+
+    def create_container(self):
+        data = self.get_json()
+        state = self.server.state
+        name = self.query.get("name") or ''
+
+        with state.lock:
+            if name and any(container["Name"] == name for container in state.containers.values()):
+                return self.send_json(409, {"message": "Conflict. The name \"/{name}\" is already in use".format(
+                    name=name)})
+
+            container_id = state.create_id()
+            address = "172.17.{high}.{low}".format(high=len(state.containers) // 250, low=len(state.containers) % 250 + 2)
+            network_mode = (data.get("HostConfig") or {}).get("NetworkMode") or "default"
+
+            container = {
+                "Id": container_id,
+                "Name": name or container_id[:12],
+                "Image": data.get("Image", ''),
+                "Labels": data.get("Labels") or {},
+                "State": {"Status": "created", "Running": False, "ExitCode": 0},
+                "Config": {"Env": data.get("Env") or [], "Labels": data.get("Labels") or {},
+                           "Image": data.get("Image", '')},
+                "HostConfig": data.get("HostConfig") or {},
+                "NetworkSettings": {"IPAddress": address, "Networks": {network_mode: {"IPAddress": address}}},
+            }
+            state.containers[container_id] = container
+
+        state.publish(container, "create")
+        self.send_json(201, {"Id": container_id, "Warnings": None})
+
+    def container(self, method, container_id, action):
+        state = self.server.state
+        container = state.find(container_id)
+        state.count("container_" + (action or method.lower()))
+
+        if container is None:
+            return self.send_json(404, {"message": "No such container: {id}".format(id=container_id)})
+
+        if method == "GET" and action == "json":
+            with state.lock:
+                inspection = dict(container, Name="/" + container["Name"])
+            return self.send_json(200, inspection)
+
+        if method == "POST" and action == "start":
+            state.sleep("start")
+            with state.lock:
+                container["State"] = {"Status": "running", "Running": True, "ExitCode": 0}
+            state.publish(container, "start")
+            return self.send_empty(204)
+
+        if method == "POST" and action in ("stop", "kill"):
+            with state.lock:
+                container["State"] = {"Status": "exited", "Running": False, "ExitCode": 0}
+            state.publish(container, "die")
+            state.publish(container, "stop")
+            return self.send_empty(204)
+
+        if method == "POST" and action == "rename":
+            with state.lock:
+                container["Name"] = self.query.get("name", container["Name"])
+            state.publish(container, "rename")
+            return self.send_empty(204)
+
+        if method == "DELETE" and not action:
+            with state.lock:
+                state.containers.pop(container["Id"], None)
+            state.publish(container, "destroy")
+            return self.send_empty(204)
+
+        self.send_json(404, {"message": "page not found"})
+
+    def image(self, method, name, action):
+        state = self.server.state
+        state.count("image_" + action)
+
+        if method == "GET" and action == "json":
+            image = self.normalize(name)
+
+            with state.lock:
+                exists = image in state.images
+                pushed = image in state.registry
+
+            if not exists:
+                return self.send_json(404, {"message": "No such image: {name}".format(name=name)})
+
+            # Images known to registry have digest of their manifest
+            digests = ["{repository}@{digest}".format(repository=image.rsplit(":", 1)[0],
+                                                      digest=self.get_digest(image))] if pushed else []
+
+            return self.send_json(200, {"Id": "sha256:" + hashlib.sha256(name.encode("utf-8")).hexdigest(),
+                                        "RepoTags": [image], "RepoDigests": digests})
+
+        if method == "POST" and action == "tag":
+            with state.lock:
+                if self.normalize(name) not in state.images:
+                    return self.send_json(404, {"message": "No such image: {name}".format(name=name)})
+
+                state.images.add("{repo}:{tag}".format(repo=self.query.get("repo"),
+                                                       tag=self.query.get("tag") or "latest"))
+
+            return self.send_empty(201)
+
+        if method == "POST" and action == "push":
+            return self.push(name, self.query.get("tag") or "latest")
+
+        self.send_json(404, {"message": "page not found"})
+
+    @staticmethod
+    def get_digest(image):
+        return "sha256:" + hashlib.sha256(image.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def normalize(name):
+        return name if ":" in name.rsplit("/", 1)[-1] else name + ":latest"
+
+    def build(self):
+        state = self.server.state
+        tag = self.query.get("t", '')
+        self.start_stream()
+
+        for step in range(1, state.build_steps + 1):
+            state.sleep("build_step")
+            self.send_chunk({"stream": "Step {step}/{count} : RUN step {step}\n".format(step=step,
+                                                                                      count=state.build_steps)})
+            self.send_chunk({"stream": " ---> {id}\n".format(id=state.create_id()[:12])})
+
+        image_id = state.create_id()[:12]
+        self.send_chunk({"stream": "Successfully built {id}\n".format(id=image_id)})
+
+        if tag:
+            with state.lock:
+                state.images.add(self.normalize(tag))
+
+        self.end_stream()
+
+    def pull(self):
+        state = self.server.state
+        image = "{name}:{tag}".format(name=self.query.get("fromImage", ''), tag=self.query.get("tag") or "latest")
+        self.start_stream()
+
+        self.send_chunk({"status": "Pulling from {name}".format(name=self.query.get("fromImage", '')),
+                         "id": self.query.get("tag") or "latest"})
+
+        for layer, step in self.progress():
+            state.sleep("pull_chunk")
+            self.send_chunk({"status": "Downloading", "id": layer,
+                             "progressDetail": {"current": step, "total": state.layer_size},
+                             "progress": "{current}/{total}".format(current=step, total=state.layer_size)})
+
+        for layer in self.get_layers():
+            self.send_chunk({"status": "Pull complete", "id": layer, "progressDetail": {}})
+
+        with state.lock:
+            state.images.add(image)
+
+            # Pulled images exist in registry
+            state.registry.add(image)
+
+        self.send_chunk({"status": "Status: Downloaded newer image for {image}".format(image=image)})
+        self.end_stream()
+
+    def push(self, name, tag):
+        state = self.server.state
+        image = "{name}:{tag}".format(name=name, tag=tag)
+
+        with state.lock:
+            if image not in state.images:
+                return self.send_json(404, {"message": "No such image: {image}".format(image=image)})
+
+            existing = name in set(pushed.rsplit(":", 1)[0] for pushed in state.registry)
+
+        self.start_stream()
+        self.send_chunk({"status": "The push refers to a repository [{name}]".format(name=name)})
+
+        if existing:
+            # Layers were uploaded by previous push of the repository
+            for layer in self.get_layers():
+                self.send_chunk({"status": "Layer already exists", "id": layer, "progressDetail": {}})
+        else:
+            for layer, step in self.progress():
+                state.sleep("push_chunk")
+                self.send_chunk({"status": "Pushing", "id": layer,
+                                 "progressDetail": {"current": step, "total": state.layer_size}})
+
+            for layer in self.get_layers():
+                self.send_chunk({"status": "Pushed", "id": layer, "progressDetail": {}})
+
+        with state.lock:
+            state.registry.add(image)
+
+        digest = self.get_digest(image)
+        self.send_chunk({"status": "{tag}: digest: {digest} size: 1234".format(tag=tag, digest=digest)})
+        self.send_chunk({"progressDetail": {}, "aux": {"Tag": tag, "Digest": digest, "Size": 1234}})
+        self.end_stream()
+
+    def get_layers(self):
+        return ["layer{index}".format(index=index) for index in range(self.server.state.layers)]
+
+    def progress(self):
+        state = self.server.state
+        chunk = max(state.layer_size // max(state.steps, 1), 1)
+
+        for layer in self.get_layers():
+            for step in range(chunk, state.layer_size + 1, chunk):
+                yield layer, step
+
+    def events(self):
+        """
+        Stream events of containers until client disconnects
+        """
+        filters = self.get_filters()
+        subscriber = queue.Queue()
+
+        with self.server.state.lock:
+            self.server.state.subscribers.append(subscriber)
+
+        self.start_stream()
+
+        try:
+            while True:
+                try:
+                    event = subscriber.get(timeout=1.0)
+                except queue.Empty:
+                    if self.disconnected():
+                        break
+                    continue
+
+                labels = event.get("Actor", {}).get("Attributes", {})
+                if not all(self.match_label({"Labels": labels}, label) for label in filters.get("label", [])):
+                    continue
+
+                self.send_chunk(event)
+        except OSError:
+            pass
+        finally:
+            with self.server.state.lock:
+                self.server.state.subscribers.remove(subscriber)
+
+            self.close_connection = True
+
+    def disconnected(self):
+        readable, _, _ = select.select([self.connection], [], [], 0)
+
+        try:
+            return bool(readable) and self.connection.recv(1, socket.MSG_PEEK) == b''
+        except OSError:
+            return True
+
+    def start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def send_chunk(self, data):
+        body = (json.dumps(data) + "\r\n").encode("utf-8")
+        self.wfile.write("{length:x}\r\n".format(length=len(body)).encode("ascii") + body + b"\r\n")
+        self.wfile.flush()
+
+    def end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def send_json(self, code, data):
+        body = json.dumps(data).encode("utf-8")
+
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_empty(self, code):
+        self.send_response(code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class RegistryServer(socketserver.ThreadingMixIn, HTTPServer):
+    """
+        Stand-in for registry HTTP API v2, knows images pushed to fake docker
+    """
+
+    daemon_threads = True
+
+    def __init__(self, state, port=0, host="127.0.0.1"):
+        self.state = state
+        super().__init__((host, port), RegistryHandler)
+
+    @property
+    def url(self):
+        return "{host}:{port}".format(host=self.server_address[0], port=self.server_address[1])
+
+
+class RegistryHandler(BaseHTTPRequestHandler):
+    """
+        Registry API, manifests exist for images pushed with registry url of this server
+    """
+
+    MANIFEST = re.compile(r'^/v2/(?P<name>.+)/manifests/(?P<tag>[^/]+)$')
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.manifest(body=False)
+
+    def do_GET(self):
+        if self.path == "/v2/":
+            return self.respond(200, b"{}")
+
+        self.manifest(body=True)
+
+    def manifest(self, body):
+        state = self.server.state
+        state.count("registry_manifest")
+
+        match = self.MANIFEST.match(self.path)
+        image = match and "{url}/{name}:{tag}".format(url=self.server.url, name=match.group("name"),
+                                                      tag=match.group("tag"))
+
+        with state.lock:
+            exists = bool(image) and image in state.registry
+
+        if not exists:
+            return self.respond(404, b'{"errors":[{"code":"MANIFEST_UNKNOWN"}]}' if body else b'')
+
+        digest = "sha256:" + hashlib.sha256(image.encode("utf-8")).hexdigest()
+        self.respond(200, b"{}" if body else b'', {"Docker-Content-Digest": digest})
+
+    def respond(self, code, body, headers=None):
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeDocker(object):
+    """
+        Fake docker and registry running in background threads
+    """
+
+    def __init__(self, path, **options):
+        """
+        :param path: Path of unix socket of docker
+        :param options: Options of State
+        """
+        self.state = State(**options)
+        self.docker = DockerServer(path, self.state)
+        self.registry = RegistryServer(self.state)
+        self.threads = []
+
+    @property
+    def base_url(self):
+        return "unix://{path}".format(path=self.docker.path)
+
+    def start(self):
+        for server in (self.docker, self.registry):
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+        return self
+
+    def stop(self):
+        for server in (self.docker, self.registry):
+            server.shutdown()
+            server.server_close()
+
+
+def request(path, method, url):
+    """
+    Call control API of fake docker running in other process
+    :param path: Path of unix socket
+    :param method: HTTP method
+    :param url: Path of request, e.g. /_stats
+    :return: Returns dict
+    """
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(path)
+
+    try:
+        connection.sendall("{method} {url} HTTP/1.1\r\nHost: docker\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+                           .format(method=method, url=url).encode("ascii"))
+        response = b''
+        while True:
+            data = connection.recv(65536)
+            if not data:
+                break
+            response += data
+    finally:
+        connection.close()
+
+    return json.loads(response.split(b"\r\n\r\n", 1)[1].decode("utf-8") or "{}")
+
+
+def parse_latencies(values):
+    latencies = {}
+
+    for value in values or []:
+        name, _, seconds = value.partition("=")
+        latencies[name] = float(seconds)
+
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake docker engine and registry for benchmarks")
+    parser.add_argument("--socket", required=True, help="Path of unix socket of docker")
+    parser.add_argument("--layers", type=int, default=3, help="Number of layers of images")
+    parser.add_argument("--layer-size", type=int, default=8 * 1024 * 1024, help="Size of layer in bytes")
+    parser.add_argument("--steps", type=int, default=5, help="Number of progress messages per layer")
+    parser.add_argument("--build-steps", type=int, default=6, help="Number of steps of builds")
+    parser.add_argument("--latency", action="append", default=[],
+                        help="Latency in format <name>=<seconds>, names: " + ", ".join(sorted(DEFAULT_LATENCIES)))
+    arguments = parser.parse_args()
+
+    fake = FakeDocker(arguments.socket, layers=arguments.layers, layer_size=arguments.layer_size,
+                      steps=arguments.steps, build_steps=arguments.build_steps,
+                      latencies=parse_latencies(arguments.latency))
+
+    # Parent process reads url of registry from first line
+    print(json.dumps({"docker": fake.base_url, "registry": fake.registry.url}), flush=True)
+
+    fake.start()
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.stop()
+
+
+if __name__ == '__main__':
+    main()
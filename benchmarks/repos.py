@@ -0,0 +1,105 @@
+import os
+import random
+import subprocess
+
+
+def create_repository(path, commits=100, files=50, file_size=1024, changes=3, tag_every=25, seed=0):
+    """
+    Create bare git repository with generated history, history is written by git fast-import so large
+    repositories are created in seconds
+    :param path: Path of bare repository, it must not exist
+    :param commits: Number of commits of master
+    :param files: Number of files in tree, besides Dockerfile
+    :param file_size: Size of every file in bytes
+    :param changes: Number of files changed by every commit
+    :param tag_every: Every n-th commit is tagged, 0 for no tags
+    :param seed: Seed of content, same seed creates same repository
+    :return: Returns path of repository
+    """
+    subprocess.check_call(["git", "init", "--quiet", "--bare", path])
+
+    process = subprocess.Popen(["git", "--git-dir", path, "fast-import", "--quiet"], stdin=subprocess.PIPE)
+    generator = random.Random(seed)
+
+    try:
+        write_history(process.stdin, generator, commits, files, file_size, changes, tag_every)
+    finally:
+        process.stdin.close()
+
+    if process.wait() != 0:
+        raise RuntimeError("git fast-import failed with {code}".format(code=process.returncode))
+
+    return path
+
+
+def write_history(stream, generator, commits, files, file_size, changes, tag_every):
+    """
+    Write fast-import stream of history
+    :param stream: Binary stream of fast-import
+    :param generator: Random generator of content
+    :return: Returns void
+    """
+    paths = ["src/module{directory}/file{index}.txt".format(directory=index % 10, index=index)
+             for index in range(files)]
+
+    dockerfile = b"FROM scratch\nCOPY src /src\n"
+
+    for number in range(1, commits + 1):
+        # First commit adds all files, following commits change some of them
+        changed = paths if number == 1 else generator.sample(paths, min(changes, len(paths)))
+
+        timestamp = 1500000000 + number * 60
+        message = "Commit {number}\n".format(number=number).encode("utf-8")
+
+        commands = [
+            b"commit refs/heads/master\n",
+            "mark :{mark}\n".format(mark=number).encode("ascii"),
+            "author Bench <bench@example.com> {time} +0000\n".format(time=timestamp).encode("ascii"),
+            "committer Bench <bench@example.com> {time} +0000\n".format(time=timestamp).encode("ascii"),
+            "data {length}\n".format(length=len(message)).encode("ascii") + message,
+        ]
+
+        if number > 1:
+            commands.append("from :{mark}\n".format(mark=number - 1).encode("ascii"))
+        else:
+            commands.append(inline("Dockerfile", dockerfile))
+
+        for path in changed:
+            content = "{path} {number} ".format(path=path, number=number).encode("utf-8")
+            size = max(file_size - len(content), 0)
+            content += generator.getrandbits(size * 8).to_bytes(size, "little") if size else b''
+            commands.append(inline(path, content))
+
+        stream.write(b"".join(commands) + b"\n")
+
+        if tag_every and number % tag_every == 0:
+            tag = "v{number}".format(number=number // tag_every)
+            message = "Release {tag}\n".format(tag=tag).encode("utf-8")
+
+            stream.write(b"".join([
+                "tag {tag}\n".format(tag=tag).encode("ascii"),
+                "from :{mark}\n".format(mark=number).encode("ascii"),
+                "tagger Bench <bench@example.com> {time} +0000\n".format(time=timestamp).encode("ascii"),
+                "data {length}\n".format(length=len(message)).encode("ascii") + message,
+                b"\n",
+            ]))
+
+
+def inline(path, content):
+    return "M 644 inline {path}\ndata {length}\n".format(path=path, length=len(content)).encode("utf-8") + \
+        content + b"\n"
+
+
+def get_size(path):
+    """
+    Get size of repository on disk
+    :param path: Path of repository
+    :return: Returns number of bytes
+    """
+    size = 0
+
+    for directory, _, names in os.walk(path):
+        for name in names:
+            size += os.path.getsize(os.path.join(directory, name))
+
+    return size
@@ -0,0 +1,510 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import contextlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks import fake_docker
+from benchmarks.repos import create_repository, get_size
+
+# Version of results format
+FORMAT = 1
+
+APPLICATION = "bench"
+ENVIRONMENT = "bench"
+
+
+class Bench(object):
+    """
+        Runs builder and agent commands in process against fake docker and generated repositories
+    """
+
+    def __init__(self, arguments, directory):
+        """
+        :param arguments: Parsed command line arguments
+        :param directory: Temporary directory of benchmark
+        """
+        self.arguments = arguments
+        self.directory = directory
+        self.results = {}
+        self.fake = None
+        self.registry = None
+        self.socket = os.path.join(directory, "docker.sock")
+        self.repositories = []
+        self.repository_size = None
+        self.deploy_id = 0
+
+    def start(self):
+        """
+        Start fake docker in its own process so it doesn't compete with tower for GIL, configure environment
+        :return: Returns void
+        """
+        command = [sys.executable, "-m", "benchmarks.fake_docker", "--socket", self.socket,
+                   "--layers", str(self.arguments.layers), "--layer-size", str(self.arguments.layer_size),
+                   "--build-steps", str(self.arguments.build_steps)]
+
+        for latency in self.arguments.latency:
+            command += ["--latency", latency]
+
+        self.fake = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE)
+        self.registry = json.loads(self.fake.stdout.readline().decode("utf-8")).get("registry")
+
+        while not os.path.exists(self.socket):
+            time.sleep(0.01)
+
+        # Nginx of benchmark accepts every configuration
+        bin_directory = os.path.join(self.directory, "bin")
+        os.makedirs(bin_directory)
+        with open(os.path.join(bin_directory, "nginx"), "w") as file:
+            file.write("#!/bin/sh\nexit 0\n")
+        os.chmod(os.path.join(bin_directory, "nginx"), 0o755)
+
+        os.makedirs(os.path.join(self.directory, "nginx"))
+
+        os.environ.update({
+            "DOCKER_HOST": "unix://{path}".format(path=self.socket),
+            "TOWER_DOCKER_API_VERSION": "1.24",
+            "TOWER_DAEMON": "off",
+            "TOWER_SCHEDULER_DB": os.path.join(self.directory, "scheduler.db"),
+            "TOWER_MAX_JOBS": str(max(self.arguments.jobs, 1)),
+            "TOWER_CACHE_DIR": os.path.join(self.directory, "cache"),
+            "TOWER_NGINX_DIR": os.path.join(self.directory, "nginx"),
+            "PATH": bin_directory + os.pathsep + os.environ.get("PATH", ''),
+            "SERVICES": "{}",
+        })
+
+        # Tower is imported once environment points to fake docker
+        from src.core.nginx import Reloader
+        from src.controller.agent_controller import AgentController
+
+        # Debounce of reloads would hide time spent by tower
+        AgentController.reloader = Reloader(delay=self.arguments.reload_delay)
+
+    def stop(self):
+        if self.fake is not None:
+            self.fake.terminate()
+            self.fake.wait()
+
+    def create_repositories(self):
+        for index in range(self.arguments.repositories):
+            path = os.path.join(self.directory, "repositories", "repository{index}.git".format(index=index))
+            create_repository(path, commits=self.arguments.commits, files=self.arguments.files,
+                              file_size=self.arguments.file_size, seed=index)
+            self.repositories.append(path)
+
+        self.repository_size = get_size(self.repositories[0]) if self.repositories else None
+
+    def run(self):
+        """
+        Run all benchmarks selected by --only
+        :return: Returns dict of results
+        """
+        benchmarks = [
+            ("builder.build", self.bench_build),
+            ("agent.deploy", self.bench_deploy),
+            ("agent.save", self.bench_save),
+            ("agent.down", self.bench_down),
+            ("dep", self.bench_dep),
+            ("repo.commits", self.bench_commits),
+            ("nginx.render", self.bench_render),
+        ]
+
+        for name, function in benchmarks:
+            if self.arguments.only and not any(name.startswith(only) for only in self.arguments.only):
+                continue
+
+            print("Running {name}".format(name=name), file=sys.stderr)
+            function()
+
+        return self.results
+
+    def bench_build(self):
+        cache = os.environ.get("TOWER_CACHE_DIR")
+
+        def cold():
+            self.reset()
+            shutil.rmtree(cache, ignore_errors=True)
+
+        # Cold builds clone, build and push, warm builds find fingerprints in registry
+        self.measure("builder.build.cold", lambda: self.command("builder", "build"), setup=cold)
+        self.measure("builder.build.warm", lambda: self.command("builder", "build"))
+
+    def bench_deploy(self):
+        self.measure("agent.deploy.cold", lambda: self.command("agent", "deploy"), setup=self.reset)
+        self.measure("agent.deploy.unchanged", lambda: self.command("agent", "deploy"))
+
+        # Every service is replaced next to its running container
+        self.measure("agent.deploy.changed", lambda: self.command("agent", "deploy"), setup=self.change)
+
+    def bench_save(self):
+        self.reset()
+        self.command("agent", "deploy")
+
+        controller = self.create_controller("agent")
+        controller.setup()
+        controller.inventory.refresh()
+
+        self.measure("agent.save", controller.save)
+
+    def bench_down(self):
+        def deploy():
+            self.reset()
+            self.command("agent", "deploy")
+
+        self.measure("agent.down", lambda: self.command("agent", "down"), setup=deploy)
+
+    def bench_dep(self):
+        from src.controller.agent_controller import AgentController
+
+        services = self.create_services()
+        self.measure("dep", lambda: AgentController.dep(services), repeat=self.arguments.repeat * 10,
+                     docker=False)
+
+    def bench_commits(self):
+        from src.core.git.git import Git
+
+        path = os.path.join(self.directory, "commits")
+        subprocess.check_call(["git", "clone", "--quiet", self.repositories[0], path])
+
+        self.measure("repo.commits", lambda: Git.repo(path).commits, docker=False,
+                     parameters={"commits": self.arguments.commits})
+
+    def bench_render(self):
+        from src.core.nginx import get_template
+
+        template = get_template(ROOT, "./resources/application.conf")
+        options = {
+            "upstream": "bench_service",
+            "virtual_host": "service.bench.local",
+            "servers": ["172.17.0.{index}".format(index=index) for index in range(2, 12)],
+            "port": 80,
+            "method": None,
+            "keepalive": 16,
+            "max_fails": 3,
+            "fail_timeout": "10s",
+            "connect_timeout": "5s",
+            "send_timeout": "60s",
+            "read_timeout": "60s",
+            "buffering": True,
+            "buffer_size": None,
+            "buffers": None,
+        }
+
+        self.measure("nginx.render", lambda: template.render(options), repeat=self.arguments.repeat * 100,
+                     docker=False)
+
+    def measure(self, name, function, setup=None, repeat=None, docker=True, parameters=None):
+        """
+        Measure function, setup is not measured
+        :param name: Name of result
+        :param function: Measured function
+        :param setup: Function called before every run
+        :param repeat: Number of runs, defaults to --repeat
+        :param docker: Record number of docker requests made by function
+        :param parameters: Parameters of result, defaults to number of services and levels
+        :return: Returns void
+        """
+        samples = []
+        requests = {}
+
+        for _ in range(repeat or self.arguments.repeat):
+            if setup is not None:
+                setup()
+
+            before = self.stats().get("requests", {}) if docker else {}
+
+            started = time.perf_counter()
+            function()
+            samples.append(time.perf_counter() - started)
+
+            if docker:
+                after = self.stats().get("requests", {})
+                requests = dict((key, value - before.get(key, 0)) for key, value in after.items()
+                                if value != before.get(key, 0))
+
+        self.results[name] = dict(summarize(samples), parameters=parameters or {
+            "services": self.arguments.services,
+            "levels": self.arguments.levels,
+            "jobs": self.arguments.jobs,
+        })
+
+        if docker:
+            # Requests of last run, they don't depend on timing so any change is a regression
+            self.results[name]["docker_requests"] = requests
+
+    def command(self, controller_name, command):
+        """
+        Run command of controller like daemon runs its jobs, output of command is discarded
+        :param controller_name: builder or agent
+        :param command: Name of command
+        :return: Returns void
+        """
+        controller = self.create_controller(controller_name)
+
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            result = getattr(controller, command)()
+
+        if result is False:
+            raise RuntimeError("{controller} {command} failed:\n{output}".format(
+                controller=controller_name,
+                command=command,
+                output=output.getvalue()[-4000:]
+            ))
+
+    def create_controller(self, controller_name):
+        from src.controller.daemon_controller import JobApp
+        from src.controller.agent_controller import AgentController
+        from src.controller.builder_controller import BuilderController
+
+        controller_class = BuilderController if controller_name == "builder" else AgentController
+
+        controller = controller_class(environment=dict(os.environ, **self.create_environment(controller_name)))
+        controller.app = JobApp(None, {"jobs": self.arguments.jobs})
+
+        return controller
+
+    def create_environment(self, controller_name):
+        if controller_name == "builder":
+            services = self.create_build_services()
+        else:
+            services = self.create_services()
+
+        application = {
+            "name": APPLICATION,
+            "environments": {
+                ENVIRONMENT: {
+                    "registry": {
+                        "local": {
+                            "host": self.registry.split(":")[0],
+                            "port": self.registry.split(":")[1],
+                            "username": "bench",
+                            "password": "bench",
+                        }
+                    },
+                    "services": services,
+                }
+            }
+        }
+
+        return {"APPLICATION": json.dumps(application), "APPLICATION_ENVIRONMENT": ENVIRONMENT}
+
+    def create_build_services(self):
+        services = {}
+
+        for index in range(self.arguments.services):
+            services["service{index}".format(index=index)] = {
+                "repository": {
+                    "origin": self.repositories[index % len(self.repositories)],
+                    "branch": "master",
+                    "image": {
+                        "name": "bench/service{index}".format(index=index),
+                        "aliases": ["stable"],
+                    },
+                    "registry": ["local"],
+                },
+                "args": {"SERVICE": str(index)},
+            }
+
+        return services
+
+    def create_services(self):
+        """
+        Create services spread over dependency levels, every service depends on a service of previous level
+        :return: Returns dict of services
+        """
+        services = {}
+        count = self.arguments.services
+        levels = max(min(self.arguments.levels, count), 1)
+
+        for index in range(count):
+            level = index * levels // count
+            name = "service{index}".format(index=index)
+
+            service = {
+                "image": "{registry}/bench/{name}:latest".format(registry=self.registry, name=name),
+                "repository": {"registry": ["local"]},
+                "environment": {
+                    "VIRTUAL_HOST": "{name}.bench.local".format(name=name),
+                    "DEPLOY": str(self.deploy_id),
+                },
+            }
+
+            if level:
+                # First service of previous level
+                dependency = next(other for other in range(count) if other * levels // count == level - 1)
+                service["depends_on"] = ["service{index}".format(index=dependency)]
+
+            services[name] = service
+
+        return services
+
+    def change(self):
+        self.deploy_id += 1
+
+    def reset(self):
+        fake_docker.request(self.socket, "POST", "/_reset")
+
+        nginx = os.environ.get("TOWER_NGINX_DIR")
+        for name in os.listdir(nginx):
+            os.remove(os.path.join(nginx, name))
+
+    def stats(self):
+        return fake_docker.request(self.socket, "GET", "/_stats")
+
+
+def summarize(samples):
+    """
+    Summarize samples of durations
+    :param samples: List of seconds
+    :return: Returns dict
+    """
+    ordered = sorted(samples)
+
+    return {
+        "unit": "seconds",
+        "runs": len(ordered),
+        "min": ordered[0],
+        "median": statistics.median(ordered),
+        "mean": statistics.mean(ordered),
+        "p90": ordered[min(int(len(ordered) * 0.9), len(ordered) - 1)],
+        "max": ordered[-1],
+        "stdev": statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare medians and docker requests with baseline
+    :param results: Results of this run
+    :param baseline: Results of baseline run
+    :param threshold: Allowed relative slowdown, e.g. 0.2 for 20 %
+    :return: Returns list of regressions
+    """
+    regressions = []
+
+    for name, result in sorted(results.items()):
+        previous = baseline.get("results", {}).get(name)
+
+        if not previous or previous.get("parameters") != result.get("parameters"):
+            continue
+
+        ratio = result.get("median") / previous.get("median") if previous.get("median") else 1.0
+        if ratio > 1 + threshold:
+            regressions.append("{name}: median {median:.4f}s is {ratio:.2f}x of baseline {baseline:.4f}s".format(
+                name=name, median=result.get("median"), ratio=ratio, baseline=previous.get("median")
+            ))
+
+        requests = sum(result.get("docker_requests", {}).values())
+        previous_requests = sum(previous.get("docker_requests", {}).values())
+        if requests > previous_requests:
+            regressions.append("{name}: {requests} docker requests, baseline made {baseline}".format(
+                name=name, requests=requests, baseline=previous_requests
+            ))
+
+    return regressions
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print("{name:<28} {median:>10} {p90:>10} {max:>10} {requests:>9}".format(
+        name="benchmark", median="median", p90="p90", max="max", requests="requests"
+    ), file=sys.stderr)
+
+    for name, result in sorted(results.items()):
+        print("{name:<28} {median:>10.4f} {p90:>10.4f} {max:>10.4f} {requests:>9}".format(
+            name=name,
+            median=result.get("median"),
+            p90=result.get("p90"),
+            max=result.get("max"),
+            requests=sum(result.get("docker_requests", {}).values()) if "docker_requests" in result else '-'
+        ), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark tower against fake docker and generated git repositories",
+        epilog="Example: python -m benchmarks.run --services 20 --levels 4 --output results.json"
+    )
+    parser.add_argument("--services", type=int, default=10, help="Number of services of application")
+    parser.add_argument("--levels", type=int, default=3, help="Number of dependency levels of services")
+    parser.add_argument("--jobs", type=int, default=4, help="Number of services built or deployed in parallel")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs of every benchmark")
+    parser.add_argument("--repositories", type=int, default=2, help="Number of generated repositories")
+    parser.add_argument("--commits", type=int, default=500, help="Number of commits of repositories")
+    parser.add_argument("--files", type=int, default=100, help="Number of files of repositories")
+    parser.add_argument("--file-size", type=int, default=4096, help="Size of files of repositories in bytes")
+    parser.add_argument("--layers", type=int, default=3, help="Number of layers of pulled and pushed images")
+    parser.add_argument("--layer-size", type=int, default=8 * 1024 * 1024, help="Size of layers in bytes")
+    parser.add_argument("--build-steps", type=int, default=6, help="Number of steps of builds")
+    parser.add_argument("--latency", action="append", default=[],
+                        help="Latency of fake docker in format <name>=<seconds>, names: " +
+                             ", ".join(sorted(fake_docker.DEFAULT_LATENCIES)))
+    parser.add_argument("--reload-delay", type=float, default=0.0, help="Debounce of nginx reloads in seconds")
+    parser.add_argument("--only", action="append", default=[], help="Run only benchmarks with this prefix")
+    parser.add_argument("--output", default=None, help="Write results as json to file, - for standard output")
+    parser.add_argument("--compare", default=None, help="Fail if results are slower than results in file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative slowdown, default 0.2")
+    arguments = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="tower-bench-")
+    bench = Bench(arguments, directory)
+
+    try:
+        bench.start()
+        bench.create_repositories()
+        results = bench.run()
+    finally:
+        bench.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    report = {
+        "format": FORMAT,
+        "created": time.time(),
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "arguments": vars(arguments),
+        "repository_size": bench.repository_size,
+        "results": results,
+    }
+
+    print_results(results)
+
+    if arguments.output == "-":
+        print(json.dumps(report, indent=2, sort_keys=True))
+    elif arguments.output:
+        with open(arguments.output, "w") as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+
+    if arguments.compare:
+        with open(arguments.compare) as file:
+            regressions = compare(results, json.load(file), arguments.threshold)
+
+        for regression in regressions:
+            print("Regression: {regression}".format(regression=regression), file=sys.stderr)
+
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
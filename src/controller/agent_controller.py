@@ -1,11 +1,31 @@
 import json
 import re
-import docker
 import os
+import shlex
 import argparse
-from jinja2 import Environment, FileSystemLoader
-from slugify import slugify
+import hashlib
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from cement.core.controller import CementBaseController, expose
+from src.core import log
+from src.core import metrics
+from src.core import model
+from src.core.graph import Graph
+from src.core.lazy import lazy
+from src.core.nginx import NginxConfig, Reloader, get_template
+from src.exceptions import DockerAPIError, FailedToDeployService, InvalidApplication
+
+# Imported by commands which use them
+asyncio = lazy("asyncio")
+scheduler = lazy("src.core.scheduler")
+slugify = lazy("slugify")
+docker_errors = lazy("docker.errors")
+docker_client = lazy("src.core.docker.client")
+docker_aio = lazy("src.core.docker.aio")
+docker_pull = lazy("src.core.docker.pull")
+docker_readiness = lazy("src.core.docker.readiness")
+daemon_client = lazy("src.core.daemon.client")
 
 
 class AgentController(CementBaseController):
@@ -14,27 +34,96 @@ class AgentController(CementBaseController):
         stacked_on = 'base'
         stacked_type = 'nested'
         description = "Agent"
+        arguments = [
+            (['-j', '--jobs'], dict(action='store', type=int, default=1,
+                                    help='Number of services deployed in parallel')),
+            (['extra_arguments'], dict(action='store', nargs='*',
+                                       help='Service and number of its replicas, only accepted by scale')),
+        ]
 
     builder_services = {}
 
-    def __init__(self, *args, **kw):
+    # Label with hash of container configuration, used to detect changed services
+    CONFIG_HASH_LABEL = "com.tower.config_hash"
+
+    # Label with number of replica of service, replica 1 is named after service, others <service>-<number>
+    REPLICA_LABEL = "com.tower.replica"
+
+    # Maximal number of replicas of service started or stopped at the same time
+    REPLICA_WORKERS = 8
+
+    # Defaults of proxy options of service, used in nginx upstream and virtual host
+    PROXY_DEFAULTS = {
+        "method": "round_robin",
+        "keepalive": 32,
+        "max_fails": 3,
+        "fail_timeout": "10s",
+        "connect_timeout": "5s",
+        "send_timeout": "60s",
+        "read_timeout": "60s",
+        "buffering": True,
+        "buffer_size": None,
+        "buffers": None,
+    }
+
+    LOAD_BALANCING_METHODS = model.LOAD_BALANCING_METHODS
+
+    # Nginx is reloaded once for changes of all applications deployed by process
+    reloader = Reloader()
+
+    def __init__(self, *args, environment=None, **kw):
+        """
+        :param environment: Environment of command, commands run by daemon pass environment of their job
+        """
         super().__init__(*args, **kw)
         self.working_dir = os.getcwd()
-        self.client = docker.Client(base_url='unix://var/run/docker.sock', version='auto')
 
-        # Application settings, comes from environment
-        self.application = json.loads(os.environ.get("APPLICATION", "")) or {}
-        self.application_name = self.application.get("name", '')
-        self.application_name_slugify = slugify(self.application_name)
-        self.environment_name = os.environ.get("APPLICATION_ENVIRONMENT", '') or ''
-        self.environment = self.application.get("environments", {}).get(self.environment_name, {})
-        self.services = self.environment.get("services", {})
+        # Commands run from command line are sent to daemon when one is running
+        self.standalone = environment is None
+        self.environ = os.environ if environment is None else environment
+
+        # Jobs of all tower processes of host are limited by scheduler
+        self.scheduler = None
+
+    def setup(self):
+        """
+        Load application and connect to docker, done by commands which need it
+        :return: Returns void
+        """
+        # Application settings, comes from environment, parsed and validated before docker is touched
+        self.model = model.load(self.environ)
+
+        self.client = docker_client.get_client()
+
+        # Batches of requests run concurrently on asyncio client
+        self.async_client = docker_client.get_async_client()
+
+        # Containers of tower are listed once and updated from events, readiness is woken up by the same events
+        self.inventory, self.readiness = docker_client.get_inventory(self.client, self.async_client)
+
+        # Services recreated during deploy and containers which are not routed to
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.recreated = set()
+        self.starting = set()
+        self.retired = set()
+
+        # Application settings
+        self.application_name = self.model.application_name
+        self.application_name_slugify = slugify.slugify(self.application_name)
+        self.environment_name = self.model.name
+
+        # Services of environment by name, parsed by model
+        self.services = self.model.services
 
         self.project_name = "{application}-{environment_name}".format(application=self.application_name_slugify,
                                                                       environment_name=self.environment_name)
 
-        template_environment = Environment(loader=FileSystemLoader(self.working_dir))
-        self.template = template_environment.get_template("./resources/application.conf")
+        self.template = get_template(self.working_dir, "./resources/application.conf")
+
+        # Virtual hosts are written only when changed and nginx is reloaded once per batch of changes
+        self.nginx = NginxConfig(self.application_name_slugify,
+                                 self.environ.get("TOWER_NGINX_DIR", '') or "/etc/nginx/conf.d")
 
     @expose(hide=True)
     def default(self):
@@ -42,42 +131,87 @@ class AgentController(CementBaseController):
 
     @expose(help="Deploy application")
     def deploy(self):
-        self.builder_services = json.loads(os.environ.get("SERVICES", "")) or {}
+        self.reject_extra_arguments()
+
+        if self.standalone and daemon_client.delegate("agent.deploy", self.environ, {"jobs": self.app.pargs.jobs}):
+            return
+
+        try:
+            self.setup()
+        except InvalidApplication as e:
+            self.print("Invalid application: {error}".format(error=e))
+            print(json.dumps({
+                'status': 'failed',
+                'success': False,
+                'errors': {'application': str(e)}
+            }))
+            return False
+
+        self.set_labels("agent.deploy")
+
+        # Deploys wait for slot of host scheduler, they go before waiting builds
+        try:
+            with self.get_scheduler().slot("deploy", self.application_name, priority=scheduler.Scheduler.DEPLOY):
+                return self.deploy_application()
+        finally:
+            metrics.flush()
+
+    def deploy_application(self):
+        self.builder_services = json.loads(self.environ.get("SERVICES", "")) or {}
 
         self.print("Deploying application")
 
-        containers = self.client.containers(filters={
-            "label": "com.tower.application={project_name}".format(project_name=self.application_name_slugify)
-        })
+        with self.lock:
+            self.recreated.clear()
+
+        self.inventory.refresh()
+        self.inventory.watch()
+        containers = self.inventory.by_application(self.application_name_slugify, running=True)
 
         if not containers:
             self.print("First time deployment")
 
-            networks = self.client.networks(names=[self.project_name])
+        networks = self.client.networks(names=[self.project_name])
+
+        if not networks:
+            self.print("Creating network for application as {network_name}".format(network_name=self.project_name))
+            network = self.client.create_network(
+                name=self.project_name,
+                internal=False,
+                driver='bridge',
+                labels={
+                    "com.tower.network": self.project_name
+                }
+            )
+        else:
+            network = networks[0]
+
+        self.print("Using network {network_name}".format(network_name=network.get("Name")))
 
-            if not networks:
-                self.print("Creating network for application as {network_name}".format(network_name=self.project_name))
-                network = self.client.create_network(
-                    name=self.project_name,
-                    internal=False,
-                    driver='bridge',
-                    labels={
-                        "com.tower.network": self.project_name
-                    }
-                )
-            else:
-                network = networks[0]
+        # Images are pulled concurrently before any container is touched
+        errors = self.pull_images()
 
-            self.print("Using network {network_name}".format(network_name=network.get("Name")))
+        if errors:
+            print(json.dumps({
+                'status': 'failed',
+                'success': False,
+                'errors': errors
+            }))
+            return False
 
-            service_tree = self.dep(self.services)
+        # Create containers and start them, every service as soon as its dependencies are started
+        errors = self.run_services(self.model.graph, self.build, "deploy")
 
-            # Create containers and start them
-            for group in service_tree:
-                for service_name in group:
-                    self.build(service_name)
+        if errors:
+            print(json.dumps({
+                'status': 'failed',
+                'success': False,
+                'errors': errors
+            }))
+            return False
 
-        self.save()
+        if self.save():
+            self.reload_nginx()
 
         # On success respond with json
         print(json.dumps({
@@ -87,19 +221,147 @@ class AgentController(CementBaseController):
 
     @expose(help="Down application")
     def down(self):
+        self.reject_extra_arguments()
+
+        if self.standalone and daemon_client.delegate("agent.down", self.environ, {"jobs": self.app.pargs.jobs}):
+            return
+
+        try:
+            self.setup()
+        except InvalidApplication as e:
+            self.print("Invalid application: {error}".format(error=e))
+            print(json.dumps({
+                'status': 'failed',
+                'success': False,
+                'errors': {'application': str(e)}
+            }))
+            return False
+
+        self.set_labels("agent.down")
+
+        try:
+            with self.get_scheduler().slot("down", self.application_name, priority=scheduler.Scheduler.DEPLOY):
+                return self.down_application()
+        finally:
+            metrics.flush()
+
+    @expose(help="Scale service to number of replicas, e.g. agent scale web 3, other replicas are kept")
+    def scale(self):
+        arguments = self.app.pargs.extra_arguments or []
+
+        if len(arguments) != 2 or not arguments[1].isdigit() or int(arguments[1]) < 1:
+            print(json.dumps({
+                'status': 'failed',
+                'success': False,
+                'errors': {'arguments': 'Usage: agent scale <service> <replicas>'}
+            }))
+            return False
+
+        if self.standalone and daemon_client.delegate("agent.scale", self.environ, {"jobs": self.app.pargs.jobs,
+                                                                                    "extra_arguments": arguments}):
+            return
+
+        try:
+            self.setup()
+        except InvalidApplication as e:
+            self.print("Invalid application: {error}".format(error=e))
+            print(json.dumps({
+                'status': 'failed',
+                'success': False,
+                'errors': {'application': str(e)}
+            }))
+            return False
+
+        self.set_labels("agent.scale")
+
+        try:
+            with self.get_scheduler().slot("scale", self.application_name, priority=scheduler.Scheduler.DEPLOY):
+                return self.scale_application(arguments[0], int(arguments[1]))
+        finally:
+            metrics.flush()
+
+    def reject_extra_arguments(self):
+        """
+        Positional arguments are declared for all commands of controller but belong only to scale,
+        other commands reject them as argparse does
+        :return: Returns void
+        """
+        arguments = getattr(self.app.pargs, "extra_arguments", None) or []
+
+        if arguments:
+            self.app.args.error("unrecognized arguments: {arguments}".format(arguments=" ".join(arguments)))
+
+    def scale_application(self, service_name, replicas):
+        """
+        Add or remove replicas of service, existing replicas within the number are not touched
+        :param service_name: Name of service
+        :param replicas: Number of replicas
+        :return: Returns False on failure
+        """
+        if service_name not in self.services:
+            print(json.dumps({
+                'status': 'failed',
+                'success': False,
+                'errors': {service_name: 'Unknown service'}
+            }))
+            return False
+
+        self.print("Scaling {service_name} to {replicas} replicas".format(service_name=service_name,
+                                                                          replicas=replicas))
+
+        self.inventory.refresh()
+        self.inventory.watch()
+
+        try:
+            log.bind(self.scale_service, prefix=service_name, service=service_name)(service_name, replicas,
+                                                                                    reconcile=False)
+        except (FailedToDeployService, docker_errors.APIError) as e:
+            self.print("Failed {service_name}: {error}".format(service_name=service_name, error=e))
+            print(json.dumps({
+                'status': 'failed',
+                'success': False,
+                'errors': {service_name: str(e)}
+            }))
+            return False
+
+        if self.save():
+            self.reload_nginx()
+
+        # On success respond with json
+        print(json.dumps({
+            'status': 'success',
+            'success': True,
+        }))
+
+    def set_labels(self, command):
+        """
+        Set labels of stages measured by command
+        :param command: Name of command, e.g. agent.deploy
+        :return: Returns void
+        """
+        log.set_labels(command=command, application=self.application_name, environment=self.environment_name)
+
+    def down_application(self):
         self.print("Bringing application down")
 
-        containers = self.client.containers(filters={
-            "label": "com.tower.application={project_name}".format(project_name=self.application_name_slugify)
-        }, all=True)
+        self.inventory.refresh()
+        containers = self.inventory.by_application(self.application_name_slugify)
 
         if containers:
-            service_tree = self.dep(self.services)
+            # Stop containers and remove them, dependents before their dependencies
+            errors = self.run_services(self.model.graph.reversed(), self.service_down, "down")
+
+            if errors:
+                print(json.dumps({
+                    'status': 'failed',
+                    'success': False,
+                    'errors': errors
+                }))
+                return False
 
-            # Create containers and start them
-            for group in service_tree:
-                for service_name in group:
-                    self.service_down(service_name)
+        # Remove virtual hosts of removed services
+        if self.save():
+            self.reload_nginx()
 
         # On success respond with json
         print(json.dumps({
@@ -107,287 +369,707 @@ class AgentController(CementBaseController):
             'success': True,
         }))
 
+    def pull_images(self):
+        """
+        Pull images of services from registries concurrently, images whose digest matches local image are skipped
+        :return: Returns dict of errors by service name, empty on success
+        """
+        images = dict(
+            (service_name, service.image) for service_name, service in self.services.items() if service.registry_urls
+        )
+
+        if not images:
+            return {}
+
+        registries = dict((registry.url, registry.options) for registry in self.model.registries.values())
+
+        pull_scheduler = docker_pull.PullScheduler(self.async_client, registries,
+                                                   max_workers=self.environ.get("TOWER_MAX_PULLS", '') or 4)
+
+        self.print("Pulling {count} images".format(count=len(set(images.values()))))
+        _, errors = pull_scheduler.pull(list(images.values()))
+
+        return dict((service_name, errors[image]) for service_name, image in images.items() if image in errors)
+
+    def get_scheduler(self):
+        """
+        Get scheduler of host, created on first use
+        :return: Returns Scheduler
+        """
+        if self.scheduler is None:
+            self.scheduler = scheduler.Scheduler.from_environment(self.environ)
+
+        return self.scheduler
+
     def service_down(self, service_name):
-        containers = self.client.containers(filters={
-            "label": "com.tower.service={service_name}".format(service_name=service_name),
-            "name": service_name,
-        }, all=True)
+        containers = self.inventory.by_service(service_name, self.application_name_slugify)
 
         if containers:
-            for container in containers:
-                self.print("Stopping {service_name}".format(service_name=service_name))
-                self.client.stop(container=container.get("Id"))
-                self.client.remove_container(container=container.get("Id"))
+            self.print("Stopping {service_name}".format(service_name=service_name))
+
+            # Replicas are stopped concurrently
+            self.remove_containers(containers)
+
+    def run_services(self, graph, function, kind):
+        """
+        Run function for every service as soon as all its dependencies are done, services on the longest
+        path by durations of previous runs go first, no service is started after a failure
+        :param graph: Graph of services
+        :param function: Function called with name of service
+        :param kind: Kind of run whose durations are recorded, e.g. deploy or down
+        :return: Returns dict of errors by service name, empty on success
+        """
+        durations = self.get_scheduler().get_durations(kind, self.application_name)
+
+        def run(service_name):
+            started = time.time()
+            function(service_name)
+            self.get_scheduler().record_duration(kind, self.application_name, service_name, time.time() - started)
+
+        # Log context is bound in this thread and used by worker threads
+        functions = dict((service_name, log.bind(run, prefix=service_name, service=service_name))
+                         for service_name in graph.order)
+
+        failures = graph.run(lambda service_name: functions[service_name](service_name),
+                             workers=self.app.pargs.jobs, durations=durations,
+                             exceptions=(FailedToDeployService, docker_errors.APIError))
+
+        errors = {}
+        for service_name, error in sorted(failures.items()):
+            self.print("Failed {service_name}: {error}".format(service_name=service_name, error=error))
+            errors[service_name] = str(error)
+
+        return errors
 
     @staticmethod
     def dep(arg):
         """
-        Dependency resolver, found at http://code.activestate.com/recipes/576570-dependency-resolver/
-        :param arg: is a dependency dictionary in which the values are the dependencies of their respective keys.
-        :return:
-        """
-        d = dict((k, set(arg[k].get("links", []) + arg[k].get("depends_on", []))) for k in arg)
-        r = []
-        while d:
-            # values not in keys (items without dep)
-            t = set(i for v in d.values() for i in v) - set(d.keys())
-            # and keys without value (items without dep)
-            t.update(k for k, v in d.items() if not v)
-            # can be done right away
-            r.append(t)
-            # and cleaned up
-            d = dict(((k, v - t) for k, v in d.items() if v))
-        return r
+        Group services to dependency levels
+        :param arg: Dict of services by name, dependencies are their links and depends_on
+        :return: Returns list of sets of service names, services depend only on services of previous levels
+        """
+        return Graph.from_services(arg).levels()
 
     def build(self, service_name):
+        """
+        Reconcile service with its definition, every replica is reconciled concurrently
+        and replicas above the number of replicas are removed
+        :param service_name: Name of service
+        :return: Returns list of ids of containers of service
+        """
         self.print("Creating service: {service_name}".format(service_name=service_name))
 
-        service = self.services.get(service_name, {})
+        # Images of registries were pulled by pull_images
+        self.print("Using image: {image}".format(image=self.services[service_name].image))
 
-        containers = self.client.containers(filters={
-            "label": "com.tower.service={service_name}".format(service_name=service_name),
-            "name": service_name,
-        }, all=True)
+        return self.scale_service(service_name, self.services[service_name].replicas)
 
-        if not containers:
+    def scale_service(self, service_name, replicas, reconcile=True):
+        """
+        Create missing replicas of service and remove replicas above number of replicas, concurrently
+        :param service_name: Name of service
+        :param replicas: Number of replicas
+        :param reconcile: Reconcile existing replicas with definition of service, otherwise they are not touched
+        :return: Returns list of ids of containers of replicas
+        """
+        containers = self.inventory.by_service(service_name, self.application_name_slugify)
+
+        # Containers of service by number of replica
+        by_replica = {}
+        for container in containers:
+            by_replica.setdefault(self.get_replica(container), []).append(container)
+
+        removed = [container for replica, replica_containers in sorted(by_replica.items()) if replica > replicas
+                   for container in replica_containers]
+        built = [replica for replica in range(1, replicas + 1) if reconcile or replica not in by_replica]
+
+        if not removed and not built:
+            return [container.get("Id", '') for container in containers]
+
+        with ThreadPoolExecutor(max_workers=max(min(len(built), self.REPLICA_WORKERS), 1)) as executor:
+            futures = [executor.submit(log.bind(self.build_replica), service_name, replica, by_replica.get(replica, []))
+                       for replica in built]
+
+            # Replicas above number are taken out of upstreams and removed while replicas are built
+            self.retire_containers(removed)
+            self.remove_containers(removed)
+
+        # First failure is raised once every replica is done
+        results = [future.result() for future in futures]
+
+        return results + [
+            container.get("Id", '') for replica in range(1, replicas + 1) if replica not in built
+            for container in by_replica.get(replica, [])
+        ]
+
+    def get_replica(self, container):
+        """
+        Get number of replica of container, containers without label are replica 1
+        :param container: Container in list format
+        :return: Returns int
+        """
+        try:
+            return int(self.inventory.get_labels(container).get(self.REPLICA_LABEL) or 1)
+        except ValueError:
+            return 1
+
+    @staticmethod
+    def get_replica_name(service_name, replica):
+        """
+        Get name of container of replica, replica 1 is named after service so links keep working
+        :param service_name: Name of service
+        :param replica: Number of replica
+        :return: Returns string
+        """
+        if replica == 1:
+            return service_name
+
+        return "{service_name}-{replica}".format(service_name=service_name, replica=replica)
+
+    def build_replica(self, service_name, replica, containers):
+        """
+        Reconcile replica of service with its definition, containers are recreated only when
+        their configuration changed, running containers are replaced without downtime
+        :param service_name: Name of service
+        :param replica: Number of replica
+        :param containers: Containers of replica
+        :return: Returns id of container of replica
+        """
+        service = self.services[service_name]
+        name = self.get_replica_name(service_name, replica)
+
+        # Replicas share configuration and its hash, only replica label differs
+        config = self.create_container_config(service_name)
+        config_hash = self.create_config_hash(config)
+        config["labels"][self.CONFIG_HASH_LABEL] = config_hash
+        config["labels"][self.REPLICA_LABEL] = str(replica)
+
+        # Legacy links are bound to container, services linking recreated service are recreated as well
+        recreated_links = [link for link in service.links if link.split(":")[0] in self.recreated]
+
+        current = [container for container in containers
+                   if self.inventory.get_labels(container).get(self.CONFIG_HASH_LABEL) == config_hash
+                   and not recreated_links]
+        outdated = [container for container in containers if container not in current]
+
+        if current:
+            self.print("Service exists {name}".format(name=name))
+
+            for container in outdated:
+                self.remove_container(container)
+
+            for container in current:
+                status = container.get("Status")
+                if status == 'Created' or status.startswith("Exited"):
+                    container_id = container.get("Id", '')
+                    self.start_container(container_id)
+                    self.inventory.update(container_id)
+
+            return current[0].get("Id", '')
+
+        running = [container for container in outdated if self.inventory.is_running(container)]
 
-            image = service.get("image", '')
+        with self.lock:
+            self.recreated.add(service_name)
 
-            if service.get("repository", False) and service.get("repository", {}).get("registry", False):
-                self.print("Pulling {image}".format(image=image))
+        if not running:
+            for container in outdated:
+                self.remove_container(container)
 
-                for l in self.client.pull(image, stream=True):
-                    # Decode and convert format from json to dict
-                    l = json.loads(l.decode("utf-8"))
+            with metrics.stage("create"):
+                container_id = self.create_container(name, config)
+            return self.start(service_name, container_id, replica)
 
-                    # Print status and progress if available
-                    self.print("Status: {status}:   Progress: {progress}".format(
-                        status=l.get("status"),
-                        progress=l.get("progress"),
-                    ))
+        # Start new container next to the old one, switch traffic once it is ready and remove old container
+        self.print("Service changed, replacing {name}".format(name=name))
 
-            self.print("Using image: {image}".format(image=image))
+        replacement_name = "{name}-{config_hash}".format(name=name, config_hash=config_hash[:12])
+        with metrics.stage("create"):
+            container_id = self.create_container(replacement_name, config)
 
-            # networking_config = client.create_networking_config({
-            #     project_name: client.create_endpoint_config()
-            # })
+        with self.lock:
+            self.starting.add(container_id)
 
-            links = {}
-            for link in service.get("links", {}):
-                links[link] = link
+        try:
+            self.start(service_name, container_id, replica)
+        except (FailedToDeployService, docker_errors.APIError):
+            self.print("Replacement failed, keeping old container")
+            self.client.remove_container(container=container_id, force=True)
+            self.inventory.remove(container_id)
+            raise
+        finally:
+            with self.lock:
+                self.starting.discard(container_id)
+
+        with self.lock:
+            self.retired.update(container.get("Id") for container in outdated)
+
+        if self.save():
+            self.reload_nginx()
+
+        for container in outdated:
+            self.remove_container(container)
+
+        self.client.rename(container=container_id, name=name)
+        self.inventory.update(container_id)
+
+        return container_id
+
+    def create_container_config(self, service_name):
+        """
+        Create arguments of create_container for service
+        :param service_name: Name of service
+        :return: Returns dict
+        """
+        service = self.services[service_name]
+
+        # Options passed to docker as they are
+        options = service.options
+
+        # networking_config = client.create_networking_config({
+        #     project_name: client.create_endpoint_config()
+        # })
+
+        links = {}
+        for link in service.links:
+            links[link] = link
+
+        host_config = self.client.create_host_config(
+            binds=None,
+            port_bindings=None,
+            lxc_conf=None,
+            publish_all_ports=False,
+            links=links,
+            privileged=options.get("privileged", False),
+            dns=options.get("dns", None),
+            dns_search=None,
+            volumes_from=options.get("volumes_from", None),
+            network_mode="bridge",
+            restart_policy=options.get("restart", None),
+            cap_add=None,
+            cap_drop=None,
+            devices=None,
+            extra_hosts=options.get("extra_hosts", None),
+            read_only=None,
+            pid_mode=None,
+            ipc_mode=None,
+            security_opt=None,
+            log_config=None,
+            cgroup_parent=None,
+            group_add=None,
+            **service.resources
+        )
+
+        labels = {
+            "com.tower.application": self.application_name_slugify,
+            "com.tower.service": service_name,
+            "com.tower.application_environment": self.environment_name
+        }
+
+        service_labels = options.get("labels", {})
+
+        labels = {**service_labels, **labels}
+
+        return dict(
+            image=service.image,
+            hostname=options.get("hostname", None),
+            user=options.get("user", None),
+            detach=False,
+            stdin_open=False,
+            tty=False,
+            ports=options.get("ports", None),
+            environment=options.get("environment", None),
+            dns=options.get("dns", None),
+            volumes=options.get("volumes", None),
+            network_disabled=options.get("network_disabled", False),
+            entrypoint=options.get("entrypoint", None),
+            working_dir=options.get("working_dir", None),
+            domainname=options.get("domainname", None),
+            mac_address=options.get("mac_address", None),
+            volume_driver=options.get("volume_driver", None),
+            stop_signal=options.get("stop_signal", None),
+            networking_config=None,
+            host_config=host_config,
+            labels=labels,
+        )
+
+    def create_config_hash(self, config):
+        """
+        Create hash of container configuration, includes id of image so a new image pushed under the same tag
+        is detected as change
+        :param config: Arguments of create_container
+        :return: Returns string
+        """
+        try:
+            image_id = self.client.inspect_image(config.get("image")).get("Id", '')
+        except docker_errors.APIError:
+            image_id = ''
+
+        payload = json.dumps({"config": config, "image_id": image_id}, sort_keys=True, default=str)
+
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def start(self, service_name, container_id, replica=1):
+        """
+        Start container of service, wait until it is ready and run before deploy commands
+        :param service_name: Name of service
+        :param container_id: Id of created container
+        :param replica: Number of replica, before deploy commands run only in replica 1
+        :return: Returns id of container
+        """
+        service = self.services[service_name]
+
+        links = {}
+        for link in service.links:
+            links[link] = link
+
+        with metrics.stage("start"):
+            self.start_container(container_id)
+        self.inventory.update(container_id)
+
+        # Wait until container is running and healthy or has exited
+        readiness = service.options.get("readiness", {})
+        with metrics.stage("readiness") as stage:
+            status, state = self.readiness.wait(container_id, timeout=readiness.get("timeout"), probe=readiness)
+
+            # Services which finished successfully, e.g. migrations, don't block their dependents
+            exited = status == docker_readiness.Readiness.EXITED and state.get("ExitCode") == 0
+            ready = exited or status in (docker_readiness.Readiness.UP, docker_readiness.Readiness.HEALTHY)
+
+            if not ready:
+                stage.outcome = metrics.FAILURE
+
+        self.print("Service return status: {status}".format(status=status))
+
+        if exited:
+            return container_id
+
+        if not ready:
+            raise FailedToDeployService("Service {service_name} is {status}".format(service_name=service_name,
+                                                                                   status=status))
+
+        if replica != 1:
+            return container_id
+
+        for command in service.options.get("before_deploy_commands", {}):
+            with metrics.stage("exec"):
+                self.run_command(service_name, container_id, command, links)
+
+        return container_id
+
+    def run_command(self, service_name, container_id, command, links):
+        """
+        Run before deploy command, in container of service or in new container of other image
+        :param service_name: Name of service
+        :param container_id: Id of container of service
+        :param command: Command, starts with name of service or image
+        :param links: Links of service
+        :return: Returns void
+        """
+        command_parts = command.split(" ")
+        command_container = command_parts[0]
+
+        if command_container == service_name:
+            self.print("Executing command on container: {command}".format(command=command))
+            command = command.replace(command_container, '').lstrip()
+
+            # Output is streamed from shared connections, stdout and stderr are printed alike
+            try:
+                exec_id = docker_aio.run(self.async_client.exec_create(container_id, shlex.split(command))).get("Id")
+
+                for _, output in docker_aio.iterate(self.async_client.exec_start(exec_id)):
+                    self.print(output.decode('UTF-8').strip())
+            except (DockerAPIError, OSError, asyncio.TimeoutError) as e:
+                raise FailedToDeployService("Command {command} failed: {error}".format(command=command, error=e))
+
+        else:
+
+            parser = argparse.ArgumentParser(description='Docker run argument parser')
+
+            parser.add_argument('--privileged', action="store_true", dest="privileged", default=False)
+            parser.add_argument('--volumes-from', action="store", dest="volumes_from", type=str)
+            parser.add_argument('-p', action="store", dest="p", type=list)
+            parser.add_argument('-v', action="store", dest="v", type=list)
+
+            command_arguments = parser.parse_args(command_parts)
 
             host_config = self.client.create_host_config(
-                binds=None,
-                port_bindings=None,
-                lxc_conf=None,
                 publish_all_ports=False,
                 links=links,
-                privileged=service.get("privileged", False),
-                dns=service.get("dns", None),
-                dns_search=None,
-                volumes_from=service.get("volumes_from", None),
+                privileged=command_arguments.privileged,
+                volumes_from=command_arguments.volumes_from,
                 network_mode="bridge",
-                restart_policy=service.get("restart", None),
-                cap_add=None,
-                cap_drop=None,
-                devices=None,
-                extra_hosts=service.get("extra_hosts", None),
-                read_only=None,
-                pid_mode=None,
-                ipc_mode=None,
-                security_opt=None,
-                ulimits=None,
-                log_config=None,
-                mem_limit=None,
-                memswap_limit=None,
-                mem_swappiness=None,
-                cgroup_parent=None,
-                group_add=None,
-                cpu_quota=None,
-                cpu_period=None,
-                blkio_weight=None,
-                blkio_weight_device=None,
-                device_read_bps=None,
-                device_write_bps=None,
-                device_read_iops=None,
-                device_write_iops=None,
-                oom_kill_disable=False,
-                shm_size=None,
-                tmpfs=None,
-                oom_score_adj=None,
             )
 
-            labels = {
-                "com.tower.application": self.application_name_slugify,
-                "com.tower.service": service_name,
-                "com.tower.application_environment": self.environment_name
-            }
-
-            service_labels = service.get("labels", {})
-
-            labels = {**service_labels, **labels}
-
-            container = self.client.create_container(
-                image=image,
-                hostname=service.get("hostname", None),
-                user=service.get("user", None),
+            command_container_id = self.create_container(None, dict(
+                image=command_container,
                 detach=False,
                 stdin_open=False,
                 tty=False,
-                mem_limit=service.get("mem_limit", None),
-                ports=service.get("ports", None),
-                environment=service.get("environment", None),
-                dns=service.get("dns", None),
-                volumes=service.get("volumes", None),
-                network_disabled=service.get("network_disabled", False),
-                entrypoint=service.get("entrypoint", None),
-                cpu_shares=service.get("cpu_shares", None),
-                working_dir=service.get("working_dir", None),
-                domainname=service.get("domainname", None),
-                memswap_limit=service.get("memswap_limit", None),
-                cpuset=service.get("cpuset", None),
-                mac_address=service.get("mac_address", None),
-                volume_driver=service.get("volume_driver", None),
-                stop_signal=service.get("stop_signal", None),
-                networking_config=None,
-                host_config=host_config,
-                labels=labels,
-                name=service_name,
-            )
+                volumes=command_arguments.v,
+                host_config=host_config
+            ))
+            self.start_container(command_container_id)
+
+    def create_container(self, name, config):
+        """
+        Create container on asyncio client, arguments are converted to configuration of docker API by docker client
+        :param name: Name of container, None for generated name
+        :param config: Arguments of create_container of docker client
+        :return: Returns id of container
+        """
+        try:
+            return docker_aio.run(self.async_client.create_container(
+                self.client.create_container_config(command=None, **config), name
+            )).get("Id", '')
+        except (DockerAPIError, OSError, asyncio.TimeoutError) as e:
+            raise FailedToDeployService("Failed to create container {name}: {error}".format(
+                name=name or config.get("image"),
+                error=e
+            ))
+
+    def start_container(self, container_id):
+        """
+        Start container on asyncio client
+        :param container_id: Id of container
+        :return: Returns void
+        """
+        try:
+            docker_aio.run(self.async_client.start(container_id))
+        except (DockerAPIError, OSError, asyncio.TimeoutError) as e:
+            raise FailedToDeployService("Failed to start container {id}: {error}".format(id=container_id[:12],
+                                                                                       error=e))
+
+    def remove_container(self, container):
+        self.print("Removing {name}".format(name=self.inventory.get_name(container)))
+        with metrics.stage("remove"):
+            self.client.stop(container=container.get("Id"))
+            self.client.remove_container(container=container.get("Id"))
+        self.inventory.remove(container.get("Id"))
+
+        with self.lock:
+            self.retired.discard(container.get("Id"))
+
+    def retire_containers(self, containers):
+        """
+        Stop sending traffic to containers before they are removed, nginx is reloaded without them
+        :param containers: Containers in list format
+        :return: Returns void
+        """
+        if not containers:
+            return
 
-            container_id = container.get("Id", '')
-            self.client.start(container=container_id)
-
-            status = "Created"
-            container = self.client.containers(filters={
-                "label": "com.tower.service={service_name}".format(service_name=service_name),
-                "name": service_name,
-            }, all=True)[0]
-
-            while status == 'Created':
-                container_status = container.get("Status")
-                if container_status.startswith("Up"):
-                    status = "Up"
-                elif container_status.startswith("Exited"):
-                    status = "Exited"
-
-            self.print("Service return status: {status}".format(status=status))
-
-            if status == 'Up':
-                for command in service.get("before_deploy_commands", {}):
-                    command_parts = command.split(" ")
-                    command_container = command_parts[0]
-
-                    if command_container == service_name:
-                        self.print("Executing command on container: {command}".format(command=command))
-                        command = command.replace(command_container, '').lstrip()
-                        exec_id = self.client.exec_create(
-                            container=container_id,
-                            cmd=command
-                        )
-                        response = self.client.exec_start(
-                            exec_id=exec_id,
-                            stream=True,
-                            detach=False
-                        )
-
-                        for s in response:
-                            self.print(s.decode('UTF-8').strip())
-
-                    else:
-
-                        parser = argparse.ArgumentParser(description='Docker run argument parser')
-
-                        parser.add_argument('--privileged', action="store_true", dest="privileged", default=False)
-                        parser.add_argument('--volumes-from', action="store", dest="volumes_from", type=str)
-                        parser.add_argument('-p', action="store", dest="p", type=list)
-                        parser.add_argument('-v', action="store", dest="v", type=list)
-
-                        command_arguments = parser.parse_args(command_parts)
-
-                        host_config = self.client.create_host_config(
-                            publish_all_ports=False,
-                            links=links,
-                            privileged=command_arguments.privileged,
-                            volumes_from=command_arguments.volumes_from,
-                            network_mode="bridge",
-                        )
-
-                        container = self.client.create_container(
-                            image=command_container,
-                            detach=False,
-                            stdin_open=False,
-                            tty=False,
-                            volumes=command_arguments.v,
-                            host_config=host_config
-                        )
-
-                        container_id = container.get("Id", '')
-                        self.client.start(container=container_id)
+        with self.lock:
+            self.retired.update(container.get("Id") for container in containers)
 
-            return container_id
+        if self.save():
+            self.reload_nginx()
 
-        else:
-            self.print("Service exists {service_name}".format(service_name=service_name))
+    def remove_containers(self, containers):
+        """
+        Stop and remove containers concurrently on asyncio client, without thread per container
+        :param containers: Containers in list format
+        :return: Returns void
+        """
+        if not containers:
+            return
 
-            for container in containers:
-                status = container.get("Status")
-                if status == 'Created' or status.startswith("Exited"):
-                    container_id = container.get("Id", '')
-                    self.client.start(container=container_id)
+        for container in containers:
+            self.print("Removing {name}".format(name=self.inventory.get_name(container)))
+
+        async def remove(container_id):
+            await self.async_client.stop(container_id)
+            await self.async_client.remove_container(container_id)
+
+        with metrics.stage("remove"):
+            results = docker_aio.run(docker_aio.gather([remove(container.get("Id")) for container in containers],
+                                                       return_exceptions=True))
+
+        errors = []
+        for container, result in zip(containers, results):
+            if isinstance(result, BaseException):
+                errors.append(result)
+                continue
+
+            self.inventory.remove(container.get("Id"))
+
+            with self.lock:
+                self.retired.discard(container.get("Id"))
+
+        if errors:
+            raise FailedToDeployService(str(errors[0]))
+
+    def reload_nginx(self):
+        """
+        Validate configuration and reload nginx, concurrent requests are served by single reload
+        :return: Returns bool
+        """
+        self.print("Reloading nginx")
+
+        with metrics.stage("nginx_reload") as stage:
+            valid, output = self.reloader.reload(self.nginx)
+
+            if not valid:
+                stage.outcome = metrics.FAILURE
+
+        if not valid:
+            self.print("Failed to reload nginx, previous virtual hosts restored: {output}".format(
+                output=output.strip()
+            ))
+
+        return valid
 
     def save(self):
-        containers = self.client.containers(filters={
-            "label": "com.tower.application" + "=" + self.application_name_slugify
-        })
+        """
+        Write nginx configuration of services with virtual host, every service gets upstream with all its containers,
+        only changed files are written and files of removed services are deleted
+        :return: Returns bool, True if configuration changed
+        """
+        with self.lock:
+            # Containers being started or replaced don't receive traffic
+            excluded = self.starting | self.retired
+            containers = [container for container in
+                          self.inventory.by_application(self.application_name_slugify, running=True)
+                          if container.get("Id") not in excluded]
 
-        application_containers = []
+        # Upstreams by service name
+        upstreams = {}
 
         for container in containers:
             network_mode = container.get("HostConfig", {}).get("NetworkMode", '')
             ip = container.get("NetworkSettings", {}).get("Networks").get(network_mode, {}).get("IPAddress")
-            inspect = self.client.inspect_container(container.get("Id"))
-            name = container.get("Name", '')
-            name = name.replace("/", '')
-            virtual_host = ''
-
-            for i in inspect.get("Config", {}).get("Env", {}):
-                match = re.match('VIRTUAL_HOST=\\"(.*)\\"', i)
-                match2 = re.match('VIRTUAL_HOST=(.*)', i)
-
-                if match:
-                    virtual_host = match.group(1)
-                elif match2:
-                    virtual_host = match2.group(1)
-
-            application_container = {
-                "ServiceName": name,
-                "IpAddress": ip,
-                "VirtualHost": virtual_host
-            }
-
-            application_containers.append(application_container)
-
-        if application_containers:
-            for container in application_containers:
-                virtual_host = container.get("VirtualHost")
-                name = container.get("ServiceName")
-                ip_address = container.get("IpAddress")
-
-                if virtual_host != '':
-                    nginx_configuration = self.template.render({
-                        'virtual_host': virtual_host,
-                        'ip_address': ip_address,
-                        "port": "80"
-                    })
-
-                    with open('/etc/nginx/conf.d/' + name, 'w') as file:
-                        file.write(nginx_configuration)
-        return True
+            inspect = self.inventory.inspect(container.get("Id"))
+            name = self.inventory.get_labels(container).get("com.tower.service") or self.inventory.get_name(container)
+            environment = inspect.get("Config", {}).get("Env", []) or []
+            virtual_host = self.get_environment_variable(environment, "VIRTUAL_HOST")
+
+            if virtual_host == '':
+                continue
+
+            upstream = upstreams.setdefault(name, {
+                "virtual_host": virtual_host,
+                "port": self.get_service_port(name, environment),
+                "servers": []
+            })
+
+            if ip:
+                upstream["servers"].append(ip)
+
+        with self.save_lock, metrics.stage("nginx_render"):
+            changed = False
+            written = set()
+
+            for name, upstream in sorted(upstreams.items()):
+                # Files are named by application and service, nginx includes only *.conf files
+                file_name = "{application}.{service_name}.conf".format(application=self.application_name_slugify,
+                                                                       service_name=name)
+                written.add(file_name)
+
+                # Upstream without servers is invalid, previous configuration is kept
+                if not upstream.get("servers"):
+                    continue
+
+                options = self.get_proxy_options(name)
+                nginx_configuration = self.template.render({
+                    "upstream": slugify.slugify("{application}_{service_name}".format(
+                        application=self.application_name_slugify,
+                        service_name=name
+                    ), separator="_"),
+                    "virtual_host": upstream.get("virtual_host"),
+                    "servers": sorted(upstream.get("servers")),
+                    "port": upstream.get("port"),
+                    "method": options.get("method") if options.get("method") != "round_robin" else None,
+                    "keepalive": options.get("keepalive"),
+                    "max_fails": options.get("max_fails"),
+                    "fail_timeout": options.get("fail_timeout"),
+                    "connect_timeout": options.get("connect_timeout"),
+                    "send_timeout": options.get("send_timeout"),
+                    "read_timeout": options.get("read_timeout"),
+                    "buffering": options.get("buffering"),
+                    "buffer_size": options.get("buffer_size"),
+                    "buffers": options.get("buffers"),
+                })
+
+                if self.nginx.write(file_name, nginx_configuration):
+                    self.print("Updated virtual host {virtual_host}".format(virtual_host=upstream.get("virtual_host")))
+                    changed = True
+
+            for name in self.nginx.prune(written):
+                self.print("Removed virtual host of {name}".format(name=name))
+                changed = True
+
+        return changed
+
+    def get_proxy_options(self, service_name):
+        """
+        Get proxy options of service, set in proxy block of service
+        :param service_name: Name of service
+        :return: Returns dict
+        """
+        options = {**self.PROXY_DEFAULTS, **self.get_service_options(service_name).get("proxy", {})}
+
+        if options.get("method") not in self.LOAD_BALANCING_METHODS:
+            self.print("Unknown load balancing method {method} of {service_name}, using round_robin".format(
+                method=options.get("method"),
+                service_name=service_name
+            ))
+            options["method"] = "round_robin"
+
+        return options
+
+    def get_service_options(self, service_name):
+        """
+        Get options of service, containers of services removed from environment have none
+        :param service_name: Name of service
+        :return: Returns dict
+        """
+        service = self.services.get(service_name)
+
+        return service.options if service is not None else {}
+
+    def get_service_port(self, service_name, environment):
+        """
+        Get port of service receiving traffic, taken from proxy block, VIRTUAL_PORT, expose or ports of service
+        :param service_name: Name of service
+        :param environment: Environment of container
+        :return: Returns string
+        """
+        options = self.get_service_options(service_name)
+
+        port = options.get("proxy", {}).get("port") or self.get_environment_variable(environment, "VIRTUAL_PORT")
+        if port:
+            return str(port)
+
+        for port in options.get("expose", []) + options.get("ports", []):
+            # Container port of <host>:<container>/<protocol>
+            return str(port).split(":")[-1].split("/")[0]
+
+        return "80"
+
+    @staticmethod
+    def get_environment_variable(environment, name):
+        """
+        Get value of variable from environment of container
+        :param environment: List of variables in format <name>=<value>
+        :param name: Name of variable
+        :return: Returns string, empty if variable is missing
+        """
+        value = ''
+
+        for i in environment:
+            match = re.match(name + '=\\"(.*)\\"', i)
+            match2 = re.match(name + '=(.*)', i)
+
+            if match:
+                value = match.group(1)
+            elif match2:
+                value = match2.group(1)
+
+        return value
 
     @staticmethod
     def print(message, end="\n"):
-        print("===> {message}".format(message=message), end=end)
+        log.emit(message, end=end)
 
     @staticmethod
     def print_stream(message, service_name):
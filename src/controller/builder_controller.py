@@ -1,17 +1,37 @@
 import os
 import json
-import string
-import random
-from requests.exceptions import HTTPError
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from src.exceptions import FailedToBuildImage
 from src.exceptions import FailedToCloneRepository
 from src.exceptions import FailedToLoginToRegistry
-from src.core.git.git import Git
-from sh import ErrorReturnCode_128
-from docker import Client
-from docker.errors import APIError
+from src.exceptions import FailedToPushImage
+from src.exceptions import InvalidApplication
+from src.exceptions import InvalidConfiguration
+from src.exceptions import DockerAPIError
+from src.core import model
+from src.core.git.cache import RepositoryCache
+from src.core.units import parse_size, format_size
+from src.core.lazy import lazy
+from src.core import log
+from src.core import metrics
 from cement.core.controller import CementBaseController, expose
 
+# Imported by commands which use them
+asyncio = lazy("asyncio")
+scheduler = lazy("src.core.scheduler")
+sh = lazy("sh")
+git = lazy("src.core.git.git")
+docker_errors = lazy("docker.errors")
+docker_client = lazy("src.core.docker.client")
+docker_aio = lazy("src.core.docker.aio")
+docker_push = lazy("src.core.docker.push")
+docker_registry = lazy("src.core.docker.registry")
+docker_context = lazy("src.core.docker.context")
+docker_stream = lazy("src.core.docker.stream")
+daemon_client = lazy("src.core.daemon.client")
+
 
 class BuilderController(CementBaseController):
     """
@@ -22,22 +42,78 @@ class BuilderController(CementBaseController):
         stacked_on = 'base'
         stacked_type = 'nested'
         description = "Management of builders"
+        arguments = [
+            (['-j', '--jobs'], dict(action='store', type=int, default=1,
+                                    help='Number of services built in parallel')),
+        ]
+
+    # Label and tag prefix of image fingerprint
+    FINGERPRINT_LABEL = "com.tower.fingerprint"
+    FINGERPRINT_TAG = "tower-"
 
-    repositories = {}
+    # Versions of docker API which added labels and cache_from of build
+    LABELS_API_VERSION = "1.23"
+    CACHE_FROM_API_VERSION = "1.25"
 
-    def __init__(self, *args, **kw):
+    def __init__(self, *args, environment=None, **kw):
+        """
+        :param environment: Environment of command, commands run by daemon pass environment of their job
+        """
         super().__init__(*args, **kw)
+
+        # Commands run from command line are sent to daemon when one is running
+        self.standalone = environment is None
+        self.environ = os.environ if environment is None else environment
+
+        # Pushes of all services share connections to registries
+        self.push_scheduler = None
+        self.push_scheduler_lock = threading.Lock()
+
+        # Clients of registry API by registry url
+        self.registries = {}
+
+        # Jobs of all tower processes of host are limited by scheduler
+        self.scheduler = None
+
+    def setup(self):
+        """
+        Connect to docker and load application, done by commands which need it
+        :return: Returns void
+        """
+        # Application settings, comes from environment, parsed and validated before any clone starts
+        self.model = model.load(self.environ)
+
+        # Cloned repositories are kept between builds, cache settings come from environment
+        budget = self.environ.get("TOWER_CACHE_BUDGET", '')
+        try:
+            budget = parse_size(budget)
+        except ValueError:
+            raise InvalidConfiguration("TOWER_CACHE_BUDGET is not a size, e.g. 10g: {value}".format(value=budget))
+
+        max_age = self.environ.get("TOWER_CACHE_MAX_AGE", '')
+        try:
+            max_age = float(max_age) * 86400 if max_age else None
+        except ValueError:
+            raise InvalidConfiguration("TOWER_CACHE_MAX_AGE is not a number of days: {value}".format(value=max_age))
+
+        self.cache = RepositoryCache(
+            root=self.environ.get("TOWER_CACHE_DIR", '') or "/storage/repositories",
+            budget=budget,
+            max_age=max_age
+        )
+
         # Connect client to docker, uses local docker
-        self.client = Client(base_url='unix://var/run/docker.sock', version='auto')
+        self.client = docker_client.get_client()
 
-        # Application settings, comes from environment
-        self.application = json.loads(os.environ.get("APPLICATION", {})) or {}
-        self.environment_name = os.environ.get("APPLICATION_ENVIRONMENT", {}) or ''
+        # Batches of requests run concurrently on asyncio client
+        self.async_client = docker_client.get_async_client()
 
-        self.environment = self.application.get("environments", {}).get(self.environment_name, {})
+        # Application settings
+        self.application_name = self.model.application_name
+        self.environment_name = self.model.name
 
-        # List of services in application
-        self.services = self.environment.get("services", {})
+        # Services of environment by name, parsed by model
+        self.services = self.model.services
 
     @expose(hide=True)
     def default(self):
@@ -53,34 +129,13 @@ class BuilderController(CementBaseController):
         Builds an image, command is executed by client
         :return: Outputs json
         """
+        if self.standalone and daemon_client.delegate("builder.build", self.environ, {"jobs": self.app.pargs.jobs}):
+            return
 
-        # List of all images
-        images = {}
-
-        # Login to registries
-        registries = self.environment.get("registry", {})
-
-        if type(registries) is dict:
-            for registry_name, registry in registries.items():
-                self.login_to_registry(registry)
-
-        # Try building a service
         try:
-            for service_name in self.services:
-                service = self.services.get(service_name, {})
-                service = self.build_service(service, service_name)
-
-                images[service_name] = service
-
-            # On success respond with json
-            print(json.dumps({
-                'status': 'success',
-                'success': True,
-                'data': images
-            }))
-
-        except FailedToLoginToRegistry as e:
-            self.print('Failed to login to registry!')
+            self.setup()
+        except InvalidApplication as e:
+            self.print('Invalid application!')
             print(json.dumps({
                 'status': 'failed',
                 'success': False,
@@ -88,9 +143,9 @@ class BuilderController(CementBaseController):
                     "message": str(e)
                 }
             }))
-
-        except FailedToBuildImage as e:
-            self.print('Failed to build image!')
+            return False
+        except InvalidConfiguration as e:
+            self.print('Invalid configuration!')
             print(json.dumps({
                 'status': 'failed',
                 'success': False,
@@ -98,9 +153,26 @@ class BuilderController(CementBaseController):
                     "message": str(e)
                 }
             }))
+            return False
+
+        # Stages of all services are measured with labels of command
+        log.set_labels(command="builder.build", application=self.application_name,
+                       environment=self.environment_name)
+
+        # List of all images
+        images = {}
+
+        # Services which failed to build, with reason
+        errors = {}
+
+        # Login to registries
+        try:
+            for registry in self.model.registries.values():
+                self.login_to_registry(registry)
 
-        except FailedToCloneRepository as e:
-            self.print('Failed to clone repository!')
+        except FailedToLoginToRegistry as e:
+            self.print('Failed to login to registry!')
+            metrics.flush()
             print(json.dumps({
                 'status': 'failed',
                 'success': False,
@@ -108,11 +180,89 @@ class BuilderController(CementBaseController):
                     "message": str(e)
                 }
             }))
+            return False
+
+        jobs = max(self.app.pargs.jobs or 1, 1)
+        self.print("Building {count} services using {jobs} workers".format(count=len(self.services), jobs=jobs))
+
+        # Build services in pool, each service prints with its own prefix
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {}
+
+            for service_name, service in self.services.items():
+                future = executor.submit(log.bind(self.schedule_service, prefix=service_name, service=service_name), service, service_name)
+                futures[future] = service_name
+
+            for future in as_completed(futures):
+                service_name = futures[future]
+
+                # Try building a service
+                try:
+                    images[service_name] = future.result()
+
+                except FailedToBuildImage as e:
+                    self.print('Failed to build image for {service_name}!'.format(service_name=service_name))
+                    errors[service_name] = str(e)
+
+                except FailedToCloneRepository as e:
+                    self.print('Failed to clone repository for {service_name}!'.format(service_name=service_name))
+                    errors[service_name] = str(e)
+
+                except FailedToPushImage as e:
+                    self.print('Failed to push image for {service_name}!'.format(service_name=service_name))
+                    errors[service_name] = str(e)
+
+        if self.push_scheduler is not None:
+            self.push_scheduler.shutdown()
+
+        # Keep cache of repositories within its budget
+        for origin in self.cache.evict():
+            self.print("Evicted cached repository {origin}".format(origin=origin))
+
+        metrics.flush()
+
+        if errors:
+            print(json.dumps({
+                'status': 'failed',
+                'success': False,
+                'data': images,
+                'errors': errors
+            }))
+            return False
+
+        # On success respond with json
+        print(json.dumps({
+            'status': 'success',
+            'success': True,
+            'data': images
+        }))
+
+    def schedule_service(self, service, service_name):
+        """
+        Build a service once scheduler of host gives it a slot, identical builds wait for the first one
+        and reuse its images
+        :param service: Service
+        :param service_name: Name of service
+        :return: Returns array of images
+        """
+        # Services without repository are not built
+        if service.repository is None:
+            return self.build_service(service, service_name)
+
+        with self.get_scheduler().slot("build", self.application_name,
+                                       key=self.create_job_key(service)) as slot:
+            if slot.coalesced:
+                self.print("Identical build finished, its images are reused")
+                return slot.result
+
+            slot.result = self.build_service(service, service_name)
+
+            return slot.result
 
     def build_service(self, service, service_name):
         """
         Build a service
-        :param service: Service is a list of options for service simmilar to docker-compose service v2
+        :param service: Service, its options are simmilar to docker-compose service v2
         :param service_name: Name of service
         :return: Returns array of images for both repository and non-private-repository images
         """
@@ -122,37 +272,81 @@ class BuilderController(CementBaseController):
 
         # If service has repository option, tower builds image,
         # aliases and then image is pushed to registry
-        repository = service.get('repository', False)
-
-        if repository and type(repository) is dict:
+        repository = service.repository
 
-            # Repository options
-            repository = service.get("repository", {})
-            image = repository.get('image', {})
-            registries = repository.get("registry", [])
+        if repository is not None:
 
             # Image options
-            aliases = image.get('aliases', [])
-            image_name = image.get("name", '')
+            aliases = list(repository.aliases)
+            image_name = repository.image_name
 
             # Docker options
-            dockerfile = service.get("dockerfile", 'Dockerfile')
+            dockerfile = service.dockerfile
+            context = service.context
+            build_args = service.build_args
+
+            origin = repository.origin
+            clone_options = self.get_clone_options(repository.options, context)
+            variant = self.create_clone_variant(clone_options, self.get_branch(repository.options))
+
+            # Urls of registries image is pushed to
+            urls = service.registry_urls
+
+            # Fingerprint tag is pushed unless registries already have image with the same fingerprint
+            push_fingerprint = True
 
-            origin = repository.get("origin", '')
-            path = self.repositories.get(origin, False)
-            if not path:
-                # Set path to repository
-                path = "/storage/{random}".format(random=self.create_random())
+            # Checkout is shared by services and builders with same origin, hold it until image is built
+            with self.cache.lock(origin, variant) as path:
+                tag = self.get_repository(repository.options, path, clone_options, variant)
+                tagged_image = self.create_tagged_image_name(image_name, tag)
 
-            tag = self.get_repository(repository, path)
-            tagged_image = self.create_tagged_image_name(image_name, tag)
+                # Unchanged images are not built again
+                with git.Git.repo(path) as repo:
+                    fingerprint = self.create_fingerprint(repo, context, dockerfile, build_args)
+                fingerprint_tag = self.create_fingerprint_tag(fingerprint)
+                fingerprint_image = self.create_tagged_image_name(image_name, fingerprint_tag)
 
-            # Build image
-            # TODO: Run pre_build commands
-            self.build_image(tagged_image, path, dockerfile)
+                if urls and all(self.get_registry(url).exists(image_name, fingerprint_tag) for url in urls):
+                    self.print("Image with fingerprint {fingerprint} exists in registries, skipping build".format(
+                        fingerprint=fingerprint_tag
+                    ))
+                    push_fingerprint = False
+
+                    # Aliases are pushed again so they point to this image, registries have all its layers
+                    if not self.image_exists(fingerprint_image):
+                        self.pull_fingerprint_image(image_name, fingerprint_tag, urls[0])
+
+                    self.alias_image(fingerprint_image, [(image_name, tag)])
+
+                elif self.image_exists(fingerprint_image):
+                    self.print("Image with fingerprint {fingerprint} exists, skipping build".format(
+                        fingerprint=fingerprint_tag
+                    ))
+                    self.alias_image(fingerprint_image, [(image_name, tag)])
+
+                else:
+                    # Previous image of tag seeds build cache, pulled only when docker API can use it
+                    cache_from = []
+                    if self.async_client.version_at_least(self.CACHE_FROM_API_VERSION):
+                        cache_from = self.pull_previous_image(image_name, [tag] + aliases, urls)
+                    else:
+                        self.print("Docker API {version} doesn't support cache_from, "
+                                   "previous image is not pulled".format(version=self.async_client.version))
+
+                    # Build image
+                    # TODO: Run pre_build commands
+                    self.build_image(tagged_image, os.path.join(path, context), dockerfile, build_args=build_args,
+                                     labels={self.FINGERPRINT_LABEL: fingerprint}, cache_from=cache_from)
+                    self.alias_image(tagged_image, [(image_name, fingerprint_tag)])
 
             # Add tag for repository
-            aliases.append(tag)
+            aliases = aliases + [tag]
+
+            # Images tagged for registries, pushed after all aliases are created
+            pushes = []
+
+            # Aliases of image, tagged at once
+            tags = []
 
             # Create aliases by tagging repository image and
             # push it to repository
@@ -164,35 +358,39 @@ class BuilderController(CementBaseController):
                 # Tagged image with empty registry
                 registry_tagged_image = self.create_tagged_image_name(image_name, alias)
 
-                if registries is False:
-                    pass
-                else:
-                    # Loop through registries and push images to them
-                    for registry_name in registries:
-                        # If registry exists
-                        if self.environment.get("registry", {}).get(registry_name, False):
-                            # Create url for registry
-                            host = self.environment.get("registry", {}).get(registry_name, {}).get("host", 'localhost')
-                            port = self.environment.get("registry", {}).get(registry_name, {}).get("port", '5000')
-                            url = "{host}:{port}".format(host=host, port=port)
+                # Loop through registries and push images to them
+                for url in urls:
+                    # Registry image name
+                    registry_image = self.create_registry_image_name(image_name, url)
 
-                            # Registry image name
-                            registry_image = self.create_registry_image_name(image_name, url)
+                    # Create repository tagged image name for pushing
+                    registry_tagged_image = self.create_repository_tagged_image_name(image_name, alias, url)
 
-                            # Create repository tagged image name for pushing
-                            registry_tagged_image = self.create_repository_tagged_image_name(image_name, alias, url)
+                    # Alias image with registry and alias and push it to private registry
+                    tags.append((registry_image, alias))
+                    pushes.append((registry_image, alias))
 
-                            # Push image to private registry
-                            self.push_image(registry_image, alias)
-
-                # Alias image with registry and alias
-                self.alias_image(tagged_image, registry_image, alias)
+                # Alias image without registry
+                if registry_image == image_name:
+                    tags.append((registry_image, alias))
 
                 # Add image to the list of images
                 images.append(registry_tagged_image)
+
+            # Fingerprint of image is pushed with it so next build can find it
+            if pushes and push_fingerprint:
+                for url in urls:
+                    registry_image = self.create_registry_image_name(image_name, url)
+                    tags.append((registry_image, fingerprint_tag))
+                    pushes.append((registry_image, fingerprint_tag))
+
+            self.alias_image(tagged_image, tags)
+
+            # Push images, registries are pushed to concurrently
+            self.get_push_scheduler().push(pushes)
         else:
             # Append image name to images if image comes from public repository
-            images.append(service.get("image", service_name))
+            images.append(service.image or service_name)
 
         # Return all images
         return images
@@ -236,55 +434,235 @@ class BuilderController(CementBaseController):
             repository_image=self.create_registry_image_name(image_name, url)
         )
 
-    def alias_image(self, tagged_image, registry_image, tag):
+    def alias_image(self, tagged_image, tags):
         """
-        Alias image by tagging it
-        :param registry_image: Registry image name
+        Alias image by tagging it, all tags are created concurrently
         :param tagged_image: Use tagged image name
-        :param tag: Tag to use for new image name
+        :param tags: List of tuples of registry image name and tag
         :return: Returns void
         """
-        self.print("Tagging image: {tagged_image} -> {repository_image}:{tag}".format(
-            tagged_image=tagged_image,
-            repository_image=registry_image,
-            tag=tag
-        ))
+        if not tags:
+            return
+
+        for registry_image, tag in tags:
+            self.print("Tagging image: {tagged_image} -> {repository_image}:{tag}".format(
+                tagged_image=tagged_image,
+                repository_image=registry_image,
+                tag=tag
+            ))
 
-        # Tag image to repository
-        self.client.tag(
-            image=tagged_image,
-            tag=tag,
-            repository=registry_image
-        )
+        # Tag image to repositories
+        try:
+            with metrics.stage("tag"):
+                docker_aio.run(docker_aio.gather(
+                    self.async_client.tag(tagged_image, registry_image, tag) for registry_image, tag in tags
+                ))
+        except (DockerAPIError, OSError, asyncio.TimeoutError) as e:
+            raise FailedToBuildImage("Failed to tag {tagged_image}: {error}".format(tagged_image=tagged_image, error=e))
+
+    def get_push_scheduler(self):
+        """
+        Get scheduler of pushes shared by all services, connection limit of registry is set by its connections option
+        :return: Returns PushScheduler
+        """
+        with self.push_scheduler_lock:
+            if self.push_scheduler is None:
+                limits = dict((registry.url, registry.connections) for registry in self.model.registries.values())
+                auths = dict((url, self.get_auth(url)) for url in limits)
+
+                self.push_scheduler = docker_push.PushScheduler(self.async_client, limits=limits, auths=auths)
+
+            return self.push_scheduler
+
+    def get_scheduler(self):
+        """
+        Get scheduler of host, created on first use
+        :return: Returns Scheduler
+        """
+        with self.push_scheduler_lock:
+            if self.scheduler is None:
+                self.scheduler = scheduler.Scheduler.from_environment(self.environ)
+
+            return self.scheduler
+
+    def create_job_key(self, service):
+        """
+        Create key of build, builds of the same origin, ref, dockerfile and arguments to the same image,
+        aliases and registries are identical
+        :param service: Service
+        :return: Returns string
+        """
+        repository = service.repository
+
+        return hashlib.sha256(json.dumps([
+            repository.origin,
+            BuilderController.get_branch(repository.options),
+            repository.options.get("tag", 'latest'),
+            service.dockerfile,
+            service.context,
+            service.build_args,
+            repository.image_name,
+            repository.aliases,
+            service.registry_urls,
+        ], sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get_registry(self, url):
+        """
+        Get client of registry API, credentials are taken from environment
+        :param url: Url of registry in format <host>:<port>
+        :return: Returns Registry
+        """
+        with self.push_scheduler_lock:
+            if url not in self.registries:
+                registry = self.model.get_registry(url)
+                username, password = (registry.username, registry.password) if registry else ('', '')
+
+                self.registries[url] = docker_registry.Registry(url, username, password)
+
+            return self.registries[url]
+
+    def create_fingerprint(self, repo, context, dockerfile, build_args):
+        """
+        Create fingerprint of build, same fingerprint produces same image
+        :param repo: Repository checked out for build
+        :param context: Build context within repository
+        :param dockerfile: Dockerfile used to build image
+        :param build_args: Dict of build arguments
+        :return: Returns string
+        """
+        try:
+            commit = repo.get_last_commit_id("%H")
+            tree = repo.get_tree_id(context.strip("/"))
+        except sh.ErrorReturnCode as e:
+            raise FailedToBuildImage("Failed to read context {context} of repository: {error}".format(
+                context=context or '/',
+                error=e.stderr.decode("utf-8", "replace").strip()
+            ))
+
+        payload = json.dumps({
+            "commit": commit,
+            "context": tree,
+            "dockerfile": dockerfile,
+            "build_args": build_args,
+        }, sort_keys=True)
+
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def create_fingerprint_tag(self, fingerprint):
+        return "{prefix}{fingerprint}".format(prefix=self.FINGERPRINT_TAG, fingerprint=fingerprint[:32])
+
+    def image_exists(self, image):
+        """
+        Check if image exists locally
+        :param image: Tagged image name
+        :return: Returns bool
+        """
+        try:
+            docker_aio.run(self.async_client.inspect_image(image))
+        except DockerAPIError:
+            return False
+
+        return True
+
+    def pull_previous_image(self, image_name, tags, urls):
+        """
+        Pull previous image from registry, it is used as cache source of build
+        :param image_name: Image name without registry
+        :param tags: Tags to try in order of preference
+        :param urls: Urls of registries
+        :return: Returns list with pulled image or empty list
+        """
+        for url in urls:
+            for tag in tags:
+                if not self.get_registry(url).exists(image_name, tag):
+                    continue
 
-    def push_image(self, registry_image, tag):
+                registry_image = self.create_registry_image_name(image_name, url)
+                self.print("Pulling {image}:{tag} as build cache".format(image=registry_image, tag=tag))
+
+                try:
+                    with metrics.stage("pull"):
+                        self.follow_pull(registry_image, tag, url)
+                except FailedToBuildImage as e:
+                    self.print("Failed to pull {image}:{tag}: {error}".format(image=registry_image, tag=tag, error=e))
+                    continue
+
+                return [self.create_tagged_image_name(registry_image, tag)]
+
+        return []
+
+    def pull_fingerprint_image(self, image_name, fingerprint_tag, url):
+        """
+        Pull image with fingerprint from registry and tag it without registry
+        :param image_name: Image name without registry
+        :param fingerprint_tag: Fingerprint tag of image
+        :param url: Url of registry which has the image
+        :return: Returns void
         """
-        Push image to registry
+        registry_image = self.create_registry_image_name(image_name, url)
+        self.print("Pulling {image}:{tag}".format(image=registry_image, tag=fingerprint_tag))
+
+        with metrics.stage("pull"):
+            self.follow_pull(registry_image, fingerprint_tag, url)
+
+        self.alias_image(self.create_tagged_image_name(registry_image, fingerprint_tag),
+                         [(image_name, fingerprint_tag)])
+
+    def follow_pull(self, registry_image, tag, url):
+        """
+        Pull image and report its aggregated progress
         :param registry_image: Repository image name in format <registry>/<image>
-        :param tag: Tag for registry image
+        :param tag: Tag of image
+        :param url: Url of registry, its credentials are sent with pull
         :return: Returns void
         """
-        self.print("Pushing image to: {registry_image}".format(registry_image=registry_image))
+        name = self.create_tagged_image_name(registry_image, tag)
+        progress = docker_stream.Progress("Pulling", name)
 
-        # Push image to registry
-        for l in self.client.push(registry_image, tag=tag, stream=True, insecure_registry=True):
-            # Decode and convert format from json to dict
-            l = json.loads(l.decode("utf-8"))
+        try:
+            for item in docker_aio.iterate(self.async_client.pull(registry_image, tag, self.get_auth(url))):
+                error = docker_stream.get_error(item)
+                if error:
+                    raise FailedToBuildImage(error)
+
+                message = progress.update(item)
+                if message:
+                    self.print(message)
+        except (DockerAPIError, OSError, ValueError, asyncio.TimeoutError) as e:
+            raise FailedToBuildImage("Failed to pull {name}: {error}".format(name=name, error=e))
+
+    def get_auth(self, url):
+        """
+        Get credentials of registry sent with pulls and pushes
+        :param url: Url of registry in format <host>:<port>
+        :return: Returns dict or None for registries without credentials
+        """
+        registry = self.model.get_registry(url)
 
-            # Print status and progress if available
-            self.print("Status: {status}:   Progress: {progress}".format(
-                status=l.get("status"),
-                progress=l.get("progress"),
-            ))
+        if registry is None or not registry.username:
+            return None
 
-    def build_image(self, tagged_image, path, dockerfile):
+        return {"username": registry.username, "password": registry.password, "serveraddress": registry.url}
+
+    def build_image(self, tagged_image, path, dockerfile, build_args=None, labels=None, cache_from=None):
         """
         Build image for service
         :param tagged_image: Tagged image name in format: <image>:<tag>
-        :param path: Path for dockerfile and build context
+        :param path: Path for dockerfile and build context, .dockerignore of context is applied
         :param dockerfile: Dockerfile used to build image
+        :param build_args: Dict of build arguments
+        :param labels: Dict of labels of image, used when docker API supports it
+        :param cache_from: List of images used as cache source, used when docker API supports it
         :return: Returns void
         """
+        options = {}
+
+        if build_args:
+            options["buildargs"] = build_args
+        if labels and self.async_client.version_at_least(self.LABELS_API_VERSION):
+            options["labels"] = labels
+        if cache_from and self.async_client.version_at_least(self.CACHE_FROM_API_VERSION):
+            options["cache_from"] = cache_from
 
         # Debugging info
         self.print("Starting building application")
@@ -293,96 +671,221 @@ class BuilderController(CementBaseController):
 
         # Try building image
         try:
-            build = self.client.build(
-                tag=tagged_image,
-                forcerm=True,
-                rm=True,
-                path=path,
-                stream=True,
-                dockerfile=dockerfile
-            )
-
-            # Output result
-            for l in build:
-                l = json.loads(l.decode("utf-8")).get("stream", "")
-                self.print(l.rstrip())
-
-        except (APIError, Exception, HTTPError) as e:
+            with metrics.stage("build") as stage:
+                # Context is streamed to docker instead of being archived in memory
+                context = docker_context.BuildContext(path, dockerfile)
+                stage.bytes = context.size
+                self.print("Sending build context: {count} files, {size}".format(
+                    count=context.count,
+                    size=format_size(context.size)
+                ))
+
+                build = self.async_client.build(
+                    context.reader(),
+                    tag=tagged_image,
+                    forcerm=True,
+                    rm=True,
+                    dockerfile=dockerfile,
+                    **options
+                )
+
+                # Output of build steps, pulls of base images are reported in aggregate
+                progress = docker_stream.Progress("Pulling", "base image")
+
+                for item in docker_aio.iterate(build):
+                    error = docker_stream.get_error(item)
+                    if error:
+                        raise FailedToBuildImage(error)
+
+                    if item.get("stream"):
+                        self.print(item.get("stream").rstrip())
+                        continue
+
+                    message = progress.update(item)
+                    if message:
+                        self.print(message)
+
+        except FailedToBuildImage:
+            raise
+        except Exception as e:
             raise FailedToBuildImage(e)
 
     @staticmethod
-    def create_random(random_range=5):
-        return ''.join(random.choice(string.ascii_uppercase + string.digits) for _ in range(random_range))
+    def get_branch(repository):
+        """
+        Get branch, tag or commit to check out, tag in format <tag>:<ref> overrides branch
+        :param repository: Repository options
+        :return: Returns string
+        """
+        tag_based = repository.get("tag", 'latest').split(':')
+
+        if len(tag_based) == 2:
+            return tag_based[1].strip()
 
-    def get_repository(self, repository, path):
+        return repository.get("branch", 'master').strip()
+
+    @staticmethod
+    def get_clone_options(repository, context=''):
+        """
+        Get clone mode of repository
+        :param repository: Repository options, supports depth, single_branch, filter, partial and sparse
+        :param context: Build context within repository, sparse checkout always includes it
+        :return: Returns dict
+        """
+        depth = repository.get("depth", None)
+        sparse = repository.get("sparse", False)
+
+        sparse_paths = []
+        if sparse:
+            sparse_paths = list(sparse) if type(sparse) is list else []
+            if context:
+                sparse_paths.append(context)
+
+        return {
+            "depth": int(depth) if depth else None,
+            "single_branch": bool(repository.get("single_branch", bool(depth))),
+            "filter": repository.get("filter", "blob:none" if repository.get("partial", False) else None),
+            "sparse": sorted(set(sparse_paths)),
+        }
+
+    @staticmethod
+    def create_clone_variant(clone_options, branch=''):
+        """
+        Create cache variant for clone mode, full clones use no variant
+        :param clone_options: Clone mode of repository
+        :param branch: Branch of repository, single branch clones which are not shallow can't fetch other branches
+        :return: Returns string
+        """
+        variant = []
+
+        if clone_options.get("depth"):
+            variant.append("depth={depth}".format(depth=clone_options.get("depth")))
+        elif clone_options.get("single_branch"):
+            variant.append("single_branch={branch}".format(branch=branch))
+
+        if clone_options.get("depth") and clone_options.get("single_branch"):
+            variant.append("single_branch")
+        if clone_options.get("filter"):
+            variant.append("filter={filter}".format(filter=clone_options.get("filter")))
+        if clone_options.get("sparse"):
+            variant.append("sparse={paths}".format(paths=":".join(clone_options.get("sparse"))))
+
+        return ",".join(variant)
+
+    def get_repository(self, repository, path, clone_options=None, variant=''):
         """
         Clone the repository from git
         :param repository: Repository options
-        :param path: Path for saved repository
+        :param path: Path of cached checkout, caller holds its lock
+        :param clone_options: Clone mode of repository
+        :param variant: Cache variant of clone mode
         :return: Returns string tag for image
         """
 
         # Set Variables
         origin = repository.get("origin", '')
-        branch = repository.get("branch", 'master')
+        branch = self.get_branch(repository)
         tag = repository.get("tag", 'latest')
+        clone_options = clone_options or self.get_clone_options(repository)
+        depth = clone_options.get("depth")
 
-        repository_path = self.repositories.get(origin, False)
-        if repository_path:
-            path = repository_path
+        # Get tag content, image without tag is tagged with id of last commit
+        commit_tag = tag == ''
+        if len(tag.split(':')) == 2:
+            tag = branch
 
-        repo = Git.repo(path)
+        tag = tag.strip()
 
-        if not repository_path:
-            # Create repository
-            self.print("Cloning...")
+        # Repository keeps git cat-file running until it is closed
+        with git.Git.repo(path) as repo:
+            cloned = self.cache.exists(origin, variant)
 
             try:
-                self.print_command(Git.clone(origin, path))
-            except ErrorReturnCode_128 as e:
-                raise FailedToCloneRepository(e)
+                if not cloned:
+                    # Create repository
+                    self.print("Cloning...")
+                    self.cache.remove(origin, variant)
+
+                    with metrics.stage("clone"):
+                        self.print_command(git.Git.clone(
+                            origin,
+                            path,
+                            branch=branch if depth or clone_options.get("single_branch") else None,
+                            depth=depth,
+                            single_branch=clone_options.get("single_branch"),
+                            filter=clone_options.get("filter"),
+                            sparse=bool(clone_options.get("sparse"))
+                        ))
+                    cloned = True
+
+                    if clone_options.get("sparse"):
+                        self.print("Using sparse checkout of {paths}".format(
+                            paths=", ".join(clone_options.get("sparse"))
+                        ))
+                        with metrics.stage("checkout"):
+                            self.print_command(repo.sparse_checkout(clone_options.get("sparse")))
+
+                    self.print("Repository cloned")
+
+                    # Switch to branch for tag
+                    self.print("Switching to branch {branch}".format(branch=branch))
+                    with metrics.stage("checkout"):
+                        self.print_command(repo.checkout(branch))
+
+                elif depth:
+                    # Shallow repository fetches only tip of branch
+                    self.print("Fetching {branch}...".format(branch=branch))
+                    with metrics.stage("fetch"):
+                        self.print_command(repo.fetch_and_checkout(branch, depth=depth))
 
-            self.repositories.update({origin: path})
-            self.print("Repository cloned")
-
-        tag_based = tag.split(':')
-
-        # Get tag content
-        if tag is '':
-            branch = repo.get_last_commit_id(format="%H")
-            tag = repo.get_last_commit_id()
-        elif len(tag_based) is 2:
-            branch = tag = tag_based[1]
+                else:
+                    # Update cached repository
+                    self.print("Fetching...")
+                    with metrics.stage("fetch"):
+                        self.print_command(repo.update())
+                    self.print("Repository updated")
+
+                    # Switch to branch for tag
+                    self.print("Switching to branch {branch}".format(branch=branch))
+                    with metrics.stage("checkout"):
+                        self.print_command(repo.checkout(branch))
+
+                with metrics.stage("submodules"):
+                    self.print_command(repo.clean())
+                    self.print_command(repo.update_submodules(depth=depth))
+
+            except sh.ErrorReturnCode as e:
+                if not cloned:
+                    self.cache.remove(origin, variant)
+                raise FailedToCloneRepository(e)
 
-        branch = branch.strip()
-        tag = tag.strip()
+            if commit_tag:
+                tag = repo.get_last_commit_id()
 
-        # Switch to branch for tag
-        self.print("Switching to branch {branch}".format(branch=branch))
-        self.print_command(repo.switch_branch(branch))
+        self.cache.touch(origin, variant)
 
         return tag
 
     def login_to_registry(self, registry):
         """
         Login to remote private repository
+        :param registry: Registry of environment
         :return: Returns void
         """
-        host = registry.get("host", 'localhost')
-        port = registry.get("port", '5000')
-        username = registry.get("username", '')
-        password = registry.get("password", '')
-        url = "{host}:{port}".format(host=host, port=port)
+        url = registry.url
+        username = registry.username
+        password = registry.password
 
         self.print("Logging to {registry} as {username}".format(registry=url, username=username))
         try:
-            self.client.login(registry=url, username=username, password=password)
-        except APIError as e:
+            with metrics.stage("login", registry=url):
+                self.client.login(registry=url, username=username, password=password)
+        except docker_errors.APIError as e:
             raise FailedToLoginToRegistry(e)
 
     @staticmethod
     def print(message, end="\n"):
-        print("===> {message}".format(message=message), end=end)
+        log.emit(message, end=end)
 
     def print_command(self, command):
         for line in command:
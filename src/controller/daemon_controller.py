@@ -0,0 +1,115 @@
+import os
+import json
+import argparse
+import threading
+from cement.core.controller import CementBaseController, expose
+from src.core import log
+from src.core.lazy import lazy
+from src.controller.builder_controller import BuilderController
+from src.controller.agent_controller import AgentController
+
+# Imported by commands which use them
+daemon_client = lazy("src.core.daemon.client")
+daemon_jobs = lazy("src.core.daemon.jobs")
+daemon_server = lazy("src.core.daemon.server")
+
+
+class JobApp(object):
+    """
+        Application seen by command of job, arguments of job replace arguments of command line
+    """
+
+    def __init__(self, app, arguments):
+        self.app = app
+        self.pargs = argparse.Namespace(**arguments)
+
+    def __getattr__(self, name):
+        return getattr(self.app, name)
+
+
+class DaemonController(CementBaseController):
+    """
+        Daemon, keeps docker connections, caches and inventory warm and runs commands as jobs
+    """
+    class Meta:
+        label = 'daemon'
+        stacked_on = 'base'
+        stacked_type = 'nested'
+        description = "Long running daemon, commands of builder and agent are sent to it when it is running"
+        arguments = [
+            (['-s', '--socket'], dict(action='store', default=None,
+                                      help='Path of unix socket, defaults to TOWER_SOCKET or /var/run/tower.sock')),
+            (['-w', '--workers'], dict(action='store', type=int, default=4,
+                                       help='Number of jobs run at the same time')),
+            (['-m', '--metrics-port'], dict(action='store', type=int, default=None,
+                                            help='Serve metrics on port of localhost, defaults to TOWER_METRICS_PORT')),
+        ]
+
+    # Commands which can be run as jobs, by name of job command
+    COMMANDS = {
+        "builder.build": (BuilderController, "build", {"jobs": 1}),
+        "agent.deploy": (AgentController, "deploy", {"jobs": 1}),
+        "agent.down": (AgentController, "down", {"jobs": 1}),
+        "agent.scale": (AgentController, "scale", {"jobs": 1, "extra_arguments": []}),
+    }
+
+    @expose(hide=True)
+    def default(self):
+        self.start()
+
+    @expose(help="Start daemon")
+    def start(self):
+        path = daemon_client.DaemonClient(self.app.pargs.socket).path
+
+        # Everything printed by jobs goes to their output
+        log.route()
+
+        runners = dict((command, self.run_job) for command in self.COMMANDS)
+        jobs = daemon_jobs.JobQueue(runners, workers=self.app.pargs.workers)
+        server = daemon_server.Server(path, jobs)
+
+        self.print("Listening on {path} with {workers} workers".format(path=path, workers=self.app.pargs.workers))
+
+        # Metrics are served on unix socket and optionally on local port for Prometheus
+        metrics_port = self.app.pargs.metrics_port or os.environ.get("TOWER_METRICS_PORT", '')
+        if metrics_port:
+            metrics_server = daemon_server.MetricsServer(metrics_port)
+            threading.Thread(target=metrics_server.serve_forever, name="metrics", daemon=True).start()
+            self.print("Serving metrics on 127.0.0.1:{port}/metrics".format(port=metrics_port))
+
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+    @expose(help="Show status of daemon and its jobs")
+    def status(self):
+        client = daemon_client.DaemonClient(self.app.pargs.socket)
+
+        if not client.available():
+            print(json.dumps({'status': 'stopped'}))
+            return
+
+        status = client.request("GET", "/status")
+        status["jobs"] = client.request("GET", "/jobs")
+        print(json.dumps(status))
+
+    def run_job(self, job):
+        """
+        Run command of job with its environment and arguments
+        :param job: Job to run
+        :return: Returns False if command failed
+        """
+        controller_class, command, defaults = self.COMMANDS[job.command]
+
+        arguments = dict(defaults)
+        arguments.update(job.arguments)
+
+        controller = controller_class(environment=job.environment)
+        controller.app = JobApp(self.app, arguments)
+
+        return getattr(controller, command)()
+
+    @staticmethod
+    def print(message, end="\n"):
+        log.emit(message, end=end)
@@ -1,5 +1,6 @@
-import sh
+import subprocess
 from cement.core.controller import CementBaseController, expose
+from src.core.nginx import NginxConfig, nginx
 
 
 class NginxController(CementBaseController):
@@ -16,17 +17,27 @@ class NginxController(CementBaseController):
     @expose(help="Start server")
     def start(self):
         self.print("Starting server")
-        sh.nginx("-g", 'daemon off;')
+        subprocess.call(["nginx", "-g", 'daemon off;'])
 
     @expose(help="Reload server")
     def reload(self):
+        valid, output = NginxConfig.test()
+
+        if not valid:
+            self.print("Invalid configuration, server not reloaded")
+            print(output)
+            return
+
         self.print("Reloading server")
-        sh.nginx("-s", 'reload')
+        valid, output = nginx("-s", 'reload')
+
+        if not valid:
+            print(output)
 
     @expose(help="Stopping server")
     def stop(self):
         self.print("Stopping server")
-        sh.nginx("-s", 'stop')
+        nginx("-s", 'stop')
 
     @staticmethod
     def print(message, end="\n"):
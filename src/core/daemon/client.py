@@ -0,0 +1,133 @@
+import os
+import sys
+import json
+import socket
+import http.client
+
+DEFAULT_SOCKET = "/var/run/tower.sock"
+
+# Variables of environment passed to jobs, other variables belong to the calling process
+ENVIRONMENT_VARIABLES = ("APPLICATION", "APPLICATION_ENVIRONMENT", "SERVICES")
+ENVIRONMENT_PREFIX = "TOWER_"
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+
+        self.sock.connect(self.path)
+
+
+class DaemonClient(object):
+    """
+        Client of daemon API
+    """
+
+    def __init__(self, path=None, timeout=5):
+        """
+        :param path: Path of unix socket, defaults to TOWER_SOCKET or /var/run/tower.sock
+        :param timeout: Seconds to wait for responses, output of jobs is waited for without timeout
+        """
+        self.path = path or os.environ.get("TOWER_SOCKET", '') or DEFAULT_SOCKET
+        self.timeout = timeout
+
+    def available(self):
+        """
+        Check if daemon is listening
+        :return: Returns bool
+        """
+        if not os.path.exists(self.path):
+            return False
+
+        try:
+            return self.request("GET", "/status").get("status") == "running"
+        except (OSError, http.client.HTTPException, ValueError):
+            return False
+
+    def submit(self, command, environment=None, arguments=None):
+        """
+        Submit job
+        :param command: Command in format <controller>.<command>
+        :param environment: Dict of environment variables of command
+        :param arguments: Dict of command line arguments of command
+        :return: Returns dict with job
+        """
+        return self.request("POST", "/jobs", {
+            "command": command,
+            "environment": environment or {},
+            "arguments": arguments or {},
+        })
+
+    def get(self, job_id):
+        return self.request("GET", "/jobs/{id}".format(id=job_id))
+
+    def follow(self, job_id):
+        """
+        Read output of job until job is done
+        :param job_id: Id of job
+        :return: Returns generator of lines
+        """
+        connection = UnixHTTPConnection(self.path)
+
+        try:
+            connection.request("GET", "/jobs/{id}/output".format(id=job_id))
+            response = connection.getresponse()
+
+            for line in iter(response.readline, b''):
+                yield line.decode("utf-8", "replace")
+        finally:
+            connection.close()
+
+    def request(self, method, path, data=None):
+        connection = UnixHTTPConnection(self.path, timeout=self.timeout)
+
+        try:
+            body = json.dumps(data).encode("utf-8") if data is not None else None
+            connection.request(method, path, body=body, headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            result = json.loads(response.read().decode("utf-8"))
+        finally:
+            connection.close()
+
+        if response.status >= 400:
+            raise ValueError(result.get("message", '') if isinstance(result, dict) else result)
+
+        return result
+
+    @staticmethod
+    def get_environment(environment):
+        return dict(
+            (name, value) for name, value in environment.items()
+            if name in ENVIRONMENT_VARIABLES or (name.startswith(ENVIRONMENT_PREFIX) and name != "TOWER_SOCKET")
+        )
+
+
+def delegate(command, environment, arguments=None):
+    """
+    Run command in daemon when one is running, output of job is printed as it comes
+    :param command: Command in format <controller>.<command>
+    :param environment: Environment of calling process
+    :param arguments: Dict of command line arguments
+    :return: Returns True if command ran in daemon, False if it has to run in this process
+    """
+    if environment.get("TOWER_DAEMON", '') in ("0", "off", "false", "no"):
+        return False
+
+    client = DaemonClient()
+    if not client.available():
+        return False
+
+    job = client.submit(command, client.get_environment(environment), arguments)
+
+    for line in client.follow(job.get("id")):
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+    return True
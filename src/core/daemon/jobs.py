@@ -0,0 +1,217 @@
+import time
+import uuid
+import queue
+import threading
+import traceback
+from collections import OrderedDict, deque
+from src.core import log
+
+
+class Job(object):
+    """
+        Command submitted to daemon, everything printed by command is kept and can be followed
+    """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    def __init__(self, command, environment=None, arguments=None):
+        """
+        :param command: Command in format <controller>.<command>, e.g. agent.deploy
+        :param environment: Dict of environment variables of command
+        :param arguments: Dict of command line arguments of command
+        """
+        self.id = uuid.uuid4().hex[:12]
+        self.command = command
+        self.environment = environment or {}
+        self.arguments = arguments or {}
+        self.status = self.PENDING
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+        # Printed output of command
+        self.output = []
+        self.condition = threading.Condition()
+
+    @property
+    def key(self):
+        """
+        Jobs of the same application and environment run one after another
+        :return: Returns tuple
+        """
+        return self.environment.get("APPLICATION", ''), self.environment.get("APPLICATION_ENVIRONMENT", '')
+
+    @property
+    def done(self):
+        return self.status in (self.SUCCEEDED, self.FAILED)
+
+    def write(self, text):
+        with self.condition:
+            self.output.append(text)
+            self.condition.notify_all()
+
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def finish(self, status):
+        with self.condition:
+            self.status = status
+            self.finished = time.time()
+            self.condition.notify_all()
+
+    def follow(self, timeout=1.0):
+        """
+        Get output of job as it is printed, until job is done
+        :param timeout: Seconds between checks of job status
+        :return: Returns generator of strings
+        """
+        offset = 0
+
+        while True:
+            with self.condition:
+                while offset == len(self.output) and not self.done:
+                    self.condition.wait(timeout)
+
+                output = self.output[offset:]
+                offset += len(output)
+                done = self.done
+
+            if output:
+                yield "".join(output)
+
+            if done and offset == len(self.output):
+                return
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "command": self.command,
+            "status": self.status,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class JobQueue(object):
+    """
+        Queue of jobs run by pool of workers, jobs of the same key are handed to workers one after another
+    """
+
+    def __init__(self, runners, workers=4, history=100):
+        """
+        :param runners: Dict of functions by command, function takes job and returns False on failure
+        :param workers: Number of jobs run at the same time
+        :param history: Number of finished jobs kept
+        """
+        self.runners = runners
+        self.history = history
+        self.queue = queue.Queue()
+
+        self.jobs = OrderedDict()
+        self.jobs_lock = threading.Lock()
+
+        # Jobs waiting for running job of the same key, by key, key is present while its job runs
+        self.keys = {}
+
+        self.workers = [
+            threading.Thread(target=self.work, name="job-worker-{index}".format(index=index), daemon=True)
+            for index in range(max(int(workers), 1))
+        ]
+
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, command, environment=None, arguments=None):
+        """
+        Add job to queue
+        :param command: Command in format <controller>.<command>
+        :param environment: Dict of environment variables of command
+        :param arguments: Dict of command line arguments of command
+        :return: Returns Job
+        """
+        if command not in self.runners:
+            raise ValueError("Unknown command: {command}".format(command=command))
+
+        job = Job(command, environment, arguments)
+
+        with self.jobs_lock:
+            self.jobs[job.id] = job
+            self.prune()
+
+            # Job of busy key waits outside of queue, so it doesn't hold worker
+            if job.key in self.keys:
+                self.keys[job.key].append(job)
+                return job
+
+            self.keys[job.key] = deque()
+
+        self.queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self.jobs_lock:
+            return self.jobs.get(job_id)
+
+    def all(self):
+        with self.jobs_lock:
+            return list(self.jobs.values())
+
+    def prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+
+        for job_id in finished[:max(len(finished) - self.history, 0)]:
+            del self.jobs[job_id]
+
+    def release(self, key):
+        """
+        Hand next job of key to workers, key is idle when it has none
+        :param key: Key of finished job
+        :return: Returns void
+        """
+        with self.jobs_lock:
+            pending = self.keys[key]
+
+            if not pending:
+                del self.keys[key]
+                return
+
+            job = pending.popleft()
+
+        self.queue.put(job)
+
+    def work(self):
+        while True:
+            job = self.queue.get()
+
+            try:
+                self.run(job)
+            finally:
+                self.release(job.key)
+
+            self.queue.task_done()
+
+    def run(self, job):
+        """
+        Run job, everything printed by job and threads it starts goes to job output
+        :param job: Job to run
+        :return: Returns void
+        """
+        job.status = Job.RUNNING
+        job.started = time.time()
+        log.set_output(job)
+
+        try:
+            result = self.runners[job.command](job)
+            job.finish(Job.FAILED if result is False else Job.SUCCEEDED)
+        except Exception:
+            job.write(traceback.format_exc())
+            job.finish(Job.FAILED)
+        finally:
+            log.set_output(None)
+            log.set_labels()
@@ -0,0 +1,165 @@
+import os
+import re
+import json
+import socket
+import socketserver
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from src.core import metrics
+
+# Content type of Prometheus text format
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+        HTTP server listening on unix socket, every request is handled in its own thread
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, jobs):
+        """
+        :param path: Path of unix socket, stale socket is replaced
+        :param jobs: JobQueue running submitted jobs
+        """
+        self.path = path
+        self.jobs = jobs
+
+        if os.path.exists(path):
+            if self.is_listening(path):
+                raise OSError("Daemon is already listening on {path}".format(path=path))
+            os.remove(path)
+
+        super().__init__(path, Handler)
+
+    def server_close(self):
+        super().server_close()
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    @staticmethod
+    def is_listening(path):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            connection.connect(path)
+        except OSError:
+            return False
+        finally:
+            connection.close()
+
+        return True
+
+
+class MetricsServer(socketserver.ThreadingMixIn, HTTPServer):
+    """
+        HTTP server exposing metrics of daemon on TCP port so Prometheus can scrape it
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port, host="127.0.0.1"):
+        """
+        :param port: Port metrics are served on
+        :param host: Address metrics are served on, local only by default
+        """
+        super().__init__((host, int(port)), MetricsHandler)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+        GET /metrics    metrics of stages of jobs in Prometheus text format
+    """
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+        send_metrics(self)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def send_metrics(handler):
+    body = metrics.registry.render().encode("utf-8")
+
+    handler.send_response(200)
+    handler.send_header("Content-Type", METRICS_CONTENT_TYPE)
+    handler.send_header("Content-Length", str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+        API of daemon
+            GET  /status              status of daemon
+            GET  /jobs                list of jobs
+            POST /jobs                submit job, body is json with command, environment and arguments
+            GET  /jobs/<id>           status of job
+            GET  /jobs/<id>/output    output of job, streamed until job is done
+            GET  /metrics             metrics of stages of jobs in Prometheus text format
+    """
+
+    JOB_PATH = re.compile(r'^/jobs/(?P<id>[0-9a-f]+)(?P<output>/output)?$')
+
+    def do_GET(self):
+        if self.path == "/status":
+            return self.send_json(200, {"status": "running", "pid": os.getpid(), "jobs": len(self.server.jobs.all())})
+
+        if self.path == "/jobs":
+            return self.send_json(200, [job.to_dict() for job in self.server.jobs.all()])
+
+        if self.path == "/metrics":
+            return send_metrics(self)
+
+        match = self.JOB_PATH.match(self.path)
+        job = self.server.jobs.get(match.group("id")) if match else None
+
+        if job is None:
+            return self.send_json(404, {"message": "Not found"})
+
+        if not match.group("output"):
+            return self.send_json(200, job.to_dict())
+
+        # Response has no length, output is written as it comes and connection is closed at the end
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        try:
+            for output in job.follow():
+                self.wfile.write(output.encode("utf-8"))
+                self.wfile.flush()
+        except OSError:
+            # Client disconnected, job keeps running
+            pass
+
+    def do_POST(self):
+        if self.path != "/jobs":
+            return self.send_json(404, {"message": "Not found"})
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8"))
+            job = self.server.jobs.submit(body.get("command", ''), body.get("environment"), body.get("arguments"))
+        except (ValueError, AttributeError) as e:
+            return self.send_json(400, {"message": str(e)})
+
+        self.send_json(202, job.to_dict())
+
+    def send_json(self, code, data):
+        body = json.dumps(data).encode("utf-8")
+
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Requests are not logged, output of daemon belongs to jobs
+        pass
@@ -0,0 +1,747 @@
+import json
+import atexit
+import base64
+import struct
+import asyncio
+import collections
+import threading
+from urllib.parse import quote, urlencode
+from src.core.docker.stream import StreamDecoder
+from src.exceptions import DockerAPIError
+
+# Size of pieces of request bodies and reads of response bodies
+CHUNK_SIZE = 64 * 1024
+
+# Streams of exec and attach, multiplexed when container has no tty
+STDOUT = 1
+STDERR = 2
+
+
+class Connection(object):
+    """
+        HTTP/1.1 connection to docker, kept open between requests of pool
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.reusable = True
+        self.requests = 0
+
+    async def send(self, method, url, headers, body=None):
+        """
+        Send request, body is bytes or object with read(size) whose length is known
+        :return: Returns void
+        """
+        self.requests += 1
+        lines = ["{method} {url} HTTP/1.1".format(method=method, url=url), "Host: docker"]
+        lines += ["{name}: {value}".format(name=name, value=value) for name, value in headers.items()]
+
+        if body is not None:
+            lines.append("Content-Length: {length}".format(length=len(body)))
+
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+        if isinstance(body, bytes):
+            self.writer.write(body)
+        elif body is not None:
+            while True:
+                chunk = body.read(CHUNK_SIZE)
+
+                if not chunk:
+                    break
+
+                self.writer.write(chunk)
+                await self.writer.drain()
+
+        await self.writer.drain()
+
+    async def read_head(self):
+        """
+        Read status line and headers of response
+        :return: Returns tuple of status code and dict of headers with lower case names
+        """
+        line = await self.reader.readline()
+
+        if not line:
+            raise ConnectionError("Docker closed connection")
+
+        status = int(line.split(b" ", 2)[1])
+        headers = {}
+
+        while True:
+            line = await self.reader.readline()
+
+            if line in (b"\r\n", b"\n", b""):
+                break
+
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("connection", '').lower() == "close":
+            self.reusable = False
+
+        return status, headers
+
+    def close(self):
+        self.reusable = False
+        self.writer.close()
+
+
+class Pool(object):
+    """
+        Connections to docker socket, number of open connections is limited and idle connections are reused
+    """
+
+    def __init__(self, base_url, size=16):
+        """
+        :param base_url: Url of docker, unix://<path> or tcp://<host>:<port>
+        :param size: Maximal number of open connections
+        """
+        self.base_url = base_url
+        self.size = max(int(size), 1)
+
+        # Created in loop of first request
+        self.idle = None
+        self.semaphore = None
+
+    async def acquire(self):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.size)
+            self.idle = []
+
+        await self.semaphore.acquire()
+
+        try:
+            while self.idle:
+                connection = self.idle.pop()
+
+                if not connection.reader.at_eof():
+                    return connection
+
+                connection.close()
+
+            return await self.connect()
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+    def release(self, connection):
+        """
+        Return connection to pool, connections which can't be reused are closed
+        :param connection: Connection whose response was fully read or abandoned
+        :return: Returns void
+        """
+        if connection.reusable:
+            self.idle.append(connection)
+        else:
+            connection.close()
+
+        self.semaphore.release()
+
+    async def connect(self):
+        if self.base_url.startswith("unix://"):
+            reader, writer = await asyncio.open_unix_connection("/" + self.base_url[len("unix://"):].lstrip("/"))
+        else:
+            host, _, port = self.base_url.split("://", 1)[-1].rstrip("/").partition(":")
+            reader, writer = await asyncio.open_connection(host, int(port or 2375))
+
+        return Connection(reader, writer)
+
+    def close(self):
+        for connection in self.idle or []:
+            connection.close()
+
+        self.idle = []
+
+
+class Response(object):
+    """
+        Response of docker, connection goes back to pool once body is read
+    """
+
+    def __init__(self, pool, connection, status, headers, method):
+        self.pool = pool
+        self.connection = connection
+        self.status = status
+        self.headers = headers
+
+        # Remaining bytes of body, None for chunked body or body ending with connection
+        self.chunked = headers.get("transfer-encoding", '').lower() == "chunked"
+        self.remaining = None if self.chunked else int(headers.get("content-length", -1))
+        self.done = method == "HEAD" or status in (204, 304)
+
+        if self.remaining == 0:
+            self.done = True
+        elif self.remaining == -1 and not self.chunked and not self.done:
+            # Body ends when docker closes connection, e.g. hijacked stream of exec
+            self.remaining = None
+            self.connection.reusable = False
+
+        if self.done:
+            self.release()
+
+    async def read_chunk(self):
+        """
+        Read next piece of body
+        :return: Returns bytes, empty at the end of body
+        """
+        if self.done:
+            return b''
+
+        reader = self.connection.reader
+
+        try:
+            if self.chunked:
+                size = int((await reader.readline()).split(b";", 1)[0].strip() or b"0", 16)
+
+                if size == 0:
+                    # Trailers end with empty line
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+
+                    chunk = b''
+                else:
+                    chunk = await reader.readexactly(size)
+                    await reader.readline()
+            elif self.remaining is not None:
+                chunk = await reader.read(min(self.remaining, CHUNK_SIZE))
+                self.remaining -= len(chunk)
+
+                if not chunk:
+                    raise ConnectionError("Docker closed connection before end of response")
+            else:
+                chunk = await reader.read(CHUNK_SIZE)
+        except asyncio.IncompleteReadError:
+            self.close()
+            raise ConnectionError("Docker closed connection before end of response")
+        except BaseException:
+            self.close()
+            raise
+
+        if not chunk or self.remaining == 0:
+            self.release()
+
+        return chunk
+
+    async def read(self):
+        chunks = []
+
+        while True:
+            chunk = await self.read_chunk()
+
+            if not chunk:
+                return b"".join(chunks)
+
+            chunks.append(chunk)
+
+    async def json(self):
+        body = await self.read()
+        return json.loads(body.decode("utf-8")) if body.strip() else None
+
+    def release(self):
+        if self.connection is not None:
+            self.done = True
+            self.pool.release(self.connection)
+            self.connection = None
+
+    def close(self):
+        """
+        Abandon response, connection is closed
+        :return: Returns void
+        """
+        if self.connection is not None:
+            self.connection.reusable = False
+            self.release()
+
+
+class JSONStream(object):
+    """
+        Objects of streamed response, e.g. progress of pull, push and build or events, used with async for
+    """
+
+    def __init__(self, response):
+        self.response = response
+        self.decoder = StreamDecoder()
+        self.items = collections.deque()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self.items:
+            chunk = await self.response.read_chunk()
+
+            if not chunk:
+                self.decoder.close()
+                raise StopAsyncIteration
+
+            self.items.extend(self.decoder.feed(chunk))
+
+        return self.items.popleft()
+
+    async def read_items(self):
+        """
+        Read objects completed by next chunks of response
+        :return: Returns list of dicts, empty at the end of stream
+        """
+        while not self.items:
+            chunk = await self.response.read_chunk()
+
+            if not chunk:
+                self.decoder.close()
+                return []
+
+            self.items.extend(self.decoder.feed(chunk))
+
+        items = list(self.items)
+        self.items.clear()
+
+        return items
+
+    def close(self):
+        self.response.close()
+
+
+class RawStream(object):
+    """
+        Output of exec, frames of multiplexed stream are split to tuples of stream and bytes
+    """
+
+    def __init__(self, response, tty=False):
+        self.response = response
+        self.tty = tty
+        self.buffer = b''
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.tty:
+            chunk = await self.response.read_chunk()
+
+            if not chunk:
+                raise StopAsyncIteration
+
+            return STDOUT, chunk
+
+        while len(self.buffer) < 8:
+            if not await self.fill():
+                raise StopAsyncIteration
+
+        stream, size = struct.unpack(">BxxxL", self.buffer[:8])
+
+        while len(self.buffer) < 8 + size:
+            if not await self.fill():
+                raise StopAsyncIteration
+
+        frame = self.buffer[8:8 + size]
+        self.buffer = self.buffer[8 + size:]
+
+        return stream, frame
+
+    async def fill(self):
+        chunk = await self.response.read_chunk()
+        self.buffer += chunk
+        return bool(chunk)
+
+    async def read_items(self):
+        """
+        Read next frame of output
+        :return: Returns list with tuple of stream and bytes, empty at the end of output
+        """
+        try:
+            return [await self.__anext__()]
+        except StopAsyncIteration:
+            return []
+
+    def close(self):
+        self.response.close()
+
+
+class AsyncClient(object):
+    """
+        Client of docker API for asyncio, requests share pool of connections so many container
+        operations run at the same time without a thread per call
+    """
+
+    def __init__(self, base_url, version, pool_size=16, timeout=60):
+        """
+        :param base_url: Url of docker, unix://<path> or tcp://<host>:<port>
+        :param version: Version of docker API
+        :param pool_size: Maximal number of open connections
+        :param timeout: Seconds to wait for response which isn't streamed
+        """
+        self.base_url = base_url
+        self.version = version
+        self.timeout = timeout
+        self.pool = Pool(base_url, pool_size)
+
+    async def request(self, method, path, params=None, body=None, headers=None):
+        """
+        Send request and read status and headers of response, body is read by caller
+        :param method: HTTP method
+        :param path: Path of API without version
+        :param params: Dict of query parameters, None values are left out
+        :param body: Bytes, dict sent as json or object with read(size)
+        :param headers: Dict of headers
+        :return: Returns Response
+        """
+        url = "/v{version}{path}".format(version=self.version, path=path)
+        query = urlencode(sorted((key, value) for key, value in (params or {}).items() if value is not None))
+
+        if query:
+            url += "?" + query
+
+        headers = dict(headers or {})
+
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+
+        while True:
+            connection = await self.pool.acquire()
+
+            try:
+                await connection.send(method, url, headers, body)
+                status, response_headers = await connection.read_head()
+                break
+            except (ConnectionError, asyncio.IncompleteReadError) as e:
+                connection.reusable = False
+                self.pool.release(connection)
+
+                # Idle connection closed by docker is replaced once, unless body was already read
+                if connection.requests > 1 and (body is None or isinstance(body, bytes)):
+                    continue
+
+                raise ConnectionError("Request to docker failed: {error}".format(error=e))
+            except BaseException:
+                connection.reusable = False
+                self.pool.release(connection)
+                raise
+
+        response = Response(self.pool, connection, status, response_headers, method)
+
+        if status >= 400:
+            try:
+                message = await response.read()
+            finally:
+                response.close()
+
+            try:
+                message = json.loads(message.decode("utf-8")).get("message", '')
+            except (ValueError, AttributeError):
+                message = message.decode("utf-8", "replace").strip()
+
+            raise DockerAPIError(status, "{method} {path}: {status} {message}".format(
+                method=method, path=path, status=status, message=message
+            ))
+
+        return response
+
+    async def call(self, method, path, params=None, body=None, headers=None):
+        """
+        Send request and decode json body of response, waits at most timeout seconds
+        :return: Returns decoded body or None for empty body
+        """
+        async def call():
+            response = await self.request(method, path, params, body, headers)
+
+            try:
+                return await response.json()
+            except BaseException:
+                response.close()
+                raise
+
+        return await asyncio.wait_for(call(), self.timeout)
+
+    async def stream(self, method, path, params=None, body=None, headers=None):
+        return JSONStream(await self.request(method, path, params, body, headers))
+
+    def version_at_least(self, version):
+        """
+        Check if docker API version of client is at least version, e.g. cache_from of build needs 1.25
+        :param version: Version in format <major>.<minor>
+        :return: Returns bool
+        """
+        return tuple(int(part) for part in str(self.version).split(".")) >= tuple(
+            int(part) for part in version.split(".")
+        )
+
+    async def version_info(self):
+        return await self.call("GET", "/version")
+
+    async def containers(self, all=False, filters=None):
+        return await self.call("GET", "/containers/json", {
+            "all": 1 if all else 0,
+            "filters": self.encode_filters(filters),
+        })
+
+    async def inspect_container(self, container):
+        return await self.call("GET", "/containers/{id}/json".format(id=quote(container)))
+
+    async def create_container(self, config, name=None):
+        """
+        Create container
+        :param config: Configuration in format of docker API, e.g. from Client.create_container_config
+        :param name: Name of container
+        :return: Returns dict with Id of container
+        """
+        return await self.call("POST", "/containers/create", {"name": name}, config)
+
+    async def start(self, container):
+        return await self.call("POST", "/containers/{id}/start".format(id=quote(container)))
+
+    async def stop(self, container, timeout=10):
+        async def stop():
+            response = await self.request("POST", "/containers/{id}/stop".format(id=quote(container)),
+                                          {"t": timeout})
+            await response.read()
+
+        # Docker waits for container up to timeout before it responds
+        return await asyncio.wait_for(stop(), self.timeout + timeout)
+
+    async def kill(self, container, signal=None):
+        return await self.call("POST", "/containers/{id}/kill".format(id=quote(container)), {"signal": signal})
+
+    async def remove_container(self, container, force=False, v=False):
+        return await self.call("DELETE", "/containers/{id}".format(id=quote(container)), {
+            "force": 1 if force else 0,
+            "v": 1 if v else 0,
+        })
+
+    async def rename(self, container, name):
+        return await self.call("POST", "/containers/{id}/rename".format(id=quote(container)), {"name": name})
+
+    async def networks(self, names=None):
+        return await self.call("GET", "/networks", {
+            "filters": self.encode_filters({"name": names}) if names else None,
+        })
+
+    async def create_network(self, name, driver=None, internal=False, labels=None):
+        return await self.call("POST", "/networks/create", body={
+            "Name": name,
+            "Driver": driver,
+            "Internal": internal,
+            "Labels": labels or {},
+            "CheckDuplicate": True,
+        })
+
+    async def inspect_image(self, image):
+        return await self.call("GET", "/images/{name}/json".format(name=quote(image, safe="/:@")))
+
+    async def tag(self, image, repository, tag=None, force=False):
+        return await self.call("POST", "/images/{name}/tag".format(name=quote(image, safe="/:@")), {
+            "repo": repository,
+            "tag": tag,
+            "force": 1 if force else None,
+        })
+
+    async def pull(self, repository, tag=None, auth=None):
+        """
+        Pull image
+        :param repository: Repository with registry
+        :param tag: Tag, defaults to latest
+        :param auth: Dict of registry credentials
+        :return: Returns JSONStream of progress
+        """
+        return await self.stream("POST", "/images/create", {"fromImage": repository, "tag": tag or "latest"},
+                                 headers=self.get_auth_headers(auth))
+
+    async def push(self, repository, tag=None, auth=None):
+        """
+        Push image
+        :param repository: Repository with registry
+        :param tag: Tag, all tags are pushed without it
+        :param auth: Dict of registry credentials
+        :return: Returns JSONStream of progress
+        """
+        return await self.stream("POST", "/images/{name}/push".format(name=quote(repository, safe="/:")),
+                                 {"tag": tag}, headers=self.get_auth_headers(auth))
+
+    async def build(self, context, tag=None, dockerfile=None, buildargs=None, labels=None, cache_from=None,
+                    rm=True, forcerm=False):
+        """
+        Build image
+        :param context: Tar of build context, bytes or object with read(size) and length, e.g. ContextReader
+        :return: Returns JSONStream of build output
+        """
+        return await self.stream("POST", "/build", {
+            "t": tag,
+            "dockerfile": dockerfile,
+            "buildargs": json.dumps(buildargs) if buildargs else None,
+            "labels": json.dumps(labels) if labels else None,
+            "cachefrom": json.dumps(cache_from) if cache_from else None,
+            "rm": 1 if rm else 0,
+            "forcerm": 1 if forcerm else None,
+        }, context, {"Content-Type": "application/x-tar"})
+
+    async def exec_create(self, container, cmd, tty=False):
+        return await self.call("POST", "/containers/{id}/exec".format(id=quote(container)), body={
+            "Cmd": cmd if isinstance(cmd, list) else ["/bin/sh", "-c", cmd],
+            "AttachStdout": True,
+            "AttachStderr": True,
+            "Tty": tty,
+        })
+
+    async def exec_start(self, exec_id, tty=False):
+        """
+        Start exec and follow its output
+        :param exec_id: Id of exec from exec_create
+        :return: Returns RawStream of tuples of stream and bytes
+        """
+        response = await self.request("POST", "/exec/{id}/start".format(id=quote(exec_id)),
+                                      body={"Detach": False, "Tty": tty})
+        return RawStream(response, tty)
+
+    async def exec_inspect(self, exec_id):
+        return await self.call("GET", "/exec/{id}/json".format(id=quote(exec_id)))
+
+    async def events(self, filters=None, since=None, until=None):
+        return await self.stream("GET", "/events", {
+            "filters": self.encode_filters(filters),
+            "since": since,
+            "until": until,
+        })
+
+    @staticmethod
+    def encode_filters(filters):
+        """
+        Encode filters for query, docker expects list of values for every filter
+        :param filters: Dict of value or list of values by filter name
+        :return: Returns json string or None without filters
+        """
+        if not filters:
+            return None
+
+        return json.dumps(dict(
+            (name, value if isinstance(value, list) else [value]) for name, value in filters.items()
+        ))
+
+    @staticmethod
+    def get_auth_headers(auth):
+        if not auth:
+            return {}
+
+        return {"X-Registry-Auth": base64.urlsafe_b64encode(json.dumps(auth).encode("utf-8")).decode("ascii")}
+
+    def close(self):
+        self.pool.close()
+
+
+class Runner(object):
+    """
+        Event loop in its own thread, threads of controllers run coroutines on it and wait for their result
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.run_forever, name="docker-aio", daemon=True)
+        self.thread.start()
+
+    def run_forever(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run(self, coroutine, timeout=None):
+        """
+        Run coroutine on loop and wait for it
+        :param coroutine: Coroutine
+        :param timeout: Seconds to wait, None to wait until it is done
+        :return: Returns result of coroutine
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def stop(self, timeout=1.0):
+        """
+        Cancel coroutines left on loop, e.g. listeners of events, so process exits without warnings
+        :param timeout: Seconds to wait for cancelled coroutines
+        :return: Returns void
+        """
+        async def cancel():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+            for task in tasks:
+                task.cancel()
+
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        try:
+            self.run(cancel(), timeout)
+        except Exception:
+            pass
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    """
+    Get runner of process, started on first use
+    :return: Returns Runner
+    """
+    global _runner
+
+    with _runner_lock:
+        if _runner is None:
+            _runner = Runner()
+            atexit.register(_runner.stop)
+
+        return _runner
+
+
+def run(coroutine, timeout=None):
+    return get_runner().run(coroutine, timeout)
+
+
+def spawn(coroutine):
+    """
+    Start coroutine on loop without waiting for it, e.g. listener of events
+    :param coroutine: Coroutine
+    :return: Returns concurrent.futures.Future
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, get_runner().loop)
+
+
+def iterate(coroutine):
+    """
+    Follow stream from thread of caller, items are read on loop in batches so output of stream is printed
+    by the thread which asked for it
+    :param coroutine: Coroutine returning JSONStream or RawStream, e.g. client.pull(...)
+    :return: Returns generator of items of stream
+    """
+    runner = get_runner()
+    stream = runner.run(coroutine)
+
+    try:
+        while True:
+            items = runner.run(stream.read_items())
+
+            if not items:
+                return
+
+            for item in items:
+                yield item
+    finally:
+        # Stream abandoned by caller closes its connection, response which was read is already released
+        runner.loop.call_soon_threadsafe(stream.close)
+
+
+async def gather(coroutines, return_exceptions=False):
+    """
+    Run coroutines concurrently, every coroutine finishes before first error is raised
+    :param coroutines: Iterable of coroutines
+    :param return_exceptions: Return exceptions in list of results instead of raising first of them
+    :return: Returns list of results
+    """
+    results = await asyncio.gather(*coroutines, return_exceptions=True)
+
+    if return_exceptions:
+        return results
+
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+    return results
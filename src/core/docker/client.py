@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from docker import Client
+from src.core.docker.aio import AsyncClient
+from src.core.docker.inventory import Inventory
+from src.core.docker.readiness import Readiness
+
+DEFAULT_BASE_URL = "unix://var/run/docker.sock"
+
+# Negotiated versions of docker API by url of docker, kept between processes
+VERSIONS_PATH = os.path.join(tempfile.gettempdir(), "tower-docker-api-versions.json")
+VERSIONS_MAX_AGE = 86400
+
+# Shared clients by url of docker, connections are reused by every command of process
+_clients = {}
+_async_clients = {}
+_inventories = {}
+_lock = threading.Lock()
+
+
+def get_client(base_url=None):
+    """
+    Get docker client, client is created once per process
+    :param base_url: Url of docker, defaults to DOCKER_HOST or local docker
+    :return: Returns Client
+    """
+    base_url = base_url or os.environ.get("DOCKER_HOST", '') or DEFAULT_BASE_URL
+
+    with _lock:
+        if base_url not in _clients:
+            version = get_api_version(base_url)
+            _clients[base_url] = Client(base_url=base_url, version=version or 'auto')
+
+            if not version:
+                save_api_version(base_url, _clients[base_url].api_version)
+
+        return _clients[base_url]
+
+
+def get_async_client(base_url=None):
+    """
+    Get asyncio docker client, it uses API version of blocking client and is created once per process
+    :param base_url: Url of docker, defaults to DOCKER_HOST or local docker
+    :return: Returns AsyncClient
+    """
+    base_url = base_url or os.environ.get("DOCKER_HOST", '') or DEFAULT_BASE_URL
+    version = get_client(base_url).api_version
+
+    with _lock:
+        if base_url not in _async_clients:
+            _async_clients[base_url] = AsyncClient(base_url, version)
+
+        return _async_clients[base_url]
+
+
+def get_api_version(base_url):
+    """
+    Get cached version of docker API, TOWER_DOCKER_API_VERSION overrides it
+    :param base_url: Url of docker
+    :return: Returns string or None if version has to be negotiated
+    """
+    if os.environ.get("TOWER_DOCKER_API_VERSION"):
+        return os.environ.get("TOWER_DOCKER_API_VERSION")
+
+    try:
+        with open(VERSIONS_PATH) as file:
+            version = json.load(file).get(base_url) or {}
+    except (OSError, ValueError, AttributeError):
+        return None
+
+    if time.time() - version.get("time", 0) > VERSIONS_MAX_AGE:
+        return None
+
+    return version.get("version")
+
+
+def save_api_version(base_url, version):
+    """
+    Cache negotiated version of docker API, file is replaced atomically
+    :param base_url: Url of docker
+    :param version: Version of API
+    :return: Returns void
+    """
+    try:
+        with open(VERSIONS_PATH) as file:
+            versions = json.load(file)
+    except (OSError, ValueError):
+        versions = {}
+
+    if not isinstance(versions, dict):
+        versions = {}
+
+    versions[base_url] = {"version": version, "time": time.time()}
+    temporary = "{path}.{pid}".format(path=VERSIONS_PATH, pid=os.getpid())
+
+    try:
+        with open(temporary, "w") as file:
+            json.dump(versions, file)
+
+        os.replace(temporary, VERSIONS_PATH)
+    except OSError:
+        pass
+
+
+def get_inventory(client, async_client):
+    """
+    Get inventory of containers with readiness woken up by its events, created once per client
+    :param client: Docker client
+    :param async_client: Asyncio docker client of the same docker, events are followed on its loop
+    :return: Returns tuple of Inventory and Readiness
+    """
+    with _lock:
+        if id(client) not in _inventories:
+            inventory = Inventory(client, async_client)
+            readiness = Readiness(client, events=False)
+            inventory.subscribe(readiness.notify)
+
+            _inventories[id(client)] = (inventory, readiness)
+
+        return _inventories[id(client)]
@@ -0,0 +1,322 @@
+import os
+import re
+import stat
+import tarfile
+
+# Size of tar blocks, members and archive are padded to it
+BLOCK_SIZE = tarfile.BLOCKSIZE
+
+
+class DockerIgnore(object):
+    """
+        Matcher of .dockerignore rules, patterns are compiled once and the last
+        matching pattern decides, patterns starting with ! include paths again
+    """
+
+    def __init__(self, patterns=None):
+        """
+        :param patterns: List of patterns in .dockerignore format
+        """
+        self.rules = []
+
+        for pattern in patterns or []:
+            pattern = pattern.strip()
+
+            if not pattern or pattern.startswith("#"):
+                continue
+
+            exception = pattern.startswith("!")
+            pattern = os.path.normpath(pattern.lstrip("!").strip()).lstrip("/")
+
+            if pattern in ('', '.'):
+                continue
+
+            self.rules.append((exception, self.compile(pattern)))
+
+        self.has_exceptions = any(exception for exception, _ in self.rules)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load rules from .dockerignore of build context
+        :param path: Path of build context
+        :return: Returns DockerIgnore, without rules if file doesn't exist
+        """
+        try:
+            with open(os.path.join(path, ".dockerignore")) as file:
+                return cls(file.read().splitlines())
+        except OSError:
+            return cls()
+
+    def ignored(self, path):
+        """
+        Check if path is excluded from build context
+        :param path: Path relative to build context, separated by /
+        :return: Returns bool
+        """
+        ignored = False
+
+        for exception, expression in self.rules:
+            if expression.match(path):
+                ignored = not exception
+
+        return ignored
+
+    @staticmethod
+    def compile(pattern):
+        """
+        Compile pattern to regular expression, pattern matches path and everything below it
+        :param pattern: Pattern in .dockerignore format
+        :return: Returns compiled expression
+        """
+        expression = ''
+        index = 0
+
+        while index < len(pattern):
+            character = pattern[index]
+
+            if pattern.startswith("**/", index):
+                expression += "(?:.*/)?"
+                index += 3
+                continue
+            elif pattern.startswith("**", index):
+                expression += ".*"
+                index += 2
+                continue
+            elif character == "*":
+                expression += "[^/]*"
+            elif character == "?":
+                expression += "[^/]"
+            elif character == "[" and "]" in pattern[index + 1:]:
+                end = pattern.index("]", index + 1)
+                characters = pattern[index + 1:end].replace("\\", "\\\\")
+
+                if characters.startswith(("!", "^")):
+                    characters = "^" + characters[1:]
+
+                expression += "[{characters}]".format(characters=characters)
+                index = end
+            elif character == "\\" and index + 1 < len(pattern):
+                index += 1
+                expression += re.escape(pattern[index])
+            else:
+                expression += re.escape(character)
+
+            index += 1
+
+        return re.compile("^{expression}(?:/.*)?$".format(expression=expression))
+
+
+class BuildContext(object):
+    """
+        Build context streamed to docker as tar archive, checkout is walked once to know
+        size of context and files are read only while archive is being sent
+    """
+
+    # Directories never sent to docker
+    SKIPPED = (".git",)
+
+    def __init__(self, path, dockerfile="Dockerfile", chunk_size=64 * 1024):
+        """
+        :param path: Path of build context
+        :param dockerfile: Dockerfile relative to build context, always sent
+        :param chunk_size: Number of bytes in chunks of stream
+        """
+        self.path = path
+        self.dockerfile = os.path.normpath(dockerfile)
+        self.chunk_size = chunk_size
+        self.ignore = DockerIgnore.load(path)
+
+        # Tar headers of members captured by scan, archive is streamed with exactly these sizes
+        self.members = []
+        self.size = 0
+        self.count = 0
+
+        self.scan()
+
+    def scan(self):
+        """
+        Walk context and collect members which are not ignored
+        :return: Returns void
+        """
+        self.members = []
+        self.size = 2 * BLOCK_SIZE
+        self.count = 0
+
+        for root, directories, files in os.walk(self.path):
+            relative_root = os.path.relpath(root, self.path)
+            relative_root = '' if relative_root == '.' else relative_root.replace(os.sep, "/")
+
+            # Ignored directories are not walked unless exception can include something inside
+            for directory in sorted(directories):
+                relative = self.join(relative_root, directory)
+
+                if directory in self.SKIPPED or (self.ignore.ignored(relative) and not self.ignore.has_exceptions):
+                    directories.remove(directory)
+                elif not self.is_ignored(relative):
+                    self.add(relative)
+
+            directories.sort()
+
+            for name in sorted(files):
+                relative = self.join(relative_root, name)
+
+                if name not in self.SKIPPED and not self.is_ignored(relative):
+                    self.add(relative)
+
+    def add(self, relative):
+        info = self.get_info(relative)
+
+        # Sockets, pipes and devices can't be part of context
+        if info is None:
+            return
+
+        self.members.append(info)
+        self.size += len(info.tobuf(tarfile.GNU_FORMAT)) + self.get_padded_size(info.size)
+
+        if info.isreg():
+            self.count += 1
+
+    def is_ignored(self, relative):
+        # Dockerfile and .dockerignore are sent even when ignored, docker reads them from context
+        if relative in (self.dockerfile, ".dockerignore"):
+            return False
+
+        return self.ignore.ignored(relative)
+
+    def stream(self):
+        """
+        Generate tar archive of context in chunks of chunk size
+        :return: Returns generator of bytes
+        """
+        buffer = bytearray()
+
+        for info in self.members:
+            for block in self.generate_member(info):
+                buffer += block
+
+                while len(buffer) >= self.chunk_size:
+                    yield bytes(buffer[:self.chunk_size])
+                    del buffer[:self.chunk_size]
+
+        buffer += b"\0" * (2 * BLOCK_SIZE)
+
+        while buffer:
+            yield bytes(buffer[:self.chunk_size])
+            del buffer[:self.chunk_size]
+
+    def reader(self):
+        """
+        Get archive as file object of known length, context is sent with Content-Length instead of chunked encoding
+        :return: Returns ContextReader
+        """
+        return ContextReader(self.stream(), self.size)
+
+    def generate_member(self, info):
+        """
+        Generate header and content of archive member, content is read in chunks, files changed since scan
+        are cut or padded to their scanned size so archive has the length promised by reader
+        :param info: TarInfo of member captured by scan
+        :return: Returns generator of bytes
+        """
+        yield info.tobuf(tarfile.GNU_FORMAT)
+
+        if not info.isreg():
+            return
+
+        remaining = info.size
+
+        try:
+            file = open(os.path.join(self.path, info.name), "rb")
+        except OSError:
+            # File was removed since it was scanned
+            file = None
+
+        try:
+            while remaining > 0:
+                data = file.read(min(self.chunk_size, remaining)) if file is not None else b''
+
+                # File shrunk since it was scanned, header already promised its size
+                if not data:
+                    data = b"\0" * remaining
+
+                remaining -= len(data)
+                yield data
+        finally:
+            if file is not None:
+                file.close()
+
+        if info.size % BLOCK_SIZE:
+            yield b"\0" * (BLOCK_SIZE - info.size % BLOCK_SIZE)
+
+    def get_info(self, relative):
+        """
+        Create tar header of member, owner is not preserved
+        :param relative: Path relative to context
+        :return: Returns TarInfo or None for special files
+        """
+        path = os.path.join(self.path, relative)
+        status = os.lstat(path)
+
+        info = tarfile.TarInfo(relative)
+        info.mode = stat.S_IMODE(status.st_mode)
+        info.mtime = int(status.st_mtime)
+
+        if stat.S_ISDIR(status.st_mode):
+            info.type = tarfile.DIRTYPE
+        elif stat.S_ISLNK(status.st_mode):
+            info.type = tarfile.SYMTYPE
+            info.linkname = os.readlink(path)
+        elif stat.S_ISREG(status.st_mode):
+            info.type = tarfile.REGTYPE
+            info.size = status.st_size
+        else:
+            return None
+
+        return info
+
+    @staticmethod
+    def get_padded_size(size):
+        return (size + BLOCK_SIZE - 1) // BLOCK_SIZE * BLOCK_SIZE
+
+    @staticmethod
+    def join(root, name):
+        return "{root}/{name}".format(root=root, name=name) if root else name
+
+
+class ContextReader(object):
+    """
+        File object reading chunks of archive, exactly size bytes are read even when files changed since scan
+    """
+
+    def __init__(self, chunks, size):
+        """
+        :param chunks: Generator of chunks of archive
+        :param size: Size of archive
+        """
+        self.chunks = chunks
+        self.size = size
+        self.position = 0
+        self.buffer = bytearray()
+
+    def __len__(self):
+        return self.size
+
+    def read(self, size=-1):
+        remaining = self.size - self.position
+        size = remaining if size is None or size < 0 else min(size, remaining)
+
+        while len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+
+            if chunk is None:
+                self.buffer += b"\0" * (size - len(self.buffer))
+                break
+
+            self.buffer += chunk
+
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        self.position += len(data)
+
+        return data
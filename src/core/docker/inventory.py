@@ -0,0 +1,183 @@
+import threading
+from src.core.docker import aio
+
+
+class Inventory(object):
+    """
+        Snapshot of containers labelled by tower, fetched with a single request and
+        kept up to date from docker events and changes made by tower itself
+    """
+
+    LABEL = "com.tower.application"
+    SERVICE_LABEL = "com.tower.service"
+
+    def __init__(self, client, async_client):
+        """
+        :param client: Docker client
+        :param async_client: Asyncio docker client, events are followed on its loop without a thread
+        """
+        self.client = client
+        self.async_client = async_client
+
+        # Containers in list format by id
+        self.containers = {}
+
+        # Cached inspections by container id
+        self.inspections = {}
+
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.listeners = []
+        self.watcher = None
+
+    def refresh(self):
+        """
+        Fetch all containers labelled by tower
+        :return: Returns void
+        """
+        containers = self.client.containers(all=True, filters={"label": self.LABEL})
+
+        with self.lock:
+            self.containers = dict((container.get("Id"), container) for container in containers)
+            self.inspections = {}
+            self.loaded = True
+
+    def all(self):
+        """
+        Get all containers, snapshot is fetched on first use
+        :return: Returns list of containers
+        """
+        with self.lock:
+            if not self.loaded:
+                self.refresh()
+
+            return list(self.containers.values())
+
+    def by_application(self, application, running=False):
+        """
+        Get containers of application
+        :param application: Slugified name of application
+        :param running: Return only running containers
+        :return: Returns list of containers
+        """
+        return [
+            container for container in self.all()
+            if self.get_labels(container).get(self.LABEL) == application and (not running or self.is_running(container))
+        ]
+
+    def by_service(self, service_name, application=None, running=False):
+        """
+        Get containers of service
+        :param service_name: Name of service
+        :param application: Slugified name of application, None matches any application
+        :param running: Return only running containers
+        :return: Returns list of containers
+        """
+        return [
+            container for container in self.all()
+            if self.get_labels(container).get(self.SERVICE_LABEL) == service_name
+            and (application is None or self.get_labels(container).get(self.LABEL) == application)
+            and (not running or self.is_running(container))
+        ]
+
+    def inspect(self, container_id):
+        """
+        Inspect container, inspection is cached until container changes
+        :param container_id: Id of container
+        :return: Returns dict
+        """
+        with self.lock:
+            if container_id in self.inspections:
+                return self.inspections[container_id]
+
+        inspection = self.client.inspect_container(container_id)
+
+        with self.lock:
+            self.inspections[container_id] = inspection
+
+        return inspection
+
+    def update(self, container_id):
+        """
+        Fetch current state of single container
+        :param container_id: Id of container
+        :return: Returns container or None if it does not exist
+        """
+        containers = self.client.containers(all=True, filters={"id": container_id, "label": self.LABEL})
+
+        return self.store(container_id, containers)
+
+    def store(self, container_id, containers):
+        """
+        Store fetched state of single container
+        :param container_id: Id of container
+        :param containers: Containers matching id, empty if it does not exist
+        :return: Returns container or None if it does not exist
+        """
+        with self.lock:
+            self.inspections.pop(container_id, None)
+
+            if not containers:
+                self.containers.pop(container_id, None)
+                return None
+
+            self.containers[container_id] = containers[0]
+            return containers[0]
+
+    def remove(self, container_id):
+        with self.lock:
+            self.containers.pop(container_id, None)
+            self.inspections.pop(container_id, None)
+
+    def subscribe(self, listener):
+        """
+        Call listener with id of container on every change of container
+        :param listener: Function taking container id
+        :return: Returns void
+        """
+        self.listeners.append(listener)
+
+    def watch(self):
+        """
+        Start following docker events on loop of asyncio client, started once
+        :return: Returns void
+        """
+        with self.lock:
+            if self.watcher is not None:
+                return
+
+            self.watcher = aio.spawn(self.listen())
+
+    async def listen(self):
+        try:
+            events = await self.async_client.events(filters={"type": "container", "label": self.LABEL})
+
+            async for event in events:
+                container_id = event.get("id") or event.get("Actor", {}).get("ID", '')
+                action = event.get("Action") or event.get("status", '')
+
+                if action == "destroy":
+                    self.remove(container_id)
+                elif self.loaded:
+                    self.store(container_id, await self.async_client.containers(
+                        all=True, filters={"id": container_id, "label": self.LABEL}
+                    ))
+
+                for listener in self.listeners:
+                    listener(container_id)
+        except Exception:
+            # Inventory is still updated by changes made by tower
+            pass
+
+    @staticmethod
+    def get_labels(container):
+        return container.get("Labels") or {}
+
+    @staticmethod
+    def get_name(container):
+        names = container.get("Names") or ['']
+        return names[0].lstrip("/")
+
+    @staticmethod
+    def is_running(container):
+        return container.get("State") == "running" or container.get("Status", '').startswith("Up")
@@ -0,0 +1,219 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from requests.exceptions import RequestException
+from src.core import log
+from src.core import metrics
+from src.core.units import format_size
+from src.core.docker import aio
+from src.core.docker import stream
+from src.core.docker.registry import Registry
+from src.exceptions import DockerAPIError, FailedToPullImage
+
+
+class PullScheduler(object):
+    """
+        Pulls images of deployment before containers are created, images are pulled concurrently
+        and images of the same repository one after another, so later pulls find layers of the first
+        one instead of downloading them again
+    """
+
+    def __init__(self, client, registries=None, max_workers=4, progress_interval=2.0):
+        """
+        :param client: Asyncio docker client, streams of pulls share its connections
+        :param registries: Dict of registry options (host, port, username, password) by registry url
+        :param max_workers: Number of images pulled at the same time
+        :param progress_interval: Minimal number of seconds between progress reports of a pull
+        """
+        self.client = client
+        self.registries = registries or {}
+        self.max_workers = max(int(max_workers), 1)
+        self.progress_interval = progress_interval
+
+        # Clients of registry API by registry url
+        self.clients = {}
+        self.clients_lock = threading.Lock()
+
+        # Layers downloaded by pulls of this scheduler
+        self.layers = set()
+        self.layers_lock = threading.Lock()
+
+    def pull(self, images):
+        """
+        Pull images and wait until all are pulled
+        :param images: List of image names in format [<registry>/]<image>[:<tag>], duplicates are pulled once
+        :return: Returns tuple of list of pull reports and dict of errors by image, empty on success
+        """
+        repositories = {}
+        for image in sorted(set(images)):
+            repositories.setdefault(self.parse(image)[1], []).append(image)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                executor.submit(log.bind(self.pull_repository), repository_images)
+                for repository_images in repositories.values()
+            ]
+
+            reports = []
+            errors = {}
+            for future in futures:
+                repository_reports, repository_errors = future.result()
+                reports += repository_reports
+                errors.update(repository_errors)
+
+        return reports, errors
+
+    def pull_repository(self, images):
+        """
+        Pull tags of single repository one after another
+        :param images: List of image names of the same repository
+        :return: Returns tuple of list of pull reports and dict of errors by image
+        """
+        reports = []
+        errors = {}
+
+        for image in images:
+            try:
+                reports.append(self.pull_image(image))
+            except (FailedToPullImage, DockerAPIError, RequestException, OSError, ValueError,
+                    asyncio.TimeoutError) as e:
+                log.emit("Failed to pull {image}: {error}".format(image=image, error=e))
+                errors[image] = str(e)
+
+        return reports, errors
+
+    def pull_image(self, image):
+        """
+        Pull image unless local image has the same digest as image in registry
+        :param image: Image name
+        :return: Returns dict with pull report
+        """
+        if self.is_current(image):
+            log.emit("Image {image} is up to date".format(image=image))
+            return {"image": image, "skipped": True}
+
+        with metrics.stage("pull", image=image) as stage:
+            report = self.stream_pull(image)
+            stage.bytes = report.get("bytes")
+
+        return report
+
+    def stream_pull(self, image):
+        """
+        Pull image and follow progress of its layers
+        :param image: Image name
+        :return: Returns dict with pull report
+        """
+        log.emit("Pulling {image}".format(image=image))
+
+        progress = stream.Progress("Pulling", image, self.progress_interval)
+        registry, repository, tag = self.parse(image)
+
+        for item in aio.iterate(self.client.pull(repository, tag, self.get_auth(registry))):
+            error = stream.get_error(item)
+            if error:
+                raise FailedToPullImage(error)
+
+            message = progress.update(item)
+            if message:
+                log.emit(message)
+
+        with self.layers_lock:
+            # Layers downloaded by other pull of this deploy are shared by docker
+            shared = len([layer for layer in progress.skipped if layer in self.layers])
+            self.layers.update(progress.layers)
+
+        report = {
+            "image": image,
+            "skipped": False,
+            "duration": round(progress.duration, 3),
+            "bytes": progress.bytes,
+            "layers_pulled": len(progress.layers),
+            "layers_existed": len(progress.skipped),
+            "layers_shared": shared,
+        }
+
+        log.emit("Pulled {image} in {duration}s, {size} in {pulled} layers, {existed} layers existed".format(
+            image=image,
+            duration=report.get("duration"),
+            size=format_size(report.get("bytes")),
+            pulled=report.get("layers_pulled"),
+            existed=report.get("layers_existed")
+        ))
+
+        return report
+
+    def is_current(self, image):
+        """
+        Check if local image has the same digest as image in registry
+        :param image: Image name
+        :return: Returns bool, False when image is missing or registry can't be reached
+        """
+        registry, repository, tag = self.parse(image)
+
+        try:
+            local = aio.run(self.client.inspect_image(image))
+        except DockerAPIError:
+            return False
+
+        # Images referenced by digest never change
+        if "@" in image:
+            return True
+
+        digests = [digest.split("@", 1)[1] for digest in local.get("RepoDigests") or []
+                   if digest.split("@", 1)[0] == repository]
+
+        if not digests or not registry:
+            return False
+
+        name = repository[len(registry) + 1:]
+        return self.get_registry(registry).get_digest(name, tag) in digests
+
+    def get_auth(self, url):
+        """
+        Get credentials of registry sent with pull
+        :param url: Registry in format <host>:<port>, empty for docker hub
+        :return: Returns dict or None for registries without credentials
+        """
+        options = self.registries.get(url, {})
+
+        if not options.get("username"):
+            return None
+
+        return {"username": options.get("username"), "password": options.get("password", ''), "serveraddress": url}
+
+    def get_registry(self, url):
+        """
+        Get client of registry API, credentials come from registry options
+        :param url: Registry in format <host>:<port>
+        :return: Returns Registry
+        """
+        with self.clients_lock:
+            if url not in self.clients:
+                options = self.registries.get(url, {})
+                self.clients[url] = Registry(url, options.get("username", ''), options.get("password", ''))
+
+            return self.clients[url]
+
+    @staticmethod
+    def parse(image):
+        """
+        Split image name to registry, repository and tag
+        :param image: Image name in format [<registry>/]<image>[:<tag>|@<digest>]
+        :return: Returns tuple of registry url (empty for docker hub), repository with registry and tag
+        """
+        name, _, digest = image.partition("@")
+        repository, tag = name, "latest"
+
+        if ":" in name.rsplit("/", 1)[-1]:
+            repository, tag = name.rsplit(":", 1)
+
+        if digest:
+            tag = digest
+
+        parts = repository.split("/", 1)
+        registry = ''
+        if len(parts) == 2 and ("." in parts[0] or ":" in parts[0] or parts[0] == "localhost"):
+            registry = parts[0]
+
+        return registry, repository, tag
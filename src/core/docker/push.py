@@ -0,0 +1,169 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from src.core import log
+from src.core import metrics
+from src.core.units import format_size
+from src.core.docker import aio
+from src.core.docker import stream
+from src.exceptions import DockerAPIError, FailedToPushImage
+
+
+class PushScheduler(object):
+    """
+        Pushes images to registries, registries are pushed to concurrently and
+        number of simultaneous pushes to a single registry is limited
+    """
+
+    def __init__(self, client, limits=None, auths=None, default_limit=2, max_workers=8, progress_interval=2.0):
+        """
+        :param client: Asyncio docker client, streams of pushes share its connections
+        :param limits: Dict of connection limits by registry url
+        :param auths: Dict of credentials (username, password) by registry url
+        :param default_limit: Connection limit of registries missing in limits
+        :param max_workers: Number of threads pushing images
+        :param progress_interval: Minimal number of seconds between progress reports of a push
+        """
+        self.client = client
+        self.limits = limits or {}
+        self.auths = auths or {}
+        self.default_limit = default_limit
+        self.progress_interval = progress_interval
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        self.semaphores = {}
+        self.semaphores_lock = threading.Lock()
+
+    def push(self, images):
+        """
+        Push images and wait until all are pushed
+        :param images: List of tuples (<registry>/<image>, tag), images have to be tagged
+        :return: Returns list of push reports
+        """
+        # Aliases of image in the same registry are pushed one after another,
+        # first push uploads layers and following pushes find them in registry
+        registries = {}
+        for registry_image, tag in images:
+            registries.setdefault(self.get_registry(registry_image), []).append((registry_image, tag))
+
+        futures = [
+            self.executor.submit(log.bind(self.push_to_registry), registry, registry_images)
+            for registry, registry_images in registries.items()
+        ]
+
+        reports = []
+        errors = []
+        for future in futures:
+            try:
+                reports += future.result()
+            except FailedToPushImage as e:
+                errors.append(str(e))
+
+        if errors:
+            raise FailedToPushImage("\n".join(errors))
+
+        return reports
+
+    def push_to_registry(self, registry, images):
+        """
+        Push images to single registry, holds connection of registry
+        :param registry: Url of registry
+        :param images: List of tuples (<registry>/<image>, tag)
+        :return: Returns list of push reports
+        """
+        reports = []
+
+        with self.get_semaphore(registry):
+            for registry_image, tag in images:
+                try:
+                    reports.append(self.push_image(registry_image, tag))
+                except (DockerAPIError, OSError, ValueError, asyncio.TimeoutError) as e:
+                    raise FailedToPushImage("{image}:{tag}: {error}".format(image=registry_image, tag=tag, error=e))
+
+        return reports
+
+    def push_image(self, registry_image, tag):
+        """
+        Push image to registry, progress is reported at most once per progress interval
+        :param registry_image: Repository image name in format <registry>/<image>
+        :param tag: Tag for registry image
+        :return: Returns dict with push report
+        """
+        name = "{registry_image}:{tag}".format(registry_image=registry_image, tag=tag)
+
+        with metrics.stage("push", image=name) as stage:
+            report = self.stream_push(name, registry_image, tag)
+            stage.bytes = report.get("bytes")
+
+        return report
+
+    def stream_push(self, name, registry_image, tag):
+        """
+        Push image and follow progress of its layers
+        :param name: Tagged name of image
+        :param registry_image: Repository image name in format <registry>/<image>
+        :param tag: Tag for registry image
+        :return: Returns dict with push report
+        """
+        log.emit("Pushing image to: {name}".format(name=name))
+
+        progress = stream.Progress("Pushing", name, self.progress_interval)
+
+        auth = self.auths.get(self.get_registry(registry_image))
+
+        for item in aio.iterate(self.client.push(registry_image, tag, auth)):
+            error = stream.get_error(item)
+            if error:
+                raise FailedToPushImage("{name}: {error}".format(name=name, error=error))
+
+            message = progress.update(item)
+            if message:
+                log.emit(message)
+
+        report = {
+            "image": name,
+            "duration": round(progress.duration, 3),
+            "bytes": progress.bytes,
+            "layers_pushed": len(progress.layers),
+            "layers_skipped": len(progress.skipped),
+        }
+
+        log.emit("Pushed {image} in {duration}s, {size} in {pushed} layers, {skipped} layers existed".format(
+            image=name,
+            duration=report.get("duration"),
+            size=format_size(report.get("bytes")),
+            pushed=report.get("layers_pushed"),
+            skipped=report.get("layers_skipped")
+        ))
+
+        return report
+
+    def get_semaphore(self, registry):
+        """
+        Get semaphore limiting connections to registry
+        :param registry: Url of registry
+        :return: Returns semaphore
+        """
+        with self.semaphores_lock:
+            if registry not in self.semaphores:
+                limit = self.limits.get(registry, self.default_limit)
+                self.semaphores[registry] = threading.BoundedSemaphore(max(int(limit), 1))
+
+            return self.semaphores[registry]
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    @staticmethod
+    def get_registry(registry_image):
+        """
+        Get registry url of image
+        :param registry_image: Repository image name in format <registry>/<image>
+        :return: Returns string, empty for images without registry
+        """
+        parts = registry_image.split("/", 1)
+
+        if len(parts) == 2 and ("." in parts[0] or ":" in parts[0] or parts[0] == "localhost"):
+            return parts[0]
+
+        return ''
@@ -0,0 +1,175 @@
+import time
+import socket
+import threading
+import http.client
+from docker.errors import APIError
+
+
+class Readiness(object):
+    """
+        Waits until container is ready, container state is inspected with backoff
+        and every event of container wakes up its waiter immediately
+    """
+
+    DEFAULT_TIMEOUT = 120
+
+    # Results of wait
+    UP = 'Up'
+    HEALTHY = 'Healthy'
+    UNHEALTHY = 'Unhealthy'
+    EXITED = 'Exited'
+    TIMEOUT = 'Timeout'
+
+    def __init__(self, client, interval=0.1, max_interval=2.0, events=True):
+        """
+        :param client: Docker client
+        :param interval: Seconds before first repeated inspection, doubled after each inspection
+        :param max_interval: Maximal number of seconds between inspections
+        :param events: Subscribe to docker events to wake up waiters
+        """
+        self.client = client
+        self.interval = interval
+        self.max_interval = max_interval
+        self.events = events
+
+        self.waiters = {}
+        self.waiters_lock = threading.Lock()
+        self.events_thread = None
+
+    def wait(self, container_id, timeout=None, probe=None):
+        """
+        Wait until container is running and healthy, has exited or timeout passed
+        :param container_id: Id of container
+        :param timeout: Seconds to wait, defaults to DEFAULT_TIMEOUT
+        :param probe: Readiness probe of service, dict with one of tcp, http or exec
+        :return: Returns tuple of status and state of container
+        """
+        deadline = time.time() + (timeout or self.DEFAULT_TIMEOUT)
+        interval = self.interval
+        wake = threading.Event()
+
+        self.subscribe()
+        with self.waiters_lock:
+            self.waiters.setdefault(container_id, []).append(wake)
+
+        try:
+            while True:
+                inspect = self.client.inspect_container(container_id)
+                state = inspect.get("State", {})
+                status = self.get_status(inspect, probe)
+
+                if status is not None:
+                    return status, state
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return self.TIMEOUT, state
+
+                wake.wait(min(interval, remaining))
+                wake.clear()
+                interval = min(interval * 2, self.max_interval)
+        finally:
+            with self.waiters_lock:
+                self.waiters[container_id].remove(wake)
+
+                if not self.waiters[container_id]:
+                    del self.waiters[container_id]
+
+    def get_status(self, inspect, probe=None):
+        """
+        Get readiness of container
+        :param inspect: Result of container inspection
+        :param probe: Readiness probe of service
+        :return: Returns status or None if container is not ready yet
+        """
+        state = inspect.get("State", {})
+
+        if state.get("Status") in ("exited", "dead"):
+            return self.EXITED
+
+        if not state.get("Running"):
+            return None
+
+        health = (state.get("Health") or {}).get("Status")
+        if health == "unhealthy":
+            return self.UNHEALTHY
+        if health == "starting":
+            return None
+
+        if probe and not self.probe(inspect, probe):
+            return None
+
+        return self.HEALTHY if health == "healthy" else self.UP
+
+    def probe(self, inspect, probe):
+        """
+        Run readiness probe against container
+        :param inspect: Result of container inspection
+        :param probe: Dict with tcp port, http path with port or exec command
+        :return: Returns bool
+        """
+        address = self.get_ip_address(inspect)
+
+        try:
+            if probe.get("tcp"):
+                with socket.create_connection((address, int(probe.get("tcp"))), timeout=1):
+                    return True
+
+            if probe.get("http"):
+                connection = http.client.HTTPConnection(address, int(probe.get("port", 80)), timeout=1)
+                try:
+                    connection.request("GET", probe.get("http"))
+                    return connection.getresponse().status < 500
+                finally:
+                    connection.close()
+
+            if probe.get("exec"):
+                exec_id = self.client.exec_create(container=inspect.get("Id"), cmd=probe.get("exec"))
+                self.client.exec_start(exec_id=exec_id)
+                return self.client.exec_inspect(exec_id).get("ExitCode") == 0
+
+        except (OSError, http.client.HTTPException, APIError):
+            return False
+
+        return True
+
+    @staticmethod
+    def get_ip_address(inspect):
+        networks = inspect.get("NetworkSettings", {}).get("Networks") or {}
+        network_mode = inspect.get("HostConfig", {}).get("NetworkMode", '')
+        network = networks.get(network_mode) or next(iter(networks.values()), {})
+
+        return network.get("IPAddress") or inspect.get("NetworkSettings", {}).get("IPAddress", '')
+
+    def notify(self, container_id):
+        """
+        Wake up waiters of container
+        :param container_id: Id of container
+        :return: Returns void
+        """
+        with self.waiters_lock:
+            for wake in self.waiters.get(container_id, []):
+                wake.set()
+
+    def subscribe(self):
+        """
+        Start thread listening to container events, started once
+        :return: Returns void
+        """
+        if not self.events:
+            return
+
+        with self.waiters_lock:
+            if self.events_thread is not None:
+                return
+
+            self.events_thread = threading.Thread(target=self.listen, name="readiness-events", daemon=True)
+            self.events_thread.start()
+
+    def listen(self):
+        try:
+            for event in self.client.events(decode=True, filters={"type": "container"}):
+                self.notify(event.get("id") or event.get("Actor", {}).get("ID", ''))
+        except Exception:
+            # Waiters fall back to inspection with backoff
+            pass
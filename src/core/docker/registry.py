@@ -0,0 +1,117 @@
+import requests
+from requests.exceptions import RequestException
+
+
+class Registry(object):
+    """
+        Minimal client of docker registry HTTP API v2, used to look up images without pulling them
+    """
+
+    MANIFEST_TYPES = ", ".join([
+        "application/vnd.docker.distribution.manifest.v2+json",
+        "application/vnd.docker.distribution.manifest.list.v2+json",
+        "application/vnd.oci.image.manifest.v1+json",
+        "application/vnd.oci.image.index.v1+json",
+    ])
+
+    def __init__(self, url, username='', password='', timeout=10):
+        """
+        :param url: Registry in format <host>:<port>
+        :param username: Username of registry
+        :param password: Password of registry
+        :param timeout: Timeout of requests in seconds
+        """
+        self.url = url
+        self.auth = (username, password) if username else None
+        self.timeout = timeout
+        self.scheme = None
+        self.tokens = {}
+        self.session = requests.Session()
+
+    def get_digest(self, name, tag):
+        """
+        Get digest of manifest
+        :param name: Name of image without registry
+        :param tag: Tag of image
+        :return: Returns string or None if image doesn't exist
+        """
+        response = self.request("HEAD", "/v2/{name}/manifests/{tag}".format(name=name, tag=tag), name)
+
+        if response is None or response.status_code != 200:
+            return None
+
+        return response.headers.get("Docker-Content-Digest", '')
+
+    def exists(self, name, tag):
+        """
+        Check if image exists in registry
+        :param name: Name of image without registry
+        :param tag: Tag of image
+        :return: Returns bool
+        """
+        return self.get_digest(name, tag) is not None
+
+    def request(self, method, path, name):
+        """
+        Make request to registry, https is preferred and http is used for insecure registries
+        :param method: HTTP method
+        :param path: Path of API
+        :param name: Name of image, used as scope of token
+        :return: Returns response or None when registry is not reachable
+        """
+        schemes = [self.scheme] if self.scheme else ["https", "http"]
+
+        for scheme in schemes:
+            try:
+                response = self.send(method, "{scheme}://{url}{path}".format(scheme=scheme, url=self.url, path=path),
+                                     name)
+            except RequestException:
+                continue
+
+            self.scheme = scheme
+            return response
+
+        return None
+
+    def send(self, method, url, name):
+        headers = {"Accept": self.MANIFEST_TYPES}
+
+        if name in self.tokens:
+            headers["Authorization"] = "Bearer {token}".format(token=self.tokens[name])
+
+        response = self.session.request(method, url, headers=headers, auth=None if name in self.tokens else self.auth,
+                                        timeout=self.timeout)
+
+        # Registries with token authentication send realm of token service
+        challenge = response.headers.get("Www-Authenticate", '')
+        if response.status_code == 401 and challenge.startswith("Bearer ") and name not in self.tokens:
+            token = self.get_token(challenge, name)
+
+            if token:
+                self.tokens[name] = token
+                return self.send(method, url, name)
+
+        return response
+
+    def get_token(self, challenge, name):
+        """
+        Get token from authentication service of registry
+        :param challenge: Www-Authenticate header in format Bearer realm="...",service="..."
+        :param name: Name of image
+        :return: Returns string or None
+        """
+        parameters = {}
+        for part in challenge[len("Bearer "):].split(","):
+            key, _, value = part.partition("=")
+            parameters[key.strip()] = value.strip().strip('"')
+
+        realm = parameters.pop("realm", '')
+        parameters["scope"] = "repository:{name}:pull".format(name=name)
+
+        try:
+            response = self.session.get(realm, params=parameters, auth=self.auth, timeout=self.timeout)
+            data = response.json()
+        except (RequestException, ValueError):
+            return None
+
+        return data.get("token") or data.get("access_token")
@@ -0,0 +1,257 @@
+import re
+from src.core.units import parse_size
+from src.exceptions import InvalidResources
+
+# Period of CPU scheduler used for cpus option, in microseconds
+CPU_PERIOD = 100000
+
+CPUSET_PATTERN = re.compile(r'^\d+(-\d+)?(,\d+(-\d+)?)*$')
+
+# Options of service in docker-compose v2 format, blkio_config is nested
+OPTIONS = (
+    "mem_limit", "memswap_limit", "mem_reservation", "mem_swappiness", "kernel_memory", "oom_kill_disable",
+    "oom_score_adj", "shm_size", "tmpfs", "cpus", "cpu_shares", "cpu_quota", "cpu_period", "cpuset", "pids_limit",
+    "ulimits", "blkio_config",
+)
+
+BLKIO_OPTIONS = ("weight", "weight_device", "device_read_bps", "device_write_bps", "device_read_iops",
+                 "device_write_iops")
+
+
+def get_resources(service, defaults=None):
+    """
+    Map resource options of service to arguments of create_host_config, options missing in service
+    are taken from defaults of environment
+    :param service: Service definition
+    :param defaults: Resource options of environment
+    :return: Returns dict of arguments of create_host_config, only set options are included
+    """
+    unknown = sorted(key for key in (defaults or {}) if key not in OPTIONS)
+    if unknown:
+        raise InvalidResources("Unknown resource defaults: {keys}".format(keys=", ".join(unknown)))
+
+    options = dict((defaults or {}).items())
+    options.update((key, value) for key, value in service.items() if key in OPTIONS and value is not None)
+
+    resources = {}
+
+    for key in ("mem_limit", "mem_reservation", "kernel_memory", "shm_size"):
+        if options.get(key) is not None:
+            resources[key] = parse_bytes(key, options.get(key))
+
+    # Swap can be unlimited with -1
+    if options.get("memswap_limit") is not None:
+        if str(options.get("memswap_limit")) == "-1":
+            resources["memswap_limit"] = -1
+        else:
+            resources["memswap_limit"] = parse_bytes("memswap_limit", options.get("memswap_limit"))
+
+    if options.get("mem_swappiness") is not None:
+        resources["mem_swappiness"] = parse_int("mem_swappiness", options.get("mem_swappiness"), 0, 100)
+
+    if options.get("oom_kill_disable") is not None:
+        resources["oom_kill_disable"] = parse_bool("oom_kill_disable", options.get("oom_kill_disable"))
+
+    if options.get("oom_score_adj") is not None:
+        resources["oom_score_adj"] = parse_int("oom_score_adj", options.get("oom_score_adj"), -1000, 1000)
+
+    if options.get("cpu_shares") is not None:
+        resources["cpu_shares"] = parse_int("cpu_shares", options.get("cpu_shares"), 2)
+
+    if options.get("cpu_period") is not None:
+        resources["cpu_period"] = parse_int("cpu_period", options.get("cpu_period"), 1000, 1000000)
+
+    if options.get("cpu_quota") is not None:
+        resources["cpu_quota"] = parse_int("cpu_quota", options.get("cpu_quota"), 1000)
+
+    if options.get("cpus") is not None:
+        if "cpu_quota" in resources:
+            raise InvalidResources("Options cpus and cpu_quota can't be used together")
+
+        cpus = parse_float("cpus", options.get("cpus"), 0.01)
+        resources["cpu_period"] = resources.get("cpu_period", CPU_PERIOD)
+        resources["cpu_quota"] = int(round(cpus * resources.get("cpu_period")))
+
+    if options.get("cpuset") is not None:
+        cpuset = str(options.get("cpuset")).replace(" ", '')
+        if not CPUSET_PATTERN.match(cpuset):
+            raise InvalidResources("Invalid cpuset: {value}".format(value=options.get("cpuset")))
+        resources["cpuset_cpus"] = cpuset
+
+    if options.get("pids_limit") is not None:
+        resources["pids_limit"] = parse_int("pids_limit", options.get("pids_limit"), -1)
+
+    if options.get("ulimits") is not None:
+        resources["ulimits"] = parse_ulimits(options.get("ulimits"))
+
+    if options.get("tmpfs") is not None:
+        resources["tmpfs"] = parse_tmpfs(options.get("tmpfs"))
+
+    if options.get("blkio_config") is not None:
+        resources.update(parse_blkio_config(options.get("blkio_config")))
+
+    return resources
+
+
+def parse_ulimits(ulimits):
+    """
+    Parse ulimits in format {nofile: {soft: 1024, hard: 2048}, nproc: 512}
+    :param ulimits: Dict of limits by name
+    :return: Returns list of dicts with name, soft and hard limit
+    """
+    if not isinstance(ulimits, dict):
+        raise InvalidResources("Invalid ulimits: {value}".format(value=ulimits))
+
+    result = []
+
+    for name, limit in sorted(ulimits.items()):
+        key = "ulimits.{name}".format(name=name)
+
+        if isinstance(limit, dict):
+            soft = parse_int(key, limit.get("soft"), -1)
+            hard = parse_int(key, limit.get("hard"), -1)
+        else:
+            soft = hard = parse_int(key, limit, -1)
+
+        if hard != -1 and (soft == -1 or soft > hard):
+            raise InvalidResources("Soft limit of ulimit {name} is above hard limit".format(name=name))
+
+        result.append({"name": name, "soft": soft, "hard": hard})
+
+    return result
+
+
+def parse_tmpfs(tmpfs):
+    """
+    Parse tmpfs mounts in format /path[:options], as string, list or dict of options by path
+    :param tmpfs: Mounts
+    :return: Returns dict of mount options by path
+    """
+    if isinstance(tmpfs, str):
+        tmpfs = [tmpfs]
+
+    if isinstance(tmpfs, dict):
+        mounts = dict((path, options or '') for path, options in tmpfs.items())
+    elif isinstance(tmpfs, list):
+        mounts = dict(str(mount).partition(":")[::2] for mount in tmpfs)
+    else:
+        raise InvalidResources("Invalid tmpfs: {value}".format(value=tmpfs))
+
+    for path in mounts:
+        if not path.startswith("/"):
+            raise InvalidResources("Path of tmpfs must be absolute: {path}".format(path=path))
+
+    return mounts
+
+
+def parse_blkio_config(config):
+    """
+    Parse blkio_config of docker-compose, rates of bps options are sizes, e.g. 10m
+    :param config: Dict of block IO options
+    :return: Returns dict of arguments of create_host_config
+    """
+    if not isinstance(config, dict):
+        raise InvalidResources("Invalid blkio_config: {value}".format(value=config))
+
+    unknown = sorted(key for key in config if key not in BLKIO_OPTIONS)
+    if unknown:
+        raise InvalidResources("Unknown blkio_config options: {keys}".format(keys=", ".join(unknown)))
+
+    resources = {}
+
+    if config.get("weight") is not None:
+        resources["blkio_weight"] = parse_int("blkio_config.weight", config.get("weight"), 10, 1000)
+
+    if config.get("weight_device") is not None:
+        resources["blkio_weight_device"] = [
+            {"Path": parse_device("blkio_config.weight_device", device),
+             "Weight": parse_int("blkio_config.weight_device", device.get("weight"), 10, 1000)}
+            for device in parse_list("blkio_config.weight_device", config.get("weight_device"))
+        ]
+
+    for key in ("device_read_bps", "device_write_bps"):
+        if config.get(key) is not None:
+            name = "blkio_config.{key}".format(key=key)
+            resources[key] = [
+                {"Path": parse_device(name, device), "Rate": parse_bytes(name, device.get("rate"))}
+                for device in parse_list(name, config.get(key))
+            ]
+
+    for key in ("device_read_iops", "device_write_iops"):
+        if config.get(key) is not None:
+            name = "blkio_config.{key}".format(key=key)
+            resources[key] = [
+                {"Path": parse_device(name, device), "Rate": parse_int(name, device.get("rate"), 1)}
+                for device in parse_list(name, config.get(key))
+            ]
+
+    return resources
+
+
+def parse_list(name, value):
+    if not isinstance(value, list) or not all(isinstance(item, dict) for item in value):
+        raise InvalidResources("Option {name} must be list of devices".format(name=name))
+
+    return value
+
+
+def parse_device(name, device):
+    path = device.get("path") or ''
+
+    if not path.startswith("/"):
+        raise InvalidResources("Option {name} needs absolute path of device".format(name=name))
+
+    return path
+
+
+def parse_bytes(name, value):
+    try:
+        size = parse_size(value)
+    except ValueError:
+        size = None
+
+    if size is None or size < 0:
+        raise InvalidResources("Invalid size of {name}: {value}".format(name=name, value=value))
+
+    return size
+
+
+def parse_int(name, value, minimum=None, maximum=None):
+    if isinstance(value, bool):
+        value = None
+
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise InvalidResources("Option {name} must be integer: {value}".format(name=name, value=value))
+
+    if number != float(value) or (minimum is not None and number < minimum) or \
+            (maximum is not None and number > maximum):
+        raise InvalidResources("Option {name} is out of range: {value}".format(name=name, value=value))
+
+    return number
+
+
+def parse_float(name, value, minimum=None):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise InvalidResources("Option {name} must be number: {value}".format(name=name, value=value))
+
+    if minimum is not None and number < minimum:
+        raise InvalidResources("Option {name} is out of range: {value}".format(name=name, value=value))
+
+    return number
+
+
+def parse_bool(name, value):
+    if isinstance(value, bool):
+        return value
+
+    if str(value).lower() in ("true", "yes", "1"):
+        return True
+
+    if str(value).lower() in ("false", "no", "0"):
+        return False
+
+    raise InvalidResources("Option {name} must be boolean: {value}".format(name=name, value=value))
@@ -0,0 +1,201 @@
+import json
+import time
+import codecs
+from src.core.units import format_size
+
+
+class StreamDecoder(object):
+    """
+        Incremental decoder of json streams of docker, chunk may hold several objects or part of one
+    """
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.text = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ''
+
+        # Offset of buffer up to which objects were tried without success
+        self.scanned = 0
+
+    def feed(self, chunk):
+        """
+        Add chunk of stream
+        :param chunk: Bytes or string
+        :return: Returns list of decoded objects completed by chunk
+        """
+        self.buffer += self.text.decode(chunk) if isinstance(chunk, bytes) else chunk
+
+        items = []
+        position = 0
+        length = len(self.buffer)
+
+        while True:
+            # Objects are separated by new lines or nothing at all
+            while position < length and self.buffer[position] in " \t\r\n":
+                position += 1
+
+            if position == length:
+                break
+
+            # Object is tried once its line ends, or when buffer ends like object without new line,
+            # so large object split to many chunks is not parsed again with every chunk
+            if self.buffer.find("\n", max(position, self.scanned)) == -1 and self.buffer[-1] not in "}]":
+                self.scanned = length
+                break
+
+            try:
+                item, position = self.decoder.raw_decode(self.buffer, position)
+            except ValueError:
+                # Object continues in next chunk
+                self.scanned = length
+                break
+
+            items.append(item)
+
+        self.buffer = self.buffer[position:]
+        self.scanned = max(self.scanned - position, 0)
+
+        return items
+
+    def close(self):
+        """
+        End stream, rest of stream has to be complete
+        :return: Returns void
+        """
+        if self.buffer.strip():
+            raise ValueError("Incomplete json at the end of stream: {buffer}".format(buffer=self.buffer[:200]))
+
+
+def decode(chunks):
+    """
+    Decode stream of docker client, chunks decoded by client are passed through
+    :param chunks: Iterable of bytes, strings or dicts
+    :return: Returns generator of dicts
+    """
+    decoder = StreamDecoder()
+
+    for chunk in chunks:
+        if isinstance(chunk, dict):
+            yield chunk
+            continue
+
+        for item in decoder.feed(chunk):
+            yield item
+
+    decoder.close()
+
+
+def get_error(item):
+    """
+    Get error embedded in stream, docker reports failures of pulls, pushes and builds
+    in the stream after response status 200
+    :param item: Decoded object of stream
+    :return: Returns message or None
+    """
+    detail = item.get("errorDetail")
+
+    if item.get("error") or detail:
+        message = item.get("error") or (detail.get("message") if isinstance(detail, dict) else str(detail))
+        code = detail.get("code") if isinstance(detail, dict) else None
+
+        if code:
+            return "{message} (code {code})".format(message=message, code=code)
+
+        return message or "Unknown error"
+
+    return None
+
+
+class Progress(object):
+    """
+        Progress of layers of pull, push or build, reported in aggregate at most once per interval
+    """
+
+    # Statuses of layers which are not transferred
+    SKIPPED_STATUSES = ("Already exists", "Layer already exists", "Mounted from")
+
+    # Statuses of transferred layers
+    DONE_STATUSES = ("Download complete", "Pull complete", "Pushed")
+
+    def __init__(self, action, name, interval=2.0):
+        """
+        :param action: Action shown in report, e.g. Pulling
+        :param name: Name of image
+        :param interval: Minimal number of seconds between reports
+        """
+        self.action = action
+        self.name = name
+        self.interval = interval
+        self.started = time.time()
+        self.reported = self.started
+
+        # Current and total bytes of transferred layers by layer id
+        self.layers = {}
+        self.skipped = set()
+
+        # Layers which reached done status, their total may be unknown
+        self.completed = set()
+
+    def update(self, item):
+        """
+        Update progress from object of stream
+        :param item: Decoded object of stream
+        :return: Returns report if it is due, otherwise None
+        """
+        layer = item.get("id")
+        status = item.get("status", '') or ''
+
+        if layer and status.startswith(self.SKIPPED_STATUSES):
+            self.skipped.add(layer)
+            self.layers.pop(layer, None)
+            self.completed.discard(layer)
+        elif layer and layer not in self.skipped:
+            progress = item.get("progressDetail") or {}
+            current, total = self.layers.get(layer, (0, 0))
+
+            if status in self.DONE_STATUSES:
+                current = total
+                self.completed.add(layer)
+            elif status in ("Downloading", "Pushing") and progress:
+                current, total = progress.get("current", current), progress.get("total", total) or total
+
+            if status in ("Downloading", "Pushing") or layer in self.layers or status in self.DONE_STATUSES:
+                self.layers[layer] = (current, total)
+
+        if time.time() - self.reported >= self.interval:
+            self.reported = time.time()
+            return self.format()
+
+        return None
+
+    @property
+    def bytes(self):
+        return sum(current for current, _ in self.layers.values())
+
+    @property
+    def total(self):
+        return sum(total for _, total in self.layers.values())
+
+    @property
+    def done(self):
+        return len(self.completed.union(
+            layer for layer, (current, total) in self.layers.items() if total and current >= total
+        ))
+
+    @property
+    def duration(self):
+        return time.time() - self.started
+
+    def format(self):
+        duration = self.duration
+
+        return "{action} {name}: {done}/{count} layers, {current} / {total}, {rate}/s, {skipped} layers existed".format(
+            action=self.action,
+            name=self.name,
+            done=self.done,
+            count=len(self.layers),
+            current=format_size(self.bytes),
+            total=format_size(self.total),
+            rate=format_size(self.bytes / duration if duration > 0 else 0),
+            skipped=len(self.skipped)
+        )
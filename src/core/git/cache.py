@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+from contextlib import contextmanager
+
+
+class RepositoryCache(object):
+    """
+        Persistent cache of cloned repositories, checkouts are stored under
+        sha256 of their origin so every builder on the host reuses them
+    """
+
+    def __init__(self, root="/storage/repositories", budget=None, max_age=None):
+        """
+        :param root: Directory of cached checkouts
+        :param budget: Maximum size of cache in bytes, None disables eviction by size
+        :param max_age: Checkouts unused for longer than max_age seconds are evicted
+        """
+        self.root = root
+        self.budget = budget
+        self.max_age = max_age
+
+    @staticmethod
+    def key(origin, variant=''):
+        """
+        Create cache key for origin
+        :param origin: Url of repository
+        :param variant: Clone mode of checkout, shallow and full clones are cached separately
+        :return: Returns string
+        """
+        name = origin.strip().rstrip("/")
+
+        if variant:
+            name = "{name}#{variant}".format(name=name, variant=variant)
+
+        return hashlib.sha256(name.encode("utf-8")).hexdigest()
+
+    def path(self, origin, variant=''):
+        """
+        Path of checkout for origin
+        :param origin: Url of repository
+        :param variant: Clone mode of checkout
+        :return: Returns string
+        """
+        return os.path.join(self.root, self.key(origin, variant))
+
+    def exists(self, origin, variant=''):
+        """
+        Check if origin is already cloned
+        :param origin: Url of repository
+        :param variant: Clone mode of checkout
+        :return: Returns bool
+        """
+        return os.path.isdir(os.path.join(self.path(origin, variant), ".git"))
+
+    @contextmanager
+    def lock(self, origin, variant=''):
+        """
+        Lock checkout of origin, shared by threads and processes on the same host
+        :param origin: Url of repository
+        :param variant: Clone mode of checkout
+        :return: Returns path to checkout
+        """
+        os.makedirs(self.root, exist_ok=True)
+
+        with open(self.path(origin, variant) + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield self.path(origin, variant)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def touch(self, origin, variant=''):
+        """
+        Record usage of checkout, must be called while holding lock, size of checkout
+        is measured later by evict
+        :param origin: Url of repository
+        :param variant: Clone mode of checkout
+        :return: Returns void
+        """
+        self.write_metadata(self.path(origin, variant), {
+            "origin": origin,
+            "variant": variant,
+            "last_used": time.time(),
+            "size": None,
+        })
+
+    @staticmethod
+    def write_metadata(path, metadata):
+        """
+        Replace metadata of checkout atomically
+        :param path: Path of checkout
+        :param metadata: Dict of metadata
+        :return: Returns void
+        """
+        with open(path + ".json.tmp", "w") as file:
+            json.dump(metadata, file)
+
+        os.rename(path + ".json.tmp", path + ".json")
+
+    def remove(self, origin, variant=''):
+        """
+        Remove checkout, must be called while holding lock
+        :param origin: Url of repository
+        :param variant: Clone mode of checkout
+        :return: Returns void
+        """
+        path = self.path(origin, variant)
+        shutil.rmtree(path, ignore_errors=True)
+
+        if os.path.exists(path + ".json"):
+            os.remove(path + ".json")
+
+    def entries(self):
+        """
+        List metadata of all cached checkouts
+        :return: Returns list of dicts sorted from least recently used
+        """
+        entries = []
+
+        if not os.path.isdir(self.root):
+            return entries
+
+        for name in os.listdir(self.root):
+            if not name.endswith(".json"):
+                continue
+
+            try:
+                with open(os.path.join(self.root, name)) as file:
+                    entries.append(json.load(file))
+            except (OSError, ValueError):
+                continue
+
+        return sorted(entries, key=lambda entry: entry.get("last_used", 0))
+
+    def evict(self):
+        """
+        Evict checkouts older than max age and least recently used checkouts until cache fits budget,
+        checkouts locked by other builders are skipped
+        :return: Returns list of evicted origins
+        """
+        entries = self.entries()
+
+        if self.budget is not None:
+            for entry in entries:
+                if entry.get("size") is None:
+                    self.measure(entry)
+
+        total = sum(entry.get("size") or 0 for entry in entries)
+        now = time.time()
+        evicted = []
+
+        for entry in entries:
+            expired = self.max_age is not None and now - entry.get("last_used", 0) > self.max_age
+            over_budget = self.budget is not None and total > self.budget
+
+            if not expired and not over_budget:
+                continue
+
+            origin = entry.get("origin", '')
+            variant = entry.get("variant", '')
+
+            with open(self.path(origin, variant) + ".lock", "a") as lock_file:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+
+                try:
+                    self.remove(origin, variant)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+            total -= entry.get("size") or 0
+            evicted.append(origin)
+
+        return evicted
+
+    def measure(self, entry):
+        """
+        Measure size of checkout used since last eviction and store it with its metadata,
+        checkouts locked by other builders are measured by next eviction
+        :param entry: Metadata of checkout, size is updated in place
+        :return: Returns void
+        """
+        path = self.path(entry.get("origin", ''), entry.get("variant", ''))
+
+        with open(path + ".lock", "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+
+            try:
+                if os.path.isdir(path):
+                    entry["size"] = self.size(path)
+                    self.write_metadata(path, entry)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def size(path):
+        """
+        Disk usage of directory
+        :param path: Directory
+        :return: Returns int number of bytes
+        """
+        total = 0
+
+        for directory, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.lstat(os.path.join(directory, name)).st_size
+                except OSError:
+                    pass
+
+        return total
@@ -0,0 +1,137 @@
+import threading
+import subprocess
+
+
+class CatFile(object):
+    """
+        Persistent git cat-file --batch process, objects are looked up by writing their
+        names to the process instead of starting a git command for every lookup
+    """
+
+    def __init__(self, git_dir):
+        """
+        :param git_dir: Path of .git directory
+        """
+        self.git_dir = git_dir
+        self.process = None
+        self.lock = threading.Lock()
+
+    def read(self, name):
+        """
+        Read object
+        :param name: Any name git understands, e.g. sha, ref or <ref>:<path>
+        :return: Returns tuple of sha, type and content or None if object doesn't exist or name is ambiguous
+        """
+        # Names are read line by line, new line would desynchronize the process
+        if not name or "\n" in name:
+            return None
+
+        with self.lock:
+            process = self.start()
+
+            try:
+                process.stdin.write(name.encode("utf-8") + b"\n")
+                process.stdin.flush()
+
+                header = process.stdout.readline().decode("utf-8").split()
+                if len(header) != 3:
+                    return None
+
+                sha, object_type, size = header
+                content = process.stdout.read(int(size) + 1)[:-1]
+            except (OSError, ValueError):
+                self.stop()
+                raise
+
+        return sha, object_type, content
+
+    def resolve(self, name):
+        """
+        Resolve name to sha of object
+        :param name: Ref, abbreviated sha or <ref>:<path>
+        :return: Returns string or None
+        """
+        result = self.read(name)
+        return result[0] if result else None
+
+    def peel(self, name):
+        """
+        Resolve name to sha of commit, annotated tags are followed to their target
+        :param name: Ref or sha
+        :return: Returns tuple of sha and content of commit or None
+        """
+        result = self.read(name)
+
+        while result and result[1] == "tag":
+            target = self.get_header(result[2], "object")
+            result = self.read(target) if target else None
+
+        if not result or result[1] != "commit":
+            return None
+
+        return result[0], result[2]
+
+    def abbreviate(self, sha, length=7):
+        """
+        Get shortest unique prefix of sha, at least length long
+        :param sha: Full sha of object
+        :param length: Minimal length of prefix
+        :return: Returns string
+        """
+        for end in range(length, len(sha)):
+            if self.resolve(sha[:end]) == sha:
+                return sha[:end]
+
+        return sha
+
+    def start(self):
+        if self.process is None or self.process.poll() is not None:
+            self.process = subprocess.Popen(
+                ["git", "--git-dir", self.git_dir, "cat-file", "--batch"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL
+            )
+
+        return self.process
+
+    def stop(self):
+        if self.process is None:
+            return
+
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+
+        self.process.wait()
+        self.process.stdout.close()
+        self.process = None
+
+    def close(self):
+        with self.lock:
+            self.stop()
+
+    def __del__(self):
+        try:
+            self.stop()
+        except Exception:
+            pass
+
+    @staticmethod
+    def get_header(content, name):
+        """
+        Get header of commit or tag object
+        :param content: Content of object
+        :param name: Name of header, e.g. tree, object or committer
+        :return: Returns string or None
+        """
+        for line in content.decode("utf-8", "replace").split("\n"):
+            if not line:
+                break
+
+            key, _, value = line.partition(" ")
+            if key == name:
+                return value
+
+        return None
@@ -1,35 +1,98 @@
-"""
-{
-    "commit": "%H",
-    "abbreviated_commit": "%h",
-    "tree": "%T",
-    "abbreviated_tree": "%t",
-    "parent": "%P",
-    "abbreviated_parent": "%p",
-    "refs": "%D",
-    "encoding": "%e",
-    "subject": "%s",
-    "sanitized_subject_line": "%f",
-    "body": "%b",
-    "commit_notes": "%N",
-    "verification_flag": "%G?",
-    "signer": "%GS",
-    "signer_key": "%GK",
-    "author": {
-        "name": "%aN",
-        "email": "%aE",
-        "date": "%aD"
-    },
-    "commiter": {
-        "name": "%cN",
-        "email": "%cE",
-        "date": "%cD"
-    }
-}
-"""
+class Signature(object):
+    """
+        Author or committer of commit
+    """
+
+    __slots__ = ("name", "email", "date")
+
+    def __init__(self, name='', email='', date=''):
+        self.name = name
+        self.email = email
+        self.date = date
+
+    def __repr__(self):
+        return "{name} <{email}>".format(name=self.name, email=self.email)
 
 
 class Commit(object):
+    """
+        Commit parsed from git log, fields follow the placeholders of git pretty formats
+    """
+
+    # Placeholders of git log format in order of fields
+    FIELDS = (
+        ("commit", "%H"),
+        ("abbreviated_commit", "%h"),
+        ("tree", "%T"),
+        ("abbreviated_tree", "%t"),
+        ("parent", "%P"),
+        ("abbreviated_parent", "%p"),
+        ("refs", "%D"),
+        ("encoding", "%e"),
+        ("subject", "%s"),
+        ("sanitized_subject_line", "%f"),
+        ("body", "%b"),
+        ("commit_notes", "%N"),
+        ("author_name", "%aN"),
+        ("author_email", "%aE"),
+        ("author_date", "%aD"),
+        ("commiter_name", "%cN"),
+        ("commiter_email", "%cE"),
+        ("commiter_date", "%cD"),
+    )
+
+    # Placeholders of signature, verifying signatures runs gpg for every commit
+    SIGNATURE_FIELDS = (
+        ("verification_flag", "%G?"),
+        ("signer", "%GS"),
+        ("signer_key", "%GK"),
+    )
+
+    __slots__ = (
+        "commit", "abbreviated_commit", "tree", "abbreviated_tree", "parent", "abbreviated_parent", "refs",
+        "encoding", "subject", "sanitized_subject_line", "body", "commit_notes", "verification_flag", "signer",
+        "signer_key", "author", "commiter"
+    )
+
     def __init__(self, data):
-        self.__dict__ = data
+        """
+        :param data: Dict of fields, author and commiter are dicts with name, email and date
+        """
+        for name in self.__slots__:
+            setattr(self, name, data.get(name, ''))
+
+        self.author = Signature(**(data.get("author") or {}))
+        self.commiter = Signature(**(data.get("commiter") or {}))
+
+    @classmethod
+    def get_format(cls, signatures=False):
+        """
+        Get format of git log with fields separated by NUL
+        :param signatures: Include verification of signatures
+        :return: Returns string
+        """
+        fields = cls.FIELDS + (cls.SIGNATURE_FIELDS if signatures else ())
+        return "%x00".join(placeholder for _, placeholder in fields)
+
+    @classmethod
+    def parse(cls, values, signatures=False):
+        """
+        Create commit from fields of git log
+        :param values: List of values in order of format
+        :param signatures: Values include verification of signatures
+        :return: Returns Commit
+        """
+        fields = cls.FIELDS + (cls.SIGNATURE_FIELDS if signatures else ())
+        data = dict((name, value) for (name, _), value in zip(fields, values))
+
+        for person in ("author", "commiter"):
+            data[person] = {
+                "name": data.pop(person + "_name", ''),
+                "email": data.pop(person + "_email", ''),
+                "date": data.pop(person + "_date", ''),
+            }
+
+        return cls(data)
 
+    def __repr__(self):
+        return "<Commit {commit} {subject}>".format(commit=self.abbreviated_commit, subject=self.subject)
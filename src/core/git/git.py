@@ -4,12 +4,40 @@ from src.core.git.repo import Repo
 
 class Git(object):
     @classmethod
-    def clone(cls, repository, path):
-        return git.clone(repository, path, '--progress', '--recursive', _err_to_out=True, _iter=True)
+    def clone(cls, repository, path, branch=None, depth=None, single_branch=False, filter=None, sparse=False):
+        """
+        Clone repository
+        :param repository: Url of repository
+        :param path: Path for cloned repository
+        :param branch: Branch or tag to check out instead of remote HEAD
+        :param depth: Create shallow clone with history truncated to depth commits
+        :param single_branch: Clone only history of branch
+        :param filter: Partial clone filter, e.g. blob:none
+        :param sparse: Initialize sparse checkout with only files in root directory
+        :return: Returns command output
+        """
+        arguments = [repository, path, '--progress', '--recursive']
+
+        if branch:
+            arguments += ['-b', branch]
+
+        if depth:
+            arguments += ['--depth', str(depth), '--shallow-submodules']
+
+        if single_branch:
+            arguments.append('--single-branch')
+
+        if filter:
+            arguments.append('--filter={filter}'.format(filter=filter))
+
+        if sparse:
+            arguments.append('--sparse')
+
+        return git.clone(*arguments, _err_to_out=True, _iter=True)
 
     @classmethod
-    def clone_branch(cls, repository, path, branch):
-        return git.clone("-v", "-b", branch, repository, path, '--progress', '--recursive', _err_to_out=True, _iter=True)
+    def clone_branch(cls, repository, path, branch, **kwargs):
+        return cls.clone(repository, path, branch=branch, **kwargs)
 
     @classmethod
     def repo(cls, path):
@@ -1,57 +1,113 @@
-import json
-from sh import git, tr
+import os
+import signal
+import subprocess
+import sh
+from sh import git, ErrorReturnCode
 from src.core.git.commit import Commit
+from src.core.git.cat_file import CatFile
 
 
 class Repo(object):
-    GIT_LOG_FORMAT = '''
-    "%H": {
-        "commit": "%H",
-        "abbreviated_commit": "%h",
-        "tree": "%T",
-        "abbreviated_tree": "%t",
-        "parent": "%P",
-        "abbreviated_parent": "%p",
-        "refs": "%D",
-        "encoding": "%e",
-        "subject": "%s",
-        "sanitized_subject_line": "%f",
-        "body": "%b",
-        "commit_notes": "%N",
-        "verification_flag": "%G?",
-        "signer": "%GS",
-        "signer_key": "%GK",
-        "author": {
-            "name": "%aN",
-            "email": "%aE",
-            "date": "%aD"
-        },
-        "commiter": {
-            "name": "%cN",
-            "email": "%cE",
-            "date": "%cD"
-        }
-    },
-    '''
+    # Number of bytes read from git log at once
+    LOG_CHUNK_SIZE = 64 * 1024
 
     def __init__(self, path):
+        self.work_tree = path
         self.path = path + "/.git"
         self.git = git.bake("--git-dir", self.path, "--work-tree", path, "--no-pager")
+        self.objects = CatFile(self.path)
 
     @property
     def commits(self):
-        commits = self.git.log('--pretty=format:' + Repo.GIT_LOG_FORMAT)
-        commits = json.loads("{" + repr(commits).strip()[:-1] + "}")
         commit_list = {}
 
-        for commit_hash, commit in commits.items():
-            commit_list[commit_hash] = Commit(commit)
+        for commit in self.log():
+            commit_list[commit.commit] = commit
 
         return commit_list
 
+    def log(self, revision_range=None, limit=None, paths=None, signatures=False):
+        """
+        Iterate over commits, output of git log is parsed while it is being read
+        :param revision_range: Revision or range, e.g. master or v1.0..HEAD, defaults to HEAD
+        :param limit: Maximal number of commits
+        :param paths: Limit commits to those changing paths
+        :param signatures: Verify signatures of commits, runs gpg for every commit
+        :return: Returns generator of Commit
+        """
+        command = ["git", "--git-dir", self.path, "--no-pager", "log", "-z",
+                   "--format=" + Commit.get_format(signatures)]
+
+        if limit:
+            command.append("--max-count={limit}".format(limit=int(limit)))
+        if revision_range:
+            command.append(revision_range)
+        if paths:
+            command += ["--"] + list(paths)
+
+        fields = len(Commit.FIELDS) + (len(Commit.SIGNATURE_FIELDS) if signatures else 0)
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        values = []
+        rest = b''
+
+        try:
+            # Fields and commits are separated by NUL, values never contain it
+            for chunk in iter(lambda: process.stdout.read(self.LOG_CHUNK_SIZE), b''):
+                parts = (rest + chunk).split(b"\0")
+                rest = parts.pop()
+
+                for part in parts:
+                    values.append(part.decode("utf-8", "replace"))
+
+                    if len(values) == fields:
+                        yield Commit.parse(values, signatures)
+                        values = []
+
+            if rest:
+                values.append(rest.decode("utf-8", "replace"))
+            if len(values) == fields:
+                yield Commit.parse(values, signatures)
+        finally:
+            process.stdout.close()
+            error = process.stderr.read()
+            process.stderr.close()
+
+            # Closed generator terminates git with SIGPIPE
+            exit_code = process.wait()
+            if exit_code not in (0, -signal.SIGPIPE):
+                raise self.get_error(exit_code)(" ".join(command), b'', error)
+
     def switch_branch(self, branch):
+        # Shallow clones contain only fetched refs, missing ref has to be fetched first
+        if self.is_shallow() and not self.has_ref(branch):
+            return self.fetch_and_checkout(branch)
+
         return self.git.checkout("-f", branch, _err_to_out=True, _iter=True)
 
+    def is_shallow(self):
+        return os.path.exists(os.path.join(self.path, "shallow"))
+
+    def fetch_ref(self, ref, origin="origin", depth=1):
+        return self.git.fetch("--depth", str(depth), "--force", origin, ref, _err_to_out=True, _iter=True)
+
+    def fetch_and_checkout(self, ref, origin="origin", depth=1):
+        """
+        Fetch tip of branch, tag or commit into shallow repository and check it out
+        :param ref: Branch, tag or commit
+        :param origin: Name of remote
+        :param depth: Depth of fetched history
+        :return: Returns generator of command output
+        """
+        for line in self.fetch_ref(ref, origin, depth):
+            yield line
+
+        for line in self.git.checkout("-f", "FETCH_HEAD", _err_to_out=True, _iter=True):
+            yield line
+
+    def sparse_checkout(self, paths):
+        return self.git("sparse-checkout", "set", "--cone", *paths, _cwd=self.work_tree, _err_to_out=True,
+                        _iter=True)
+
     def create_branch(self, branch, tag=""):
         return self.git.checkout("-b", branch, tag, _err_to_out=True, _iter=True)
 
@@ -68,22 +124,135 @@ class Repo(object):
     def fetch(self, origin="origin", branch="master"):
         return self.git.fetch(origin, branch, _err_to_out=True, _iter=True)
 
+    def update(self, origin="origin"):
+        return self.git.fetch(origin, "--prune", "--tags", "--force", _cwd=self.work_tree,
+                                  _err_to_out=True, _iter=True)
+
+    def has_ref(self, ref):
+        try:
+            self.git("rev-parse", "--verify", "--quiet", ref)
+        except ErrorReturnCode:
+            return False
+        return True
+
+    def checkout(self, ref, origin="origin"):
+        """
+        Checkout branch, tag or commit, branches are reset to their state on origin
+        :param ref: Branch, tag or commit
+        :param origin: Name of remote
+        :return: Returns command output
+        """
+        remote_branch = "refs/remotes/{origin}/{ref}".format(origin=origin, ref=ref)
+
+        if self.has_ref(remote_branch):
+            return self.git.checkout("-f", "-B", ref, remote_branch, _err_to_out=True, _iter=True)
+
+        return self.switch_branch(ref)
+
+    def clean(self):
+        return self.git.clean("-ffdx", _err_to_out=True, _iter=True)
+
+    def update_submodules(self, depth=None):
+        arguments = ["update", "--init", "--recursive", "--force"]
+
+        if depth:
+            arguments += ["--depth", str(depth)]
+
+        return self.git.submodule(*arguments, _cwd=self.work_tree, _err_to_out=True, _iter=True)
+
     def remotes(self):
         return self.git("ls-remote", _err_to_out=True, _iter=True)
 
+    def resolve(self, ref):
+        """
+        Resolve ref to sha of commit
+        :param ref: Branch, tag, sha or any other revision
+        :return: Returns string or None if ref doesn't exist
+        """
+        commit = self.objects.peel(ref)
+        return commit[0] if commit else None
+
     def get_last_commit_id(self, commit_format="%h"):
-        return self.git.log('--format="{format}"'.format(commit_format=commit_format), n='1')
+        """
+        Get id of checked out commit
+        :param commit_format: %H for full sha, %h for abbreviated sha or any other git log format
+        :return: Returns string
+        """
+        if commit_format in ("%H", "%h"):
+            sha = self.resolve("HEAD")
+
+            if sha:
+                return sha if commit_format == "%H" else self.objects.abbreviate(sha)
+
+        return str(self.git.log('--format={commit_format}'.format(commit_format=commit_format), n='1')).strip()
 
     def git_log(self):
-        clone = self.git.clone(
-            '--pretty=format:' + Repo.GIT_LOG_FORMAT,
-            '--progress',
-            '--recursive',
-            _err_to_out=True, _iter=True, _out_bufsize=100
-        )
-        for line in clone:
-            print(line)
+        for commit in self.log():
+            print("{commit} {subject}".format(commit=commit.abbreviated_commit, subject=commit.subject))
+
+    def get_tree_id(self, path=''):
+        tree = self.objects.resolve("HEAD:{path}".format(path=path))
+
+        if tree is None:
+            raise self.get_error(128)("git cat-file HEAD:{path}".format(path=path), b'', b'Path does not exist in HEAD')
+
+        return tree
+
+    def get_tags(self):
+        """
+        Get tags of repository from loose and packed refs
+        :return: Returns dict of sha by tag name
+        """
+        tags = {}
+
+        try:
+            with open(os.path.join(self.path, "packed-refs")) as file:
+                for line in file:
+                    sha, _, ref = line.strip().partition(" ")
+                    if ref.startswith("refs/tags/"):
+                        tags[ref[len("refs/tags/"):]] = sha
+        except OSError:
+            pass
+
+        directory = os.path.join(self.path, "refs", "tags")
+        for root, _, files in os.walk(directory):
+            for name in files:
+                with open(os.path.join(root, name)) as file:
+                    tags[os.path.relpath(os.path.join(root, name), directory).replace(os.sep, "/")] = file.read().strip()
+
+        return tags
 
     def get_last_tag(self):
-        return repr(
-            self.git.describe('--tags', tr("-d", "'\n'", _in=self.git("rev-list", "--tags", "--max-count", 1)))).strip()
+        """
+        Get tag of most recent tagged commit
+        :return: Returns string or None if repository has no tags
+        """
+        last_tag, last_time = None, None
+
+        for tag, sha in sorted(self.get_tags().items()):
+            commit = self.objects.peel(sha)
+            if not commit:
+                continue
+
+            committer = CatFile.get_header(commit[1], "committer") or ''
+            parts = committer.rsplit(" ", 2)
+            time = int(parts[1]) if len(parts) == 3 and parts[1].isdigit() else 0
+
+            if last_time is None or time > last_time:
+                last_tag, last_time = tag, time
+
+        return last_tag
+
+    def close(self):
+        self.objects.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @staticmethod
+    def get_error(exit_code):
+        # Errors of commands not run by sh are raised as the same exceptions callers already handle
+        return getattr(sh, "ErrorReturnCode_{exit_code}".format(exit_code=abs(exit_code)))
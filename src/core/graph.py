@@ -0,0 +1,192 @@
+import heapq
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from src.exceptions import InvalidDependencies
+
+
+class Graph(object):
+    """
+        Dependency graph of services, services run after all their dependencies
+    """
+
+    # Duration of services without history, in seconds
+    DEFAULT_DURATION = 1.0
+
+    def __init__(self, dependencies):
+        """
+        :param dependencies: Dict of iterables of dependencies by node
+        """
+        self.dependencies = dict((node, set(nodes)) for node, nodes in dependencies.items())
+
+        # Nodes depending on node, by node
+        self.dependents = dict((node, set()) for node in self.dependencies)
+
+        unknown = {}
+        for node, nodes in sorted(self.dependencies.items()):
+            for dependency in sorted(nodes):
+                if dependency in self.dependents:
+                    self.dependents[dependency].add(node)
+                else:
+                    unknown.setdefault(node, []).append(dependency)
+
+        if unknown:
+            errors = [
+                "Service {node} depends on unknown service {dependencies}".format(node=node,
+                                                                                 dependencies=", ".join(nodes))
+                for node, nodes in sorted(unknown.items())
+            ]
+
+            # Cycles among known nodes are reported together with unknown dependencies
+            for node, nodes in unknown.items():
+                self.dependencies[node].difference_update(nodes)
+
+            try:
+                self.sort()
+            except InvalidDependencies as e:
+                errors.append(str(e))
+
+            raise InvalidDependencies("; ".join(errors))
+
+        self.order = self.sort()
+
+    @classmethod
+    def from_services(cls, services):
+        """
+        Create graph of services from their links and depends_on options, links may have alias
+        :param services: Dict of services by name
+        :return: Returns Graph
+        """
+        return cls(dict(
+            (name, [link.split(":")[0] for link in service.get("links", []) or []] + list(service.get("depends_on", []) or []))
+            for name, service in services.items()
+        ))
+
+    def sort(self):
+        """
+        Sort nodes topologically with Kahn's algorithm
+        :return: Returns list of nodes, every node follows its dependencies
+        """
+        remaining = dict((node, len(nodes)) for node, nodes in self.dependencies.items())
+        ready = sorted(node for node, count in remaining.items() if count == 0)
+        order = []
+
+        while ready:
+            node = ready.pop()
+            order.append(node)
+
+            for dependent in self.dependents[node]:
+                remaining[dependent] -= 1
+
+                if remaining[dependent] == 0:
+                    ready.append(dependent)
+
+        if len(order) != len(self.dependencies):
+            raise InvalidDependencies("Dependency cycle: {cycle}".format(
+                cycle=" -> ".join(self.find_cycle(set(node for node, count in remaining.items() if count)))
+            ))
+
+        return order
+
+    def find_cycle(self, nodes):
+        """
+        Find cycle among nodes left by topological sort, every such node depends on another one of them
+        :param nodes: Set of nodes which could not be sorted
+        :return: Returns list of nodes of cycle, first node is repeated at the end
+        """
+        path = []
+        visited = {}
+        node = min(nodes)
+
+        while node not in visited:
+            visited[node] = len(path)
+            path.append(node)
+            node = min(dependency for dependency in self.dependencies[node] if dependency in nodes)
+
+        return path[visited[node]:] + [node]
+
+    def levels(self):
+        """
+        Group nodes to levels, nodes of level depend only on nodes of previous levels
+        :return: Returns list of sets
+        """
+        depth = {}
+
+        for node in self.order:
+            depth[node] = max([depth[dependency] + 1 for dependency in self.dependencies[node]] or [0])
+
+        levels = [set() for _ in range(max(depth.values()) + 1)] if depth else []
+        for node, level in depth.items():
+            levels[level].add(node)
+
+        return levels
+
+    def reversed(self):
+        """
+        Get graph with reversed edges, dependents run before their dependencies, e.g. when stopping services
+        :return: Returns Graph
+        """
+        return Graph(self.dependents)
+
+    def get_priorities(self, durations=None):
+        """
+        Get length of longest path from node to the end of graph, nodes on critical path have highest priority
+        :param durations: Dict of durations by node, nodes without duration take average of known durations
+        :return: Returns dict of priorities by node
+        """
+        durations = dict((node, duration) for node, duration in (durations or {}).items() if duration is not None)
+        default = sum(durations.values()) / len(durations) if durations else self.DEFAULT_DURATION
+        priorities = {}
+
+        for node in reversed(self.order):
+            priorities[node] = durations.get(node, default) + max(
+                [priorities[dependent] for dependent in self.dependents[node]] or [0]
+            )
+
+        return priorities
+
+    def run(self, function, workers=1, durations=None, exceptions=(Exception,)):
+        """
+        Call function for every node as soon as all its dependencies finished, ready nodes on longest
+        remaining path go first, no node is started after a failure
+        :param function: Function called with node
+        :param workers: Number of nodes run at the same time
+        :param durations: Dict of expected durations by node
+        :param exceptions: Exceptions of function which are reported as failure of node
+        :return: Returns dict of exceptions by node, empty on success
+        """
+        priorities = self.get_priorities(durations)
+        remaining = dict((node, len(nodes)) for node, nodes in self.dependencies.items())
+        ready = [(-priorities[node], node) for node, count in remaining.items() if count == 0]
+        heapq.heapify(ready)
+
+        workers = max(int(workers or 1), 1)
+        running = {}
+        errors = {}
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while ready or running:
+                # Nodes are submitted only when worker is free so priority decides which node runs next
+                while ready and len(running) < workers and not errors:
+                    _, node = heapq.heappop(ready)
+                    running[executor.submit(function, node)] = node
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    node = running.pop(future)
+
+                    try:
+                        future.result()
+                    except exceptions as e:
+                        errors[node] = e
+                        continue
+
+                    for dependent in self.dependents[node]:
+                        remaining[dependent] -= 1
+
+                        if remaining[dependent] == 0:
+                            heapq.heappush(ready, (-priorities[dependent], dependent))
+
+        return errors
@@ -0,0 +1,30 @@
+import importlib
+
+
+class LazyModule(object):
+    """
+        Module imported on first use of its attribute, keeps heavy dependencies
+        out of commands which don't need them
+    """
+
+    def __init__(self, name):
+        """
+        :param name: Name of module, e.g. docker.errors
+        """
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attribute):
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name)
+
+        return getattr(self.__module, attribute)
+
+
+def lazy(name):
+    """
+    Import module on first use
+    :param name: Name of module
+    :return: Returns LazyModule
+    """
+    return LazyModule(name)
@@ -0,0 +1,119 @@
+import sys
+import threading
+
+# Per thread output context, holds the prefix of the service being processed
+_context = threading.local()
+
+# Serializes writes of worker threads so lines are never interleaved
+_lock = threading.Lock()
+
+
+def get_prefix():
+    """
+    Get prefix of current thread
+    :return: Returns string
+    """
+    return getattr(_context, "prefix", '')
+
+
+def get_output():
+    """
+    Get output of current thread
+    :return: Returns writable object or None if thread writes to standard output
+    """
+    return getattr(_context, "output", None)
+
+
+def set_output(output):
+    """
+    Redirect everything printed by current thread and threads bound to it
+    :param output: Object with write and flush methods, None restores standard output
+    :return: Returns void
+    """
+    _context.output = output
+
+
+def get_labels():
+    """
+    Get labels of current thread, e.g. application and service, used by metrics
+    :return: Returns dict
+    """
+    return dict(getattr(_context, "labels", {}))
+
+
+def set_labels(**labels):
+    """
+    Replace labels of current thread, threads bound to it inherit them
+    :param labels: Labels
+    :return: Returns void
+    """
+    _context.labels = labels
+
+
+def route():
+    """
+    Replace standard output with router so output of threads can be redirected, done once
+    :return: Returns void
+    """
+    if not isinstance(sys.stdout, Router):
+        sys.stdout = Router(sys.stdout)
+
+
+def bind(function, prefix=None, **labels):
+    """
+    Wrap function so it runs with output context of the calling thread, used when submitting work to pools
+    :param function: Function executed in worker thread
+    :param prefix: Prefix for all lines printed by function, appended to callers prefix
+    :param labels: Labels added to labels of caller
+    :return: Returns wrapped function
+    """
+    context = dict(_context.__dict__)
+
+    if prefix is not None:
+        context["prefix"] = "{parent}{prefix}: ".format(parent=context.get("prefix", ''), prefix=prefix)
+
+    if labels:
+        context["labels"] = dict(context.get("labels", {}), **labels)
+
+    def wrapper(*args, **kwargs):
+        previous = dict(_context.__dict__)
+        _context.__dict__.update(context)
+
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _context.__dict__.clear()
+            _context.__dict__.update(previous)
+
+    return wrapper
+
+
+def emit(message, end="\n"):
+    """
+    Print message prefixed with service of current thread
+    :param message: Message to print
+    :param end: Line ending
+    :return: Returns void
+    """
+    line = "===> {prefix}{message}".format(prefix=get_prefix(), message=message)
+
+    with _lock:
+        print(line, end=end, flush=True)
+
+
+class Router(object):
+    """
+        Standard output writing to output of current thread
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        return (get_output() or self.stream).write(text)
+
+    def flush(self):
+        (get_output() or self.stream).flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
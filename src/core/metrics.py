@@ -0,0 +1,248 @@
+import os
+import sys
+import json
+import time
+import fcntl
+import threading
+from contextlib import contextmanager
+from src.core import log
+
+# Upper bounds of duration buckets in seconds
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# Labels of series in order they are written
+LABELS = ("command", "application", "environment", "service", "stage", "outcome")
+
+SUCCESS = 'success'
+FAILURE = 'failure'
+
+
+class Span(object):
+    """
+        Running stage, bytes and outcome can be set by the stage itself
+    """
+
+    def __init__(self, stage, labels):
+        self.stage = stage
+        self.labels = labels
+        self.bytes = 0
+        self.outcome = SUCCESS
+        self.started = time.time()
+
+
+class Registry(object):
+    """
+        Histograms of stage durations and counters of transferred bytes, series are
+        identified by their labels
+    """
+
+    def __init__(self):
+        # Totals of process, exposed by daemon
+        self.series = {}
+
+        # Changes not written to metrics file yet
+        self.unflushed = {}
+
+        self.lock = threading.Lock()
+
+    def observe(self, labels, duration, size=0):
+        """
+        Record finished stage
+        :param labels: Dict of labels
+        :param duration: Duration in seconds
+        :param size: Number of transferred bytes
+        :return: Returns void
+        """
+        key = tuple(labels.get(label, '') for label in LABELS)
+
+        with self.lock:
+            for series in (self.series, self.unflushed):
+                self.add(series.setdefault(key, self.create_series()), duration, size)
+
+    @staticmethod
+    def create_series():
+        return {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0, "bytes": 0}
+
+    @staticmethod
+    def add(series, duration, size):
+        for index, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                series["buckets"][index] += 1
+
+        series["sum"] += duration
+        series["count"] += 1
+        series["bytes"] += size
+
+    @staticmethod
+    def merge(series, other):
+        series["buckets"] = [a + b for a, b in zip(series["buckets"], other["buckets"])]
+        series["sum"] += other["sum"]
+        series["count"] += other["count"]
+        series["bytes"] += other["bytes"]
+
+    def render(self):
+        with self.lock:
+            return render(self.series)
+
+    def flush(self, path):
+        """
+        Add changes to metrics file, totals of all processes are kept in <path>.json
+        and rendered to path in Prometheus text format
+        :param path: Path of metrics file, e.g. in textfile directory of node exporter
+        :return: Returns void
+        """
+        with self.lock:
+            unflushed, self.unflushed = self.unflushed, {}
+
+        if not unflushed:
+            return
+
+        state_path = "{path}.json".format(path=path)
+
+        with open("{path}.lock".format(path=path), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            try:
+                with open(state_path) as file:
+                    series = dict((tuple(item.get("labels")), item.get("series")) for item in json.load(file))
+            except (OSError, ValueError):
+                series = {}
+
+            for key, value in unflushed.items():
+                self.merge(series.setdefault(key, self.create_series()), value)
+
+            write(state_path, json.dumps([{"labels": list(key), "series": value} for key, value in series.items()]))
+            write(path, render(series))
+
+
+# Metrics of process
+registry = Registry()
+
+# Serializes writes of events
+_events_lock = threading.Lock()
+
+
+@contextmanager
+def stage(name, **labels):
+    """
+    Measure stage of pipeline, labels of current thread are added to labels of stage
+    :param name: Name of stage, e.g. clone, build or push
+    :param labels: Additional labels
+    :return: Returns Span
+    """
+    span = Span(name, dict(log.get_labels(), **labels))
+
+    try:
+        yield span
+    except BaseException:
+        span.outcome = FAILURE
+        raise
+    finally:
+        finish(span)
+
+
+def finish(span):
+    duration = time.time() - span.started
+    labels = dict(span.labels, stage=span.stage, outcome=span.outcome)
+
+    registry.observe(labels, duration, span.bytes)
+
+    emit(dict(
+        labels,
+        event="stage",
+        time=round(span.started, 3),
+        duration=round(duration, 3),
+        bytes=span.bytes
+    ))
+
+
+def emit(event):
+    """
+    Write event as json line to TOWER_EVENTS, - writes events to standard error
+    :param event: Dict of event
+    :return: Returns void
+    """
+    destination = os.environ.get("TOWER_EVENTS", '')
+
+    if not destination:
+        return
+
+    line = json.dumps(event, sort_keys=True) + "\n"
+
+    with _events_lock:
+        if destination == "-":
+            sys.stderr.write(line)
+            sys.stderr.flush()
+            return
+
+        # Lines shorter than pipe buffer are appended atomically by concurrent processes
+        with open(destination, "a") as file:
+            file.write(line)
+
+
+def flush():
+    """
+    Write metrics to TOWER_METRICS_FILE if it is set, called at the end of commands
+    :return: Returns void
+    """
+    path = os.environ.get("TOWER_METRICS_FILE", '')
+
+    if path:
+        registry.flush(path)
+
+
+def render(series):
+    """
+    Render series in Prometheus text format
+    :param series: Dict of series by tuple of label values
+    :return: Returns string
+    """
+    lines = [
+        "# HELP tower_stage_duration_seconds Duration of pipeline stages",
+        "# TYPE tower_stage_duration_seconds histogram",
+    ]
+
+    for key, value in sorted(series.items()):
+        labels = format_labels(key)
+
+        for bound, count in zip(BUCKETS, value["buckets"]):
+            lines.append('tower_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {count}'.format(
+                labels=labels, bound=bound, count=count
+            ))
+
+        lines.append('tower_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {count}'.format(
+            labels=labels, count=value["count"]
+        ))
+        lines.append("tower_stage_duration_seconds_sum{{{labels}}} {sum}".format(labels=labels, sum=value["sum"]))
+        lines.append("tower_stage_duration_seconds_count{{{labels}}} {count}".format(labels=labels,
+                                                                                       count=value["count"]))
+
+    lines += [
+        "# HELP tower_stage_bytes_total Bytes transferred by pipeline stages",
+        "# TYPE tower_stage_bytes_total counter",
+    ]
+
+    for key, value in sorted(series.items()):
+        lines.append("tower_stage_bytes_total{{{labels}}} {bytes}".format(labels=format_labels(key),
+                                                                           bytes=value["bytes"]))
+
+    return "\n".join(lines) + "\n"
+
+
+def format_labels(key):
+    return ",".join(
+        '{name}="{value}"'.format(
+            name=name,
+            value=str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        for name, value in zip(LABELS, key)
+    )
+
+
+def write(path, content):
+    temporary = "{path}.{pid}.tmp".format(path=path, pid=os.getpid())
+
+    with open(temporary, "w") as file:
+        file.write(content)
+
+    os.replace(temporary, path)
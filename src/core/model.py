@@ -0,0 +1,371 @@
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from src.core.graph import Graph
+from src.core.docker.resources import get_resources
+from src.exceptions import InvalidApplication, InvalidDependencies, InvalidResources
+
+# Number of parsed configurations kept by process, daemon parses every configuration once
+CACHE_SIZE = 32
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+# Load balancing methods of upstream, random needs nginx 1.15.1 which images of tower don't have
+LOAD_BALANCING_METHODS = ("round_robin", "least_conn", "ip_hash")
+
+
+class Registry(object):
+    """
+        Registry of environment
+    """
+
+    __slots__ = ("name", "host", "port", "username", "password", "connections", "url", "options")
+
+    def __init__(self, name, options):
+        self.name = name
+        self.host = str(options.get("host", 'localhost'))
+        self.port = str(options.get("port", '5000'))
+        self.username = options.get("username", '')
+        self.password = options.get("password", '')
+        self.connections = int(options.get("connections", 2))
+        self.url = "{host}:{port}".format(host=self.host, port=self.port)
+        self.options = options
+
+
+class Repository(object):
+    """
+        Git repository and image of built service
+    """
+
+    __slots__ = ("origin", "image_name", "aliases", "registries", "options")
+
+    def __init__(self, options):
+        image = options.get("image", {}) or {}
+
+        self.origin = options.get("origin", '')
+        self.image_name = image.get("name", '')
+        self.aliases = list(image.get("aliases", []) or [])
+        self.registries = list(options.get("registry", []) or [])
+        self.options = options
+
+
+class Service(object):
+    """
+        Service of environment
+    """
+
+    __slots__ = ("name", "image", "links", "dockerfile", "context", "build_args", "repository", "dependencies",
+                 "replicas", "resources", "registry_urls", "options")
+
+    def __init__(self, name, options, repository, dependencies, replicas, resources, registry_urls):
+        self.name = name
+        self.image = options.get("image", '') or ''
+        self.links = list(options.get("links", []) or [])
+        self.dockerfile = options.get("dockerfile", 'Dockerfile') or 'Dockerfile'
+        self.context = options.get("context", '') or ''
+        self.build_args = options.get("args", {}) or {}
+        self.repository = repository
+        self.dependencies = dependencies
+        self.replicas = replicas
+        self.resources = resources
+        self.registry_urls = registry_urls
+        self.options = options
+
+
+class Environment(object):
+    """
+        Environment of application with its services and registries, validated when it is parsed
+    """
+
+    __slots__ = ("application_name", "name", "registries", "services", "graph", "options", "application")
+
+    def __init__(self, application, name, options, registries, services, graph):
+        self.application_name = application.get("name", '')
+        self.name = name
+        self.registries = registries
+        self.services = services
+        self.graph = graph
+        self.options = options
+        self.application = application
+
+    def get_registry(self, url):
+        """
+        Get registry by its url
+        :param url: Url in format <host>:<port>
+        :return: Returns Registry or None
+        """
+        for registry in self.registries.values():
+            if registry.url == url:
+                return registry
+
+        return None
+
+
+def load(environ):
+    """
+    Load environment of application from APPLICATION or file in TOWER_APPLICATION_FILE,
+    parsed environments are cached by hash of configuration
+    :param environ: Environment of command
+    :return: Returns Environment
+    """
+    path = environ.get("TOWER_APPLICATION_FILE", '')
+
+    if path:
+        try:
+            with open(path) as file:
+                text = file.read()
+        except OSError as e:
+            raise InvalidApplication("Failed to read {path}: {error}".format(path=path, error=e))
+    else:
+        text = environ.get("APPLICATION", '')
+
+    return load_text(text, environ.get("APPLICATION_ENVIRONMENT", '') or '')
+
+
+def load_text(text, environment_name):
+    """
+    Parse environment of application from json, result is cached
+    :param text: Application in json
+    :param environment_name: Name of environment
+    :return: Returns Environment
+    """
+    key = hashlib.sha256("{environment}\0{text}".format(environment=environment_name, text=text).encode("utf-8"))
+    key = key.hexdigest()
+
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    try:
+        application = json.loads(text)
+    except ValueError as e:
+        raise InvalidApplication("Application is not valid json: {error}".format(error=e))
+
+    environment = parse(application, environment_name)
+
+    with _lock:
+        _cache[key] = environment
+
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    return environment
+
+
+def parse(application, environment_name):
+    """
+    Parse and validate environment of application, all errors are reported at once
+    :param application: Application options
+    :param environment_name: Name of environment
+    :return: Returns Environment
+    """
+    errors = []
+
+    if not isinstance(application, dict):
+        raise InvalidApplication("Application must be object")
+
+    if not isinstance(application.get("name", ''), str) or not application.get("name", ''):
+        errors.append("name: application needs name")
+
+    environments = application.get("environments", {}) or {}
+    if not isinstance(environments, dict):
+        errors.append("environments: must be object")
+        environments = {}
+    elif environment_name not in environments:
+        errors.append("environments: unknown environment {name}, application has {names}".format(
+            name=environment_name or "''",
+            names=", ".join(sorted(environments)) or "no environments"
+        ))
+
+    options = environments.get(environment_name, {}) or {}
+    path = "environments.{name}".format(name=environment_name)
+
+    if not isinstance(options, dict):
+        errors.append("{path}: must be object".format(path=path))
+        options = {}
+
+    registries = parse_registries(options.get("registry", {}), path + ".registry", errors)
+
+    resources = options.get("resources", {}) or {}
+    if not isinstance(resources, dict):
+        errors.append("{path}.resources: must be object".format(path=path))
+        resources = {}
+
+    service_options = options.get("services", {}) or {}
+    if not isinstance(service_options, dict):
+        errors.append("{path}.services: must be object".format(path=path))
+        service_options = {}
+
+    services = OrderedDict()
+    for name, service in sorted(service_options.items()):
+        service = parse_service(name, service, registries, resources,
+                                "{path}.services.{name}".format(path=path, name=name), errors)
+
+        if service is not None:
+            services[name] = service
+
+    # Dependencies are checked even when some services are invalid, so all errors are reported at once
+    graph = None
+    try:
+        graph = Graph(dict((name, get_dependencies(service)) for name, service in service_options.items()))
+    except InvalidDependencies as e:
+        errors.append("{path}.services: {error}".format(path=path, error=e))
+
+    if errors:
+        raise InvalidApplication("\n".join(errors))
+
+    return Environment(application, environment_name, options, registries, services, graph)
+
+
+def parse_registries(options, path, errors):
+    registries = {}
+
+    if options is False or options is None:
+        return registries
+
+    if not isinstance(options, dict):
+        errors.append("{path}: must be object".format(path=path))
+        return registries
+
+    for name, registry in sorted(options.items()):
+        registry_path = "{path}.{name}".format(path=path, name=name)
+
+        if not isinstance(registry, dict):
+            errors.append("{path}: must be object".format(path=registry_path))
+            continue
+
+        if not is_integer(registry.get("port", 5000)):
+            errors.append("{path}.port: must be number".format(path=registry_path))
+            continue
+
+        if not is_integer(registry.get("connections", 2)) or int(registry.get("connections", 2)) < 1:
+            errors.append("{path}.connections: must be positive number".format(path=registry_path))
+            continue
+
+        registries[name] = Registry(name, registry)
+
+    return registries
+
+
+def parse_service(name, options, registries, resources, path, errors):
+    """
+    Parse service and collect its errors
+    :return: Returns Service or None if service is invalid
+    """
+    count = len(errors)
+
+    if not isinstance(options, dict):
+        errors.append("{path}: must be object".format(path=path))
+        return None
+
+    for key in ("image", "dockerfile", "context"):
+        if options.get(key) is not None and not isinstance(options.get(key), str):
+            errors.append("{path}.{key}: must be string".format(path=path, key=key))
+
+    for key in ("links", "depends_on"):
+        if not is_string_list(options.get(key, []) or []):
+            errors.append("{path}.{key}: must be list of strings".format(path=path, key=key))
+
+    if not isinstance(options.get("args", {}) or {}, dict):
+        errors.append("{path}.args: must be object".format(path=path))
+
+    proxy = options.get("proxy", {}) or {}
+    if not isinstance(proxy, dict):
+        errors.append("{path}.proxy: must be object".format(path=path))
+    elif proxy.get("method", "round_robin") not in LOAD_BALANCING_METHODS:
+        errors.append("{path}.proxy.method: unknown load balancing method {method}, supported are {methods}".format(
+            path=path,
+            method=proxy.get("method"),
+            methods=", ".join(LOAD_BALANCING_METHODS)
+        ))
+
+    replicas = options.get("replicas", options.get("scale", 1))
+    if not is_integer(replicas) or int(replicas) < 1:
+        errors.append("{path}.replicas: must be positive number".format(path=path))
+
+    try:
+        service_resources = get_resources(options, resources)
+    except InvalidResources as e:
+        errors.append("{path}: {error}".format(path=path, error=e))
+
+    repository = None
+    registry_urls = []
+    repository_options = options.get("repository", False)
+
+    if repository_options:
+        if not isinstance(repository_options, dict):
+            errors.append("{path}.repository: must be object".format(path=path))
+        else:
+            repository = parse_repository(repository_options, registries, path + ".repository", errors)
+
+    if repository is not None:
+        registry_urls = [registries[registry].url for registry in repository.registries]
+
+    if len(errors) > count:
+        return None
+
+    return Service(name, options, repository, get_dependencies(options), int(replicas), service_resources,
+                   registry_urls)
+
+
+def parse_repository(options, registries, path, errors):
+    count = len(errors)
+
+    if options.get("origin") is not None and not isinstance(options.get("origin"), str):
+        errors.append("{path}.origin: must be string".format(path=path))
+
+    image = options.get("image", {}) or {}
+    if not isinstance(image, dict):
+        errors.append("{path}.image: must be object".format(path=path))
+        image = {}
+
+    if options.get("origin") and not image.get("name"):
+        errors.append("{path}.image.name: built image needs name".format(path=path))
+
+    if not is_string_list(image.get("aliases", []) or []):
+        errors.append("{path}.image.aliases: must be list of strings".format(path=path))
+
+    names = options.get("registry", []) or []
+    if not is_string_list(names):
+        errors.append("{path}.registry: must be list of registry names".format(path=path))
+        names = []
+
+    for name in names:
+        if name not in registries:
+            errors.append("{path}.registry: unknown registry {name}".format(path=path, name=name))
+
+    return Repository(options) if len(errors) == count else None
+
+
+def get_dependencies(options):
+    """
+    Get services service depends on, through links with optional alias and depends_on,
+    invalid options are left out, they are reported by parse_service
+    :param options: Service options
+    :return: Returns set of names of services
+    """
+    if not isinstance(options, dict):
+        return set()
+
+    links = options.get("links", []) or []
+    depends_on = options.get("depends_on", []) or []
+
+    return set(link.split(":")[0] for link in links if is_string_list(links)) | \
+        set(depends_on if is_string_list(depends_on) else [])
+
+
+def is_integer(value):
+    if isinstance(value, bool):
+        return False
+
+    try:
+        return int(value) == float(value)
+    except (TypeError, ValueError):
+        return False
+
+
+def is_string_list(value):
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
@@ -0,0 +1,246 @@
+import os
+import hashlib
+import threading
+import functools
+import subprocess
+
+# Held while files of virtual hosts are changed and while configuration is tested, so every change
+# is either tested by a reload or waits for the next one
+lock = threading.RLock()
+
+
+@functools.lru_cache(maxsize=None)
+def get_template(directory, name):
+    """
+    Get compiled template, templates are compiled once per process
+    :param directory: Directory templates are loaded from
+    :param name: Name of template within directory
+    :return: Returns Template
+    """
+    # Only commands rendering templates pay for import of jinja
+    from jinja2 import Environment, FileSystemLoader
+
+    return Environment(loader=FileSystemLoader(directory)).get_template(name)
+
+
+def nginx(*arguments):
+    """
+    Run nginx, nginx is called from hooks often so it is run without sh
+    :param arguments: Arguments of nginx
+    :return: Returns tuple of bool and output of nginx
+    """
+    try:
+        process = subprocess.run(("nginx",) + arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError as e:
+        return False, "Command not found: {command}".format(command=e)
+
+    return process.returncode == 0, process.stdout.decode("utf-8", "replace")
+
+
+class NginxConfig(object):
+    """
+        Writes virtual host configurations of application, files are replaced
+        atomically and only when their content changed, previous content is kept
+        until reload accepts configuration
+    """
+
+    MARKER = "# Managed by tower, application: {application}\n"
+
+    def __init__(self, application, directory="/etc/nginx/conf.d"):
+        """
+        :param application: Slugified name of application owning written files
+        :param directory: Directory of virtual host configurations
+        """
+        self.application = application
+        self.directory = directory
+
+        # Previous content of files changed since last reload by name, None for new files
+        self.backups = {}
+
+    def write(self, name, content):
+        """
+        Write configuration if its content changed, file is written to temporary file and renamed
+        :param name: Name of file
+        :param content: Rendered configuration
+        :return: Returns bool, True if file changed
+        """
+        content = self.MARKER.format(application=self.application) + content
+        path = os.path.join(self.directory, name)
+
+        with lock:
+            if self.get_hash(path) == hashlib.sha256(content.encode("utf-8")).hexdigest():
+                return False
+
+            self.backup(name)
+            self.replace(name, content)
+
+        return True
+
+    def replace(self, name, content):
+        """
+        Replace file atomically
+        :param name: Name of file
+        :param content: Content of file
+        :return: Returns void
+        """
+        temporary = os.path.join(self.directory, ".{name}.tmp".format(name=name))
+        with open(temporary, "w") as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(temporary, os.path.join(self.directory, name))
+
+    def backup(self, name):
+        """
+        Keep content of file before its first change since last reload
+        :param name: Name of file
+        :return: Returns void
+        """
+        if name in self.backups:
+            return
+
+        try:
+            with open(os.path.join(self.directory, name)) as file:
+                self.backups[name] = file.read()
+        except OSError:
+            self.backups[name] = None
+
+    def commit(self):
+        """
+        Forget previous content of files, called when nginx accepted configuration
+        :return: Returns void
+        """
+        with lock:
+            self.backups = {}
+
+    def rollback(self):
+        """
+        Restore files changed since last reload, called when nginx rejected configuration
+        :return: Returns list of restored files
+        """
+        with lock:
+            for name, content in self.backups.items():
+                if content is None:
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except OSError:
+                        pass
+                else:
+                    self.replace(name, content)
+
+            restored = sorted(self.backups)
+            self.backups = {}
+
+        return restored
+
+    def prune(self, keep):
+        """
+        Remove files of application which were not written by current deploy
+        :param keep: Names of files to keep
+        :return: Returns list of removed files
+        """
+        marker = self.MARKER.format(application=self.application)
+        removed = []
+
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+
+            if name in keep or name.startswith(".") or not os.path.isfile(path):
+                continue
+
+            with open(path) as file:
+                if file.readline() != marker:
+                    continue
+
+            with lock:
+                self.backup(name)
+                os.remove(path)
+
+            removed.append(name)
+
+        return removed
+
+    @staticmethod
+    def get_hash(path):
+        try:
+            with open(path, "rb") as file:
+                return hashlib.sha256(file.read()).hexdigest()
+        except OSError:
+            return None
+
+    @staticmethod
+    def test():
+        """
+        Validate configuration of nginx
+        :return: Returns tuple of bool and output of nginx
+        """
+        return nginx("-t")
+
+
+class Reloader(object):
+    """
+        Debounced reload of nginx, requests made within delay are served by a single
+        reload which is done only when configuration is valid, otherwise changes of
+        configurations of the batch are rolled back
+    """
+
+    def __init__(self, delay=0.5):
+        """
+        :param delay: Seconds to wait for other requests before reloading
+        """
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.timer = None
+        self.done = None
+        self.configs = []
+
+    def request(self, config=None):
+        """
+        Request reload
+        :param config: NginxConfig with changes tested by reload
+        :return: Returns event which is set once reload is done
+        """
+        with self.lock:
+            if self.timer is None:
+                self.done = threading.Event()
+                self.configs = []
+                self.timer = threading.Timer(self.delay, self.run, args=(self.done, self.configs))
+                self.timer.daemon = True
+                self.timer.start()
+
+            if config is not None and config not in self.configs:
+                self.configs.append(config)
+
+            return self.done
+
+    def reload(self, config=None):
+        """
+        Request reload and wait for it
+        :param config: NginxConfig with changes tested by reload
+        :return: Returns tuple of bool and output of nginx
+        """
+        done = self.request(config)
+        done.wait()
+        return done.result
+
+    def run(self, done, configs):
+        with self.lock:
+            self.timer = None
+
+        with lock:
+            valid, output = NginxConfig.test()
+
+            if valid:
+                for config in configs:
+                    config.commit()
+
+                valid, reload_output = nginx("-s", "reload")
+                output = output if valid else reload_output
+            else:
+                # Invalid file would fail every later reload of host, previous configuration is restored
+                for config in configs:
+                    config.rollback()
+
+        done.result = (valid, output)
+        done.set()
@@ -0,0 +1,384 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import contextlib
+
+
+class Slot(object):
+    """
+        Running job of scheduler
+    """
+
+    def __init__(self, job_id, coalesced=False, result=None):
+        """
+        :param job_id: Id of job in queue
+        :param coalesced: Job waited for identical job which ran before it
+        :param result: Result of identical job, job doesn't need to run when it is set
+        """
+        self.id = job_id
+        self.coalesced = coalesced
+
+        # Result stored with job, identical jobs waiting for this one reuse it, must be serializable to json
+        self.result = result
+
+
+class Heartbeat(threading.Thread):
+    """
+        Renews lease of job while process works on it, jobs with expired lease are released
+    """
+
+    def __init__(self, scheduler, job_id):
+        super().__init__(daemon=True)
+        self.scheduler = scheduler
+        self.job_id = job_id
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.scheduler.lease / 4):
+            try:
+                self.scheduler.renew(self.job_id)
+            except sqlite3.Error:
+                continue
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class Scheduler(object):
+    """
+        Queue of builder and agent jobs shared by all tower processes of host, queue is kept in SQLite
+        database so limits hold across processes and jobs of crashed processes are released once their
+        lease expires, processes may run in different containers sharing the database
+    """
+
+    # Priorities, jobs with lower priority run first
+    DEPLOY = 0
+    BUILD = 10
+
+    PENDING = 'pending'
+    WAITING = 'waiting'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            application TEXT NOT NULL,
+            key TEXT,
+            priority INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            pid INTEGER NOT NULL,
+            created REAL NOT NULL,
+            started REAL,
+            finished REAL,
+            heartbeat REAL,
+            result TEXT
+        );
+        CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, priority, id);
+        CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, status);
+        CREATE TABLE IF NOT EXISTS durations (
+            kind TEXT NOT NULL,
+            application TEXT NOT NULL,
+            service TEXT NOT NULL,
+            duration REAL NOT NULL,
+            updated REAL NOT NULL,
+            PRIMARY KEY (kind, application, service)
+        );
+    """
+
+    # Weight of last duration in moving average of service durations
+    DURATION_WEIGHT = 0.3
+
+    # Columns added to databases created by previous versions
+    COLUMNS = (("heartbeat", "REAL"), ("result", "TEXT"))
+
+    def __init__(self, path="/storage/tower/scheduler.db", limit=4, application_limit=None, interval=0.2,
+                 max_interval=2.0, history=86400, lease=60.0):
+        """
+        :param path: Path of database
+        :param limit: Maximal number of running jobs of host
+        :param application_limit: Maximal number of running jobs of application, None for no limit
+        :param interval: Seconds before first check of queue, doubled after each check
+        :param max_interval: Maximal number of seconds between checks of queue
+        :param history: Seconds finished jobs are kept
+        :param lease: Seconds job is kept without renewal by its process
+        """
+        self.path = path
+        self.limit = max(int(limit), 1)
+        self.application_limit = max(int(application_limit), 1) if application_limit else None
+        self.interval = interval
+        self.max_interval = max_interval
+        self.history = history
+        self.lease = lease
+
+        # Seconds connection waits for busy database, renewal has to get through well within lease
+        self.timeout = lease / 4
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        try:
+            # Readers don't block writers of other processes
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(self.SCHEMA)
+
+            columns = set(row[1] for row in connection.execute("PRAGMA table_info(jobs)").fetchall())
+            for name, column_type in self.COLUMNS:
+                if name not in columns:
+                    connection.execute("ALTER TABLE jobs ADD COLUMN {name} {type}".format(name=name, type=column_type))
+        finally:
+            connection.close()
+
+    @classmethod
+    def from_environment(cls, environment):
+        """
+        Create scheduler configured by TOWER_SCHEDULER_DB, TOWER_MAX_JOBS, TOWER_MAX_APPLICATION_JOBS
+        and TOWER_JOB_LEASE
+        :param environment: Environment of command
+        :return: Returns Scheduler
+        """
+        return cls(
+            path=environment.get("TOWER_SCHEDULER_DB", '') or "/storage/tower/scheduler.db",
+            limit=environment.get("TOWER_MAX_JOBS", '') or 4,
+            application_limit=environment.get("TOWER_MAX_APPLICATION_JOBS", '') or None,
+            lease=float(environment.get("TOWER_JOB_LEASE", '') or 60)
+        )
+
+    @contextlib.contextmanager
+    def slot(self, kind, application, key=None, priority=BUILD):
+        """
+        Wait until job may run and hold its slot, identical jobs wait for the first one to finish and get
+        its result, they run only when it failed or left no result
+        :param kind: Kind of job, e.g. build or deploy
+        :param application: Name of application
+        :param key: Jobs with the same key are identical, None if job can't be coalesced
+        :param priority: Priority of job, DEPLOY or BUILD
+        :return: Returns Slot
+        """
+        job_id, leader = self.submit(kind, application, key, priority)
+        heartbeat = Heartbeat(self, job_id)
+        heartbeat.start()
+
+        slot = None
+        try:
+            if leader is not None:
+                status, result = self.wait_for(leader)
+
+                if status == self.DONE and result is not None:
+                    slot = Slot(job_id, coalesced=True, result=result)
+                else:
+                    self.update(job_id, self.PENDING)
+
+            if slot is None:
+                self.wait_for_slot(job_id)
+                slot = Slot(job_id)
+        except BaseException:
+            heartbeat.stop()
+            self.finish(job_id, self.FAILED)
+            raise
+
+        status = self.FAILED
+        try:
+            yield slot
+            status = self.DONE
+        finally:
+            heartbeat.stop()
+            self.finish(job_id, status, slot.result)
+
+    def submit(self, kind, application, key, priority):
+        """
+        Add job to queue
+        :return: Returns tuple of job id and id of identical job it waits for or None
+        """
+        with self.transaction() as connection:
+            self.release_stale(connection)
+
+            leader = None
+            if key is not None:
+                row = connection.execute(
+                    "SELECT id FROM jobs WHERE key = ? AND status IN (?, ?) ORDER BY id LIMIT 1",
+                    (key, self.PENDING, self.RUNNING)
+                ).fetchone()
+                leader = row[0] if row else None
+
+            cursor = connection.execute(
+                "INSERT INTO jobs (kind, application, key, priority, status, pid, created, heartbeat) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, application, key, priority, self.WAITING if leader else self.PENDING, os.getpid(), time.time(),
+                 time.time())
+            )
+
+            return cursor.lastrowid, leader
+
+    def wait_for(self, job_id):
+        """
+        Wait until job is finished
+        :param job_id: Id of job
+        :return: Returns tuple of status and result of job
+        """
+        interval = self.interval
+
+        while True:
+            with self.transaction() as connection:
+                self.release_stale(connection)
+                row = connection.execute("SELECT status, result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+            if row is None:
+                return self.FAILED, None
+
+            if row[0] in (self.DONE, self.FAILED):
+                return row[0], json.loads(row[1]) if row[1] else None
+
+            time.sleep(interval)
+            interval = min(interval * 2, self.max_interval)
+
+    def wait_for_slot(self, job_id):
+        interval = self.interval
+
+        while not self.try_start(job_id):
+            time.sleep(interval)
+            interval = min(interval * 2, self.max_interval)
+
+    def try_start(self, job_id):
+        """
+        Start job if limits allow it and no pending job goes before it
+        :param job_id: Id of job
+        :return: Returns bool, True if job was started
+        """
+        with self.transaction() as connection:
+            self.release_stale(connection)
+
+            # Job released while its renewal waited for busy database goes back to queue at its place,
+            # otherwise it would never be pending again
+            row = connection.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is not None and row[0] == self.FAILED:
+                connection.execute("UPDATE jobs SET status = ?, finished = NULL, heartbeat = ? WHERE id = ?",
+                                   (self.PENDING, time.time(), job_id))
+
+            running = dict(connection.execute(
+                "SELECT application, COUNT(*) FROM jobs WHERE status = ? GROUP BY application", (self.RUNNING,)
+            ).fetchall())
+
+            if sum(running.values()) >= self.limit:
+                return False
+
+            # First pending job whose application is within its limit goes next
+            for pending_id, application in connection.execute(
+                "SELECT id, application FROM jobs WHERE status = ? ORDER BY priority, id", (self.PENDING,)
+            ).fetchall():
+                if self.application_limit and running.get(application, 0) >= self.application_limit:
+                    continue
+
+                if pending_id != job_id:
+                    return False
+
+                connection.execute("UPDATE jobs SET status = ?, started = ? WHERE id = ?",
+                                   (self.RUNNING, time.time(), job_id))
+                return True
+
+            return False
+
+    def update(self, job_id, status):
+        with self.transaction() as connection:
+            connection.execute("UPDATE jobs SET status = ? WHERE id = ?", (status, job_id))
+
+    def renew(self, job_id):
+        with self.transaction() as connection:
+            connection.execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (time.time(), job_id))
+
+    def finish(self, job_id, status, result=None):
+        with self.transaction() as connection:
+            connection.execute("UPDATE jobs SET status = ?, finished = ?, result = ? WHERE id = ?",
+                               (status, time.time(), json.dumps(result) if result is not None else None, job_id))
+            connection.execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished < ?",
+                               (self.DONE, self.FAILED, time.time() - self.history))
+
+    def jobs(self):
+        """
+        Get jobs which are not finished
+        :return: Returns list of dicts
+        """
+        with self.transaction() as connection:
+            self.release_stale(connection)
+            rows = connection.execute(
+                "SELECT id, kind, application, key, priority, status, pid, created, started FROM jobs "
+                "WHERE status IN (?, ?, ?) ORDER BY priority, id", (self.PENDING, self.WAITING, self.RUNNING)
+            ).fetchall()
+
+        columns = ("id", "kind", "application", "key", "priority", "status", "pid", "created", "started")
+        return [dict(zip(columns, row)) for row in rows]
+
+    def get_durations(self, kind, application):
+        """
+        Get average durations of services of application
+        :param kind: Kind of job, e.g. deploy or down
+        :param application: Name of application
+        :return: Returns dict of seconds by service name
+        """
+        with self.transaction() as connection:
+            return dict(connection.execute(
+                "SELECT service, duration FROM durations WHERE kind = ? AND application = ?", (kind, application)
+            ).fetchall())
+
+    def record_duration(self, kind, application, service, duration):
+        """
+        Add duration of service to its moving average
+        :param kind: Kind of job, e.g. deploy or down
+        :param application: Name of application
+        :param service: Name of service
+        :param duration: Seconds service took
+        :return: Returns void
+        """
+        with self.transaction() as connection:
+            row = connection.execute(
+                "SELECT duration FROM durations WHERE kind = ? AND application = ? AND service = ?",
+                (kind, application, service)
+            ).fetchone()
+
+            if row is not None:
+                duration = row[0] + (duration - row[0]) * self.DURATION_WEIGHT
+
+            connection.execute(
+                "INSERT OR REPLACE INTO durations (kind, application, service, duration, updated) VALUES (?, ?, ?, ?, ?)",
+                (kind, application, service, duration, time.time())
+            )
+
+    def release_stale(self, connection):
+        """
+        Fail jobs whose lease expired, their process stopped or lost access to database, pids can't be
+        checked because processes of other containers share the database
+        :param connection: Connection in transaction
+        :return: Returns void
+        """
+        connection.execute(
+            "UPDATE jobs SET status = ?, finished = ? WHERE status IN (?, ?, ?) AND COALESCE(heartbeat, created) < ?",
+            (self.FAILED, time.time(), self.PENDING, self.WAITING, self.RUNNING, time.time() - self.lease)
+        )
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Open connection with immediate transaction, queue is locked until transaction ends
+        :return: Returns connection
+        """
+        connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
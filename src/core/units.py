@@ -0,0 +1,51 @@
+import re
+
+SIZE_UNITS = {
+    '': 1,
+    'b': 1,
+    'k': 1024,
+    'kb': 1024,
+    'm': 1024 ** 2,
+    'mb': 1024 ** 2,
+    'g': 1024 ** 3,
+    'gb': 1024 ** 3,
+    't': 1024 ** 4,
+    'tb': 1024 ** 4,
+}
+
+SIZE_PATTERN = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([a-zA-Z]*)\s*$')
+
+
+def parse_size(value):
+    """
+    Parse size in docker format, e.g. 512m, 1.5g or number of bytes
+    :param value: Size as string or number
+    :return: Returns int number of bytes or None if value is empty
+    """
+    if value is None or value == '':
+        return None
+
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    match = SIZE_PATTERN.match(str(value))
+    unit = match.group(2).lower() if match else ''
+
+    if not match or unit not in SIZE_UNITS:
+        raise ValueError("Invalid size: {value}".format(value=value))
+
+    return int(float(match.group(1)) * SIZE_UNITS[unit])
+
+
+def format_size(size):
+    """
+    Format number of bytes for humans
+    :param size: Number of bytes
+    :return: Returns string, e.g. 1.5 MB
+    """
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return "{size:.1f} {unit}".format(size=size, unit=unit)
+        size /= 1024.0
+
+    return "{size:.1f} TB".format(size=size)
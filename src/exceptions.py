@@ -9,3 +9,36 @@ class FailedToCloneRepository(Exception):
 class FailedToLoginToRegistry(Exception):
     pass
 
+
+class FailedToPushImage(Exception):
+    pass
+
+
+class FailedToPullImage(Exception):
+    pass
+
+
+class FailedToDeployService(Exception):
+    pass
+
+
+class InvalidDependencies(Exception):
+    pass
+
+
+class InvalidResources(Exception):
+    pass
+
+
+class InvalidApplication(Exception):
+    pass
+
+
+class InvalidConfiguration(Exception):
+    pass
+
+
+class DockerAPIError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
@@ -1,3 +1,9 @@
+import sys
+import time
+
+# Startup is measured from here, reported by --profile-startup
+started = time.perf_counter()
+
 import signal
 from cement.core.exc import CaughtSignal
 from cement.core.foundation import CementApp
@@ -5,6 +11,11 @@ from src.controller.builder_controller import BuilderController
 from src.controller.agent_controller import AgentController
 from src.controller.tower_controller import TowerController
 from src.controller.nginx_controller import NginxController
+from src.controller.daemon_controller import DaemonController
+
+imported = time.perf_counter()
+
+PROFILE_STARTUP = "--profile-startup"
 
 
 class Tower(CementApp):
@@ -14,17 +25,56 @@ class Tower(CementApp):
             TowerController,
             BuilderController,
             AgentController,
-            NginxController
+            NginxController,
+            DaemonController
         ]
 
 
 def main():
-    with Tower() as app:
-        try:
-            app.run()
-        except CaughtSignal as e:
-            if e.signum == signal.SIGINT:
-                print("Stoping...")
+    # Flag is handled before cement so it works with every command
+    profile = PROFILE_STARTUP in sys.argv
+    if profile:
+        sys.argv.remove(PROFILE_STARTUP)
+
+    initialized = None
+
+    # Commands return False when they fail
+    result = None
+
+    try:
+        with Tower() as app:
+            initialized = time.perf_counter()
+
+            try:
+                result = app.run()
+            except CaughtSignal as e:
+                if e.signum == signal.SIGINT:
+                    print("Stoping...")
+    finally:
+        if profile:
+            print_startup_profile(initialized)
+
+    if result is False:
+        sys.exit(1)
+
+
+def print_startup_profile(initialized):
+    """
+    Print time spent importing modules, initializing application and running command
+    :param initialized: Time application was initialized at, None if it failed
+    :return: Returns void
+    """
+    finished = time.perf_counter()
+    initialized = initialized or finished
+
+    print("===> Startup: imports {imports:.1f} ms, init {init:.1f} ms, command {command:.1f} ms, "
+          "total {total:.1f} ms, {modules} modules loaded".format(
+              imports=(imported - started) * 1000,
+              init=(initialized - imported) * 1000,
+              command=(finished - initialized) * 1000,
+              total=(finished - started) * 1000,
+              modules=len(sys.modules)
+          ), file=sys.stderr)
 
 
 if __name__ == '__main__':